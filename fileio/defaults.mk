@@ -46,6 +46,19 @@ TMPFS_CHECK ?= -1
 #   make check TMPFS_PERF=1
 TMPFS_PERF ?= -1
 
+# BUDGET:  Seconds to spend on the performance tests; extra trials go
+# to the tests whose results are least certain
+# Default:  (see test_scripts/defaults.py)
+# To set the budget for one run, run with:
+#   make perf BUDGET=120
+BUDGET ?= -1
+
+# TRACE:  Show histograms of the system calls made by the performance
+# test programs (see io300_trace.c)
+# To enable, run with:
+#   make perf TRACE=1
+TRACE ?= 0
+
 ifneq ($(SEED), -1)
 	TESTFLAGS += --seed=$(SEED)
 endif
@@ -59,6 +72,13 @@ ifneq ($(JSON),-1)
 	TESTFLAGS += --json=$(JSON)
 endif
 
+ifneq ($(BUDGET),-1)
+	TESTFLAGS += --perf-time-budget=$(BUDGET)
+endif
+ifeq ($(TRACE),1)
+	TESTFLAGS += --perf-trace-syscalls
+endif
+
 ifeq ($(TMPFS),1)
 	TMPFS_CHECK = 1
 	TMPFS_PERF = 1
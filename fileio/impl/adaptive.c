@@ -0,0 +1,19 @@
+/*
+    adaptive.c
+
+    The multi-slot LRU cache from lru.c with adaptive readahead turned
+    on.  The cache classifies the access stream as sequential, reverse
+    or strided from the distance between consecutive accesses, and on
+    each miss loads up to CACHE_READAHEAD pages on the side of the
+    current position that the stream is moving towards.  Reverse readers
+    like reverse_byte_cat therefore refill about as rarely as byte_cat.
+
+    The readahead window can be set at compile time, e.g.:
+       $ CFLAGS="-DCACHE_SIZE=4096 -DCACHE_READAHEAD=16" make -B IMPL=adaptive
+*/
+
+#ifndef CACHE_READAHEAD
+#define CACHE_READAHEAD 8
+#endif
+
+#include "lru.c"
@@ -0,0 +1,572 @@
+#define _GNU_SOURCE
+#include <assert.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <unistd.h>
+
+#include "../io300.h"
+
+/*
+    async.c
+
+    This implementation caches one CACHE_SIZE-byte window of the file at
+    a time, like a single-buffer cache, but hands the slow parts to a
+    background I/O thread:
+
+    - readahead:  whenever the window moves, the thread starts reading
+      the neighbouring window (in the direction the reader is moving)
+      into a spare buffer, so the next refill is usually a buffer swap;
+    - write-behind:  a modified window is queued for the thread to write
+      back, and the caller carries on with a fresh buffer.
+
+    The thread runs jobs strictly in the order they were queued, so a
+    read queued after a write-back of the same window sees the new data.
+    io300_close waits for every queued write to finish.
+
+    In the statistics, every window read (readahead or not) is a
+    refill, and an access that needs the window to move is a miss even
+    if the readahead already has the new window ready.
+*/
+
+#ifndef CACHE_SIZE
+#define CACHE_SIZE 8
+#endif
+
+#if (CACHE_SIZE < 4)
+#error "internal cache size should not be below 4."
+#endif
+
+/* One current window, one readahead window, the rest for write-behind */
+#define NUM_BUFFERS 4
+
+#define NO_BUFFER (-1)
+
+enum buffer_state {
+    /* unused */
+    BUF_FREE,
+    /* the window the caller is using */
+    BUF_CURRENT,
+    /* queued for (or being) filled by the I/O thread */
+    BUF_READING,
+    /* filled by a readahead, not used yet */
+    BUF_READY,
+    /* readahead no longer wanted:  free it once the read completes */
+    BUF_STALE,
+    /* queued for (or being) written back by the I/O thread */
+    BUF_WRITING,
+};
+
+struct window {
+    enum buffer_state state;
+    /* file offset of the first byte in the window (a multiple of CACHE_SIZE) */
+    off_t start;
+    /* bytes [dirty_lo, dirty_hi) were modified by the caller */
+    size_t dirty_lo;
+    size_t dirty_hi;
+    char* data;
+};
+
+struct io300_file {
+    /* read,write,seek all take a file descriptor as a parameter */
+    int fd;
+    /* nonzero if the file was opened for writing */
+    int writable;
+
+    /* current file position */
+    off_t pos;
+    /* logical size of the file, including data not yet written back */
+    off_t size;
+    /* size of the file once every queued write-back has completed */
+    off_t queued_size;
+
+    /* index of the BUF_CURRENT window, or NO_BUFFER */
+    int current;
+    /* start of the previous current window, to tell which way we move */
+    off_t last_start;
+
+    char* cache;
+    struct window windows[NUM_BUFFERS];
+
+    /* Everything below is shared with the I/O thread */
+    pthread_t thread;
+    pthread_mutex_t lock;
+    pthread_cond_t cond;
+    /* FIFO of window indices with a pending read or write */
+    int queue[NUM_BUFFERS];
+    int queue_head;
+    int queue_len;
+    /* set by the I/O thread if a read or write failed */
+    int error;
+    /* tells the I/O thread to exit once the queue is empty */
+    int stopping;
+    /* the I/O thread adds its system calls here, with the lock held */
+    struct io300_stats stats;
+
+    /* Used for debugging, keep track of which io300_file is which */
+    char* description;
+};
+
+static void check_invariants(struct io300_file* f) {
+    assert(f != NULL);
+    assert(f->cache != NULL);
+    assert(f->fd >= 0);
+    assert(f->pos >= 0);
+    assert(f->current == NO_BUFFER
+           || f->windows[f->current].state == BUF_CURRENT);
+}
+
+/*
+ *  Read or write back window `w` (on the I/O thread, without the lock
+ *  held), counting the system calls in `io`.  Returns 0 on success, -1
+ *  on failure.
+ */
+static int do_io(struct io300_file* f, struct window* w, enum buffer_state op,
+                 struct io300_stats* io) {
+    if (op == BUF_READING) {
+        size_t got = 0;
+        while (got < CACHE_SIZE) {
+            io->read_calls++;
+            ssize_t const n = pread(f->fd, w->data + got, CACHE_SIZE - got,
+                                    w->start + got);
+            if (n == -1) {
+                return -1;
+            } else if (n == 0) {
+                break;
+            }
+            io->bytes_read += n;
+            got += n;
+        }
+        memset(w->data + got, 0, CACHE_SIZE - got);
+    } else {
+        size_t done = w->dirty_lo;
+        while (done < w->dirty_hi) {
+            io->write_calls++;
+            ssize_t const n = pwrite(f->fd, w->data + done, w->dirty_hi - done,
+                                     w->start + done);
+            if (n <= 0) {
+                return -1;
+            }
+            io->bytes_written += n;
+            done += n;
+        }
+        w->dirty_lo = w->dirty_hi = 0;
+    }
+    return 0;
+}
+
+static void* io_thread(void* arg) {
+    struct io300_file* f = arg;
+
+    pthread_mutex_lock(&f->lock);
+    while (1) {
+        while (f->queue_len == 0 && !f->stopping) {
+            pthread_cond_wait(&f->cond, &f->lock);
+        }
+        if (f->queue_len == 0) {
+            break;
+        }
+
+        struct window* w = &f->windows[f->queue[f->queue_head]];
+        enum buffer_state const op = w->state == BUF_WRITING ? BUF_WRITING : BUF_READING;
+        pthread_mutex_unlock(&f->lock);
+
+        struct io300_stats io = {0};
+        int const r = do_io(f, w, op, &io);
+
+        pthread_mutex_lock(&f->lock);
+        f->stats.read_calls += io.read_calls;
+        f->stats.write_calls += io.write_calls;
+        f->stats.bytes_read += io.bytes_read;
+        f->stats.bytes_written += io.bytes_written;
+        if (r == -1) {
+            f->error = 1;
+        }
+        if (w->state == BUF_READING) {
+            w->state = BUF_READY;
+        } else {
+            // Finished write-backs and unwanted readaheads
+            w->state = BUF_FREE;
+        }
+        f->queue_head = (f->queue_head + 1) % NUM_BUFFERS;
+        f->queue_len--;
+        pthread_cond_broadcast(&f->cond);
+    }
+    pthread_mutex_unlock(&f->lock);
+    return NULL;
+}
+
+/* Queue window `i` for the I/O thread.  Call with the lock held. */
+static void enqueue(struct io300_file* f, int i) {
+    f->queue[(f->queue_head + f->queue_len) % NUM_BUFFERS] = i;
+    f->queue_len++;
+    pthread_cond_broadcast(&f->cond);
+}
+
+/*
+ *  Find a free window, waiting for a write-back to finish if there is
+ *  none.  Call with the lock held.
+ */
+static int take_free_window(struct io300_file* f) {
+    while (1) {
+        for (int i = 0; i < NUM_BUFFERS; i++) {
+            if (f->windows[i].state == BUF_FREE) {
+                return i;
+            }
+        }
+        pthread_cond_wait(&f->cond, &f->lock);
+    }
+}
+
+/*
+ *  Stop using the current window, queueing it for write-back if it was
+ *  modified.  Call with the lock held.
+ */
+static void retire_current(struct io300_file* f) {
+    if (f->current == NO_BUFFER) {
+        return;
+    }
+    struct window* w = &f->windows[f->current];
+    if (w->dirty_hi > 0) {
+        f->stats.flushes++;
+        w->state = BUF_WRITING;
+        if (w->start + (off_t)w->dirty_hi > f->queued_size) {
+            f->queued_size = w->start + w->dirty_hi;
+        }
+        enqueue(f, f->current);
+    } else {
+        w->state = BUF_FREE;
+    }
+    f->current = NO_BUFFER;
+}
+
+/*
+ *  Start reading the window at `start` ahead of time, if it exists on
+ *  disk and a buffer is free.  Call with the lock held.
+ */
+static void start_readahead(struct io300_file* f, off_t start) {
+    if (start < 0 || start >= f->queued_size) {
+        return;
+    }
+    for (int i = 0; i < NUM_BUFFERS; i++) {
+        if (f->windows[i].state == BUF_FREE) {
+            f->stats.refills++;
+            f->windows[i].state = BUF_READING;
+            f->windows[i].start = start;
+            f->windows[i].dirty_lo = f->windows[i].dirty_hi = 0;
+            enqueue(f, i);
+            return;
+        }
+    }
+}
+
+/*
+ *  Make the window containing `pos` the current window.
+ *  Returns 0 on success, -1 on failure.
+ */
+static int move_window(struct io300_file* f, off_t pos) {
+    off_t const start = pos - pos % CACHE_SIZE;
+
+    pthread_mutex_lock(&f->lock);
+    retire_current(f);
+
+    // Use the readahead window if it is the one we need; drop it otherwise
+    int found = NO_BUFFER;
+    for (int i = 0; i < NUM_BUFFERS; i++) {
+        struct window* w = &f->windows[i];
+        if (w->state != BUF_READING && w->state != BUF_READY) {
+            continue;
+        }
+        if (w->start == start) {
+            while (w->state == BUF_READING) {
+                pthread_cond_wait(&f->cond, &f->lock);
+            }
+            found = i;
+        } else {
+            w->state = w->state == BUF_READY ? BUF_FREE : BUF_STALE;
+        }
+    }
+
+    if (found == NO_BUFFER) {
+        found = take_free_window(f);
+        struct window* w = &f->windows[found];
+        w->start = start;
+        w->dirty_lo = w->dirty_hi = 0;
+        if (start < f->queued_size) {
+            // Read it through the queue so earlier write-backs land first
+            f->stats.refills++;
+            w->state = BUF_READING;
+            enqueue(f, found);
+            while (w->state == BUF_READING) {
+                pthread_cond_wait(&f->cond, &f->lock);
+            }
+        } else {
+            memset(w->data, 0, CACHE_SIZE);
+        }
+    }
+
+    f->windows[found].state = BUF_CURRENT;
+    f->current = found;
+
+    if (start < f->last_start) {
+        start_readahead(f, start - CACHE_SIZE);
+    } else {
+        start_readahead(f, start + CACHE_SIZE);
+    }
+    f->last_start = start;
+
+    int const error = f->error;
+    pthread_mutex_unlock(&f->lock);
+    return error ? -1 : 0;
+}
+
+/*
+ *  Return the current window, moving it to cover f->pos if needed.
+ *  Returns NULL on failure.
+ */
+static struct window* window_at_pos(struct io300_file* f) {
+    if (f->current != NO_BUFFER) {
+        struct window* w = &f->windows[f->current];
+        if (f->pos >= w->start && f->pos < w->start + CACHE_SIZE) {
+            f->stats.hits++;
+            return w;
+        }
+    }
+    f->stats.misses++;
+    if (move_window(f, f->pos) == -1) {
+        return NULL;
+    }
+    return &f->windows[f->current];
+}
+
+struct io300_file* io300_open(const char* const path, int mode, char* description) {
+    if (path == NULL) {
+        fprintf(stderr, "error: null file path\n");
+        return NULL;
+    }
+
+    int flags = O_CREAT | O_SYNC;
+    switch(mode) {
+    case MODE_READ:
+        flags |= O_RDONLY;
+        break;
+    case MODE_WRITE:
+        flags |= O_RDWR | O_TRUNC;
+        break;
+    case (MODE_READ|MODE_WRITE):
+        flags |= O_RDWR;
+        break;
+    default:
+        fprintf(stderr, "error: invalid file mode %02x\n", mode);
+        return NULL;
+    }
+
+    int const fd = open(path, flags, S_IRUSR | S_IWUSR);
+    if (fd == -1) {
+        fprintf(stderr, "error: could not open file: `%s`: %s\n", path,
+                strerror(errno));
+        return NULL;
+    }
+
+    struct stat st;
+    if (fstat(fd, &st) == -1 || !S_ISREG(st.st_mode)) {
+        fprintf(stderr, "error: %s is not a regular file\n", path);
+        close(fd);
+        return NULL;
+    }
+
+    struct io300_file* const ret = malloc(sizeof(*ret));
+    if (ret == NULL) {
+        fprintf(stderr, "error: could not allocate io300_file\n");
+        close(fd);
+        return NULL;
+    }
+
+    ret->cache = malloc((size_t)NUM_BUFFERS * CACHE_SIZE);
+    if (ret->cache == NULL) {
+        fprintf(stderr, "error: could not allocate file cache\n");
+        close(fd);
+        free(ret);
+        return NULL;
+    }
+
+    ret->fd = fd;
+    ret->writable = (mode & MODE_WRITE) != 0;
+    ret->pos = 0;
+    ret->size = st.st_size;
+    ret->queued_size = st.st_size;
+    ret->current = NO_BUFFER;
+    ret->last_start = 0;
+    for (int i = 0; i < NUM_BUFFERS; i++) {
+        ret->windows[i].state = BUF_FREE;
+        ret->windows[i].start = 0;
+        ret->windows[i].dirty_lo = ret->windows[i].dirty_hi = 0;
+        ret->windows[i].data = ret->cache + (size_t)i * CACHE_SIZE;
+    }
+    ret->queue_head = 0;
+    ret->queue_len = 0;
+    ret->error = 0;
+    ret->stopping = 0;
+    ret->stats = (struct io300_stats){0};
+    ret->description = description;
+
+    pthread_mutex_init(&ret->lock, NULL);
+    pthread_cond_init(&ret->cond, NULL);
+    if (pthread_create(&ret->thread, NULL, io_thread, ret) != 0) {
+        fprintf(stderr, "error: could not start I/O thread\n");
+        pthread_cond_destroy(&ret->cond);
+        pthread_mutex_destroy(&ret->lock);
+        close(fd);
+        free(ret->cache);
+        free(ret);
+        return NULL;
+    }
+
+    // Get the first window on its way before the caller asks for it
+    pthread_mutex_lock(&ret->lock);
+    start_readahead(ret, 0);
+    pthread_mutex_unlock(&ret->lock);
+
+    check_invariants(ret);
+    return ret;
+}
+
+int io300_close(struct io300_file* const f) {
+    check_invariants(f);
+
+    // Queue the last write-back and let the I/O thread drain the queue
+    pthread_mutex_lock(&f->lock);
+    retire_current(f);
+    f->stopping = 1;
+    pthread_cond_broadcast(&f->cond);
+    pthread_mutex_unlock(&f->lock);
+    pthread_join(f->thread, NULL);
+
+    int const ret = f->error ? -1 : 0;
+    io300_report_stats(&f->stats);
+
+    pthread_cond_destroy(&f->cond);
+    pthread_mutex_destroy(&f->lock);
+    close(f->fd);
+    free(f->cache);
+    free(f);
+    return ret;
+}
+
+off_t io300_filesize(struct io300_file* const f) {
+    check_invariants(f);
+    return f->size;
+}
+
+int io300_seek(struct io300_file* const f, off_t const pos) {
+    check_invariants(f);
+    if (pos < 0) {
+        return -1;
+    }
+    f->pos = pos;
+    return pos;
+}
+
+int io300_readc(struct io300_file* const f) {
+    check_invariants(f);
+    if (f->pos >= f->size) {
+        return -1;
+    }
+
+    struct window* w = window_at_pos(f);
+    if (w == NULL) {
+        return -1;
+    }
+    unsigned char const c = w->data[f->pos - w->start];
+    f->pos++;
+    return c;
+}
+
+int io300_writec(struct io300_file* f, int ch) {
+    char const c = (char)ch;
+    return io300_write(f, &c, 1) == 1 ? (unsigned char)c : -1;
+}
+
+ssize_t io300_read(struct io300_file* const f, char* const buff,
+                   size_t const sz) {
+    check_invariants(f);
+    if (f->pos >= f->size) {
+        return 0;
+    }
+
+    size_t total = sz;
+    if ((off_t)total > f->size - f->pos) {
+        total = f->size - f->pos;
+    }
+
+    size_t done = 0;
+    while (done < total) {
+        struct window* w = window_at_pos(f);
+        if (w == NULL) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos - w->start;
+        size_t n = CACHE_SIZE - off;
+        if (n > total - done) {
+            n = total - done;
+        }
+        memcpy(buff + done, w->data + off, n);
+        done += n;
+        f->pos += n;
+    }
+    return done;
+}
+
+ssize_t io300_write(struct io300_file* const f, const char* buff,
+                    size_t const sz) {
+    check_invariants(f);
+    if (!f->writable) {
+        return -1;
+    }
+
+    size_t done = 0;
+    while (done < sz) {
+        struct window* w = window_at_pos(f);
+        if (w == NULL) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos - w->start;
+        size_t n = CACHE_SIZE - off;
+        if (n > sz - done) {
+            n = sz - done;
+        }
+        memcpy(w->data + off, buff + done, n);
+
+        if (w->dirty_hi == 0) {
+            w->dirty_lo = off;
+            w->dirty_hi = off + n;
+        } else {
+            if (off < w->dirty_lo) {
+                w->dirty_lo = off;
+            }
+            if (off + n > w->dirty_hi) {
+                w->dirty_hi = off + n;
+            }
+        }
+
+        done += n;
+        f->pos += n;
+        if (f->pos > f->size) {
+            f->size = f->pos;
+        }
+    }
+    return done;
+}
+
+int io300_get_stats(struct io300_file* const f, struct io300_stats* stats) {
+    check_invariants(f);
+    pthread_mutex_lock(&f->lock);
+    *stats = f->stats;
+    pthread_mutex_unlock(&f->lock);
+    return 0;
+}
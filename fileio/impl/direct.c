@@ -0,0 +1,435 @@
+#define _GNU_SOURCE
+#include <assert.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <unistd.h>
+
+#include "../io300.h"
+
+/*
+    direct.c
+
+    This implementation opens files with O_DIRECT, so its reads and
+    writes bypass the kernel's page cache.  Streaming a file much larger
+    than RAM through it does not push everything else out of the cache.
+
+    O_DIRECT requires that buffer addresses, file offsets and transfer
+    lengths are all multiples of the device block size.  The cache is
+    one DIRECT_WINDOW_SIZE-byte window that always starts at a multiple
+    of DIRECT_ALIGN, and modified bytes are written back in whole
+    blocks.  When the last block of the file is only partly used, the
+    write-back pads it with zeros; the file is truncated back to its
+    real size on close.
+
+    If the filesystem does not support O_DIRECT (e.g. tmpfs), the file
+    is opened normally instead, and everything else works the same way.
+
+    io300_peek and io300_reserve return pointers into the window, never
+    past its end.  In the statistics, an access that finds the window
+    already covering the file position is a hit.
+
+    Both sizes can be set at compile time, e.g.:
+       $ CFLAGS="-DDIRECT_WINDOW_SIZE=4194304" make -B IMPL=direct
+*/
+
+#ifndef DIRECT_ALIGN
+#define DIRECT_ALIGN 4096
+#endif
+
+#ifndef DIRECT_WINDOW_SIZE
+#define DIRECT_WINDOW_SIZE (1 << 20)
+#endif
+
+#if (DIRECT_WINDOW_SIZE % DIRECT_ALIGN != 0)
+#error "DIRECT_WINDOW_SIZE must be a multiple of DIRECT_ALIGN"
+#endif
+
+#define ALIGN_DOWN(x) ((x) - (x) % DIRECT_ALIGN)
+#define ALIGN_UP(x) ALIGN_DOWN((x) + DIRECT_ALIGN - 1)
+
+struct io300_file {
+    /* read,write,seek all take a file descriptor as a parameter */
+    int fd;
+    /* nonzero if the file was opened for writing */
+    int writable;
+    /* nonzero if the file was opened with O_DIRECT */
+    int direct;
+
+    /* current file position */
+    off_t pos;
+    /* logical size of the file, including data not yet written back */
+    off_t size;
+    /* size of the file on disk, including any zero padding we wrote */
+    off_t disk_size;
+
+    /* the window:  DIRECT_WINDOW_SIZE bytes, aligned to DIRECT_ALIGN */
+    char* cache;
+    /* file offset of the window, or -1 if the window is empty */
+    off_t start;
+    /* bytes [dirty_lo, dirty_hi) of the window were modified */
+    size_t dirty_lo;
+    size_t dirty_hi;
+
+    /* bytes handed out by the last io300_peek or io300_reserve */
+    size_t lent;
+
+    struct io300_stats stats;
+
+    /* Used for debugging, keep track of which io300_file is which */
+    char* description;
+};
+
+static void check_invariants(struct io300_file* f) {
+    assert(f != NULL);
+    assert(f->cache != NULL);
+    assert(f->fd >= 0);
+    assert(f->pos >= 0);
+    assert(f->start == -1 || f->start % DIRECT_ALIGN == 0);
+    assert(f->dirty_hi <= DIRECT_WINDOW_SIZE);
+}
+
+/*
+ *  Write the modified blocks of the window back to the file.
+ *  Returns 0 on success, -1 on failure.
+ */
+static int flush(struct io300_file* f) {
+    if (f->dirty_hi == 0) {
+        return 0;
+    }
+
+    f->stats.flushes++;
+    size_t const lo = ALIGN_DOWN(f->dirty_lo);
+    size_t const hi = ALIGN_UP(f->dirty_hi);
+    size_t done = 0;
+    while (done < hi - lo) {
+        f->stats.write_calls++;
+        ssize_t const n = pwrite(f->fd, f->cache + lo + done, hi - lo - done,
+                                 f->start + lo + done);
+        if (n <= 0) {
+            return -1;
+        }
+        f->stats.bytes_written += n;
+        done += n;
+    }
+
+    if (f->start + (off_t)hi > f->disk_size) {
+        f->disk_size = f->start + hi;
+    }
+    f->dirty_lo = f->dirty_hi = 0;
+    return 0;
+}
+
+/* Record that bytes [off, off + n) of the window were modified */
+static void mark_dirty(struct io300_file* f, size_t off, size_t n) {
+    if (f->dirty_hi == 0) {
+        f->dirty_lo = off;
+        f->dirty_hi = off + n;
+    } else {
+        if (off < f->dirty_lo) {
+            f->dirty_lo = off;
+        }
+        if (off + n > f->dirty_hi) {
+            f->dirty_hi = off + n;
+        }
+    }
+}
+
+/*
+ *  Load the window containing `pos`, writing back the current one first.
+ *  Returns 0 on success, -1 on failure.
+ */
+static int fetch(struct io300_file* f, off_t pos) {
+    if (flush(f) == -1) {
+        return -1;
+    }
+
+    f->stats.refills++;
+    off_t const start = pos - pos % DIRECT_WINDOW_SIZE;
+    size_t got = 0;
+    while (start + (off_t)got < f->disk_size && got < DIRECT_WINDOW_SIZE) {
+        f->stats.read_calls++;
+        ssize_t const n = pread(f->fd, f->cache + got, DIRECT_WINDOW_SIZE - got,
+                                start + got);
+        if (n == -1) {
+            f->start = -1;
+            return -1;
+        } else if (n == 0) {
+            break;
+        }
+        f->stats.bytes_read += n;
+        got += n;
+        if (got % DIRECT_ALIGN != 0) {
+            // Short read at the end of the file
+            break;
+        }
+    }
+    memset(f->cache + got, 0, DIRECT_WINDOW_SIZE - got);
+    f->start = start;
+    return 0;
+}
+
+/* Make sure the window covers f->pos.  Returns 0 on success, -1 on failure. */
+static int window_at_pos(struct io300_file* f) {
+    if (f->start != -1 && f->pos >= f->start
+        && f->pos < f->start + DIRECT_WINDOW_SIZE) {
+        f->stats.hits++;
+        return 0;
+    }
+    f->stats.misses++;
+    return fetch(f, f->pos);
+}
+
+struct io300_file* io300_open(const char* const path, int mode, char* description) {
+    if (path == NULL) {
+        fprintf(stderr, "error: null file path\n");
+        return NULL;
+    }
+
+    int flags = O_CREAT | O_SYNC;
+    switch(mode) {
+    case MODE_READ:
+        flags |= O_RDONLY;
+        break;
+    case MODE_WRITE:
+        flags |= O_RDWR | O_TRUNC;
+        break;
+    case (MODE_READ|MODE_WRITE):
+        flags |= O_RDWR;
+        break;
+    default:
+        fprintf(stderr, "error: invalid file mode %02x\n", mode);
+        return NULL;
+    }
+
+    int direct = 1;
+    int fd = open(path, flags | O_DIRECT, S_IRUSR | S_IWUSR);
+    if (fd == -1 && errno == EINVAL) {
+        direct = 0;
+        fd = open(path, flags, S_IRUSR | S_IWUSR);
+    }
+    if (fd == -1) {
+        fprintf(stderr, "error: could not open file: `%s`: %s\n", path,
+                strerror(errno));
+        return NULL;
+    }
+
+    struct stat st;
+    if (fstat(fd, &st) == -1 || !S_ISREG(st.st_mode)) {
+        fprintf(stderr, "error: %s is not a regular file\n", path);
+        close(fd);
+        return NULL;
+    }
+
+    struct io300_file* const ret = malloc(sizeof(*ret));
+    if (ret == NULL) {
+        fprintf(stderr, "error: could not allocate io300_file\n");
+        close(fd);
+        return NULL;
+    }
+
+    if (posix_memalign((void**)&ret->cache, DIRECT_ALIGN, DIRECT_WINDOW_SIZE) != 0) {
+        fprintf(stderr, "error: could not allocate file cache\n");
+        close(fd);
+        free(ret);
+        return NULL;
+    }
+
+    ret->fd = fd;
+    ret->writable = (mode & MODE_WRITE) != 0;
+    ret->direct = direct;
+    ret->pos = 0;
+    ret->size = st.st_size;
+    ret->disk_size = st.st_size;
+    ret->start = -1;
+    ret->dirty_lo = ret->dirty_hi = 0;
+    ret->lent = 0;
+    ret->stats = (struct io300_stats){0};
+    ret->description = description;
+
+    check_invariants(ret);
+    return ret;
+}
+
+int io300_close(struct io300_file* const f) {
+    check_invariants(f);
+
+    int ret = flush(f);
+    // Remove the zero padding after the last partial block
+    if (f->writable && f->disk_size != f->size && ftruncate(f->fd, f->size) == -1) {
+        ret = -1;
+    }
+
+    io300_report_stats(&f->stats);
+    close(f->fd);
+    free(f->cache);
+    free(f);
+    return ret;
+}
+
+off_t io300_filesize(struct io300_file* const f) {
+    check_invariants(f);
+    return f->size;
+}
+
+int io300_seek(struct io300_file* const f, off_t const pos) {
+    check_invariants(f);
+    if (pos < 0) {
+        return -1;
+    }
+    f->pos = pos;
+    return pos;
+}
+
+int io300_readc(struct io300_file* const f) {
+    check_invariants(f);
+    if (f->pos >= f->size || window_at_pos(f) == -1) {
+        return -1;
+    }
+    unsigned char const c = f->cache[f->pos - f->start];
+    f->pos++;
+    return c;
+}
+
+int io300_writec(struct io300_file* f, int ch) {
+    char const c = (char)ch;
+    return io300_write(f, &c, 1) == 1 ? (unsigned char)c : -1;
+}
+
+ssize_t io300_read(struct io300_file* const f, char* const buff,
+                   size_t const sz) {
+    check_invariants(f);
+    if (f->pos >= f->size) {
+        return 0;
+    }
+
+    size_t total = sz;
+    if ((off_t)total > f->size - f->pos) {
+        total = f->size - f->pos;
+    }
+
+    size_t done = 0;
+    while (done < total) {
+        if (window_at_pos(f) == -1) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos - f->start;
+        size_t n = DIRECT_WINDOW_SIZE - off;
+        if (n > total - done) {
+            n = total - done;
+        }
+        memcpy(buff + done, f->cache + off, n);
+        done += n;
+        f->pos += n;
+    }
+    return done;
+}
+
+ssize_t io300_write(struct io300_file* const f, const char* buff,
+                    size_t const sz) {
+    check_invariants(f);
+    if (!f->writable) {
+        return -1;
+    }
+
+    size_t done = 0;
+    while (done < sz) {
+        if (window_at_pos(f) == -1) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos - f->start;
+        size_t n = DIRECT_WINDOW_SIZE - off;
+        if (n > sz - done) {
+            n = sz - done;
+        }
+        memcpy(f->cache + off, buff + done, n);
+        mark_dirty(f, off, n);
+
+        done += n;
+        f->pos += n;
+        if (f->pos > f->size) {
+            f->size = f->pos;
+        }
+    }
+    return done;
+}
+
+ssize_t io300_peek(struct io300_file* const f, const char** ptr, size_t const max) {
+    check_invariants(f);
+    f->lent = 0;
+    if (f->pos >= f->size) {
+        return 0;
+    }
+    if (window_at_pos(f) == -1) {
+        return -1;
+    }
+
+    size_t const off = f->pos - f->start;
+    size_t n = DIRECT_WINDOW_SIZE - off;
+    if (n > max) {
+        n = max;
+    }
+    if ((off_t)n > f->size - f->pos) {
+        n = f->size - f->pos;
+    }
+    *ptr = f->cache + off;
+    f->lent = n;
+    return n;
+}
+
+int io300_consume(struct io300_file* const f, size_t const nbytes) {
+    check_invariants(f);
+    if (nbytes > f->lent) {
+        return -1;
+    }
+    f->pos += nbytes;
+    f->lent = 0;
+    return 0;
+}
+
+ssize_t io300_reserve(struct io300_file* const f, char** ptr, size_t const max) {
+    check_invariants(f);
+    f->lent = 0;
+    if (!f->writable || window_at_pos(f) == -1) {
+        return -1;
+    }
+
+    size_t const off = f->pos - f->start;
+    size_t n = DIRECT_WINDOW_SIZE - off;
+    if (n > max) {
+        n = max;
+    }
+    *ptr = f->cache + off;
+    f->lent = n;
+    return n;
+}
+
+int io300_commit(struct io300_file* const f, size_t const nbytes) {
+    check_invariants(f);
+    if (nbytes > f->lent) {
+        return -1;
+    }
+    f->lent = 0;
+    if (nbytes == 0) {
+        return 0;
+    }
+
+    // The window still covers the position, since io300_reserve was the
+    // last call
+    mark_dirty(f, f->pos - f->start, nbytes);
+    f->pos += nbytes;
+    if (f->pos > f->size) {
+        f->size = f->pos;
+    }
+    return 0;
+}
+
+int io300_get_stats(struct io300_file* const f, struct io300_stats* stats) {
+    check_invariants(f);
+    *stats = f->stats;
+    return 0;
+}
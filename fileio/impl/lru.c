@@ -0,0 +1,941 @@
+#define _GNU_SOURCE
+#include <assert.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <sys/uio.h>
+#include <unistd.h>
+
+#include "../io300.h"
+
+/*
+    lru.c
+
+    This implementation keeps a set of CACHE_SLOTS cache slots, each
+    holding one CACHE_SLOT_SIZE-byte "page" of the file (page k covers
+    bytes [k * CACHE_SLOT_SIZE, (k + 1) * CACHE_SLOT_SIZE)).  A hash
+    table maps file pages to slots.  When every slot is in use, the
+    least recently used one is evicted, and its modified bytes (if any)
+    are written back with a single pwrite.
+
+    Unlike a single-buffer cache, strided and random readers keep their
+    working set cached as long as it fits in the slots, so they perform
+    close to sequential readers.
+
+    Both parameters can be set at compile time, e.g.:
+       $ CFLAGS="-DCACHE_SLOTS=64 -DCACHE_SLOT_SIZE=4096" make -B IMPL=lru
+    By default a slot is CACHE_SIZE bytes.
+
+    Setting CACHE_READAHEAD to more than 1 turns on adaptive readahead
+    (see adaptive.c):  the cache watches the distance between
+    consecutive accesses, classifies the stream as sequential, reverse
+    or strided, and on a miss loads up to CACHE_READAHEAD pages in the
+    direction the stream is moving with a single preadv.
+
+    io300_readv serves a whole batch of reads in one pass:  when a
+    request misses, the pages the following requests need next to it
+    (forwards or backwards) are loaded with the same preadv.
+
+    io300_advise replaces the guessed access pattern with the caller's:
+    a sequential or reverse hint reads ahead up to HINT_READAHEAD pages
+    in that direction (even if CACHE_READAHEAD is 1), a random hint
+    turns readahead off, and IO300_WILLNEED loads the given range right
+    away.  The hint is also passed on to the kernel with posix_fadvise.
+
+    io300_peek and io300_reserve hand out pointers into a cache slot,
+    never more than the rest of the slot holding the file position.
+
+    In the statistics, every page lookup is a hit or a miss, and every
+    preadv (however many pages it loads) is one refill.
+*/
+
+#ifndef CACHE_SIZE
+#define CACHE_SIZE 8
+#endif
+
+#ifndef CACHE_SLOT_SIZE
+#define CACHE_SLOT_SIZE CACHE_SIZE
+#endif
+
+#ifndef CACHE_SLOTS
+#define CACHE_SLOTS 256
+#endif
+
+#ifndef CACHE_READAHEAD
+#define CACHE_READAHEAD 1
+#endif
+
+#ifndef HINT_READAHEAD
+#define HINT_READAHEAD 16
+#endif
+
+#if (CACHE_SLOT_SIZE < 1 || CACHE_SLOTS < 1 || CACHE_READAHEAD < 1 || HINT_READAHEAD < 1)
+#error "CACHE_SLOT_SIZE, CACHE_SLOTS, CACHE_READAHEAD and HINT_READAHEAD must be positive"
+#endif
+
+/* Never load more than half of the cache in one refill */
+#if (CACHE_READAHEAD > CACHE_SLOTS / 2)
+#define MAX_READAHEAD (CACHE_SLOTS / 2 > 0 ? CACHE_SLOTS / 2 : 1)
+#else
+#define MAX_READAHEAD CACHE_READAHEAD
+#endif
+
+#if (HINT_READAHEAD > CACHE_SLOTS / 2)
+#define MAX_HINT_READAHEAD (CACHE_SLOTS / 2 > 0 ? CACHE_SLOTS / 2 : 1)
+#else
+#define MAX_HINT_READAHEAD HINT_READAHEAD
+#endif
+
+/* Most pages loaded at once (by readahead, io300_readv or io300_advise) */
+#if (CACHE_SLOTS / 2 > MAX_READAHEAD)
+#define MAX_BATCH_PAGES (CACHE_SLOTS / 2)
+#else
+#define MAX_BATCH_PAGES MAX_READAHEAD
+#endif
+
+/* Most iovecs passed to one preadv (IOV_MAX on Linux) */
+#if (MAX_BATCH_PAGES > 1024)
+#define MAX_IOV 1024
+#else
+#define MAX_IOV MAX_BATCH_PAGES
+#endif
+
+/* Number of hash buckets:  a power of two, at least twice the slot count */
+#define ROUND_UP_POW2_(x) ((x) | (x) >> 1 | (x) >> 2 | (x) >> 4 | (x) >> 8 | (x) >> 16)
+#define HASH_BUCKETS (ROUND_UP_POW2_(2 * CACHE_SLOTS - 1) + 1)
+
+#define NO_SLOT (-1)
+#define NO_PAGE ((off_t)-1)
+
+enum access_pattern {
+    PATTERN_RANDOM,
+    /* each access starts where the previous one ended */
+    PATTERN_SEQUENTIAL,
+    /* consecutive accesses move backwards by the same distance */
+    PATTERN_REVERSE,
+    /* consecutive accesses move forwards by the same distance */
+    PATTERN_STRIDED,
+};
+
+struct cache_slot {
+    /* file page held by this slot, or NO_PAGE if the slot is free */
+    off_t page;
+    /* bytes [dirty_lo, dirty_hi) of the slot were modified since it was loaded */
+    size_t dirty_lo;
+    size_t dirty_hi;
+    /* neighbours in the LRU list (prev is more recently used) */
+    int prev;
+    int next;
+    /* next slot in the same hash bucket */
+    int hnext;
+    char* data;
+};
+
+struct io300_file {
+    /* read,write,seek all take a file descriptor as a parameter */
+    int fd;
+    /* nonzero if the file was opened for writing */
+    int writable;
+
+    /* current file position */
+    off_t pos;
+    /* logical size of the file, including data not yet written back */
+    off_t size;
+    /* size of the file on disk:  pages past this need not be read */
+    off_t disk_size;
+
+    /* backing memory for every slot's data */
+    char* cache;
+    struct cache_slot slots[CACHE_SLOTS];
+    /* most and least recently used slots */
+    int lru_head;
+    int lru_tail;
+    /* slot most recently returned by get_slot (always lru_head) */
+    int current;
+    /* first slot in each hash bucket */
+    int buckets[HASH_BUCKETS];
+
+    /* access pattern given with io300_advise, or IO300_NORMAL to guess */
+    int hint;
+    /* most pages to load on a miss */
+    int readahead;
+
+    /* access pattern detection (see note_access) */
+    enum access_pattern pattern;
+    off_t last_pos;
+    off_t last_end;
+    off_t last_delta;
+
+    /* bytes handed out by the last io300_peek or io300_reserve */
+    size_t lent;
+
+    struct io300_stats stats;
+
+    /* Used for debugging, keep track of which io300_file is which */
+    char* description;
+};
+
+static void check_invariants(struct io300_file* f) {
+    assert(f != NULL);
+    assert(f->cache != NULL);
+    assert(f->fd >= 0);
+    assert(f->pos >= 0);
+    assert(f->disk_size <= f->size);
+}
+
+static unsigned bucket_of(off_t page) {
+    // Fibonacci hashing spreads strided page numbers across buckets
+    uint64_t const h = (uint64_t)page * 0x9E3779B97F4A7C15ull;
+    return (unsigned)(h >> 32) & (HASH_BUCKETS - 1);
+}
+
+static void lru_unlink(struct io300_file* f, int i) {
+    struct cache_slot* s = &f->slots[i];
+    if (s->prev != NO_SLOT) {
+        f->slots[s->prev].next = s->next;
+    } else {
+        f->lru_head = s->next;
+    }
+    if (s->next != NO_SLOT) {
+        f->slots[s->next].prev = s->prev;
+    } else {
+        f->lru_tail = s->prev;
+    }
+}
+
+static void lru_push_front(struct io300_file* f, int i) {
+    struct cache_slot* s = &f->slots[i];
+    s->prev = NO_SLOT;
+    s->next = f->lru_head;
+    if (f->lru_head != NO_SLOT) {
+        f->slots[f->lru_head].prev = i;
+    }
+    f->lru_head = i;
+    if (f->lru_tail == NO_SLOT) {
+        f->lru_tail = i;
+    }
+}
+
+static int hash_find(struct io300_file* f, off_t page) {
+    int i = f->buckets[bucket_of(page)];
+    while (i != NO_SLOT && f->slots[i].page != page) {
+        i = f->slots[i].hnext;
+    }
+    return i;
+}
+
+static void hash_remove(struct io300_file* f, int i) {
+    int* link = &f->buckets[bucket_of(f->slots[i].page)];
+    while (*link != i) {
+        link = &f->slots[*link].hnext;
+    }
+    *link = f->slots[i].hnext;
+}
+
+static void hash_insert(struct io300_file* f, int i) {
+    unsigned const b = bucket_of(f->slots[i].page);
+    f->slots[i].hnext = f->buckets[b];
+    f->buckets[b] = i;
+}
+
+/*
+ *  Write the modified part of slot `i` back to the file.
+ *  Returns 0 on success, -1 on failure.
+ */
+static int flush_slot(struct io300_file* f, int i) {
+    struct cache_slot* s = &f->slots[i];
+    if (s->dirty_hi == 0) {
+        return 0;
+    }
+
+    f->stats.flushes++;
+    off_t const base = s->page * CACHE_SLOT_SIZE;
+    size_t done = s->dirty_lo;
+    while (done < s->dirty_hi) {
+        f->stats.write_calls++;
+        ssize_t const n = pwrite(f->fd, s->data + done, s->dirty_hi - done,
+                                 base + done);
+        if (n <= 0) {
+            return -1;
+        }
+        f->stats.bytes_written += n;
+        done += n;
+    }
+
+    if (base + (off_t)s->dirty_hi > f->disk_size) {
+        f->disk_size = base + s->dirty_hi;
+    }
+    s->dirty_lo = s->dirty_hi = 0;
+    return 0;
+}
+
+/* Record that bytes [off, off + n) of slot `s` were modified */
+static void mark_dirty(struct cache_slot* s, size_t off, size_t n) {
+    if (s->dirty_hi == 0) {
+        s->dirty_lo = off;
+        s->dirty_hi = off + n;
+    } else {
+        if (off < s->dirty_lo) {
+            s->dirty_lo = off;
+        }
+        if (off + n > s->dirty_hi) {
+            s->dirty_hi = off + n;
+        }
+    }
+}
+
+/*
+ *  Record an access of `len` bytes at `pos` and update the guess of
+ *  the access pattern used to choose readahead pages.
+ */
+static void note_access(struct io300_file* f, off_t pos, size_t len) {
+    off_t const delta = pos - f->last_pos;
+    if (pos == f->last_end) {
+        f->pattern = PATTERN_SEQUENTIAL;
+    } else if (delta == f->last_delta) {
+        f->pattern = delta < 0 ? PATTERN_REVERSE : PATTERN_STRIDED;
+    } else {
+        f->pattern = PATTERN_RANDOM;
+    }
+    f->last_delta = delta;
+    f->last_pos = pos;
+    f->last_end = pos + len;
+}
+
+/*
+ *  Take the least recently used slot for a new page, writing back its
+ *  contents first if needed.  Returns the slot, or NO_SLOT on failure.
+ */
+static int evict_slot(struct io300_file* f) {
+    int const i = f->lru_tail;
+    if (f->slots[i].page != NO_PAGE) {
+        if (flush_slot(f, i) == -1) {
+            return NO_SLOT;
+        }
+        hash_remove(f, i);
+        f->slots[i].page = NO_PAGE;
+    }
+    // Move it out of the way so the next eviction picks another slot
+    lru_unlink(f, i);
+    lru_push_front(f, i);
+    return i;
+}
+
+/*
+ *  Load the `n` pages starting at `first`, none of which are cached,
+ *  into the cache with one preadv.  Bytes past the end of the file on
+ *  disk are zero.  Stores the slot holding each page in `idx`.
+ *  Returns 0 on success, -1 on failure.
+ */
+static int load_pages(struct io300_file* f, off_t first, int n, int* idx) {
+    assert(n >= 1 && n <= MAX_BATCH_PAGES);
+    for (int j = 0; j < n; j++) {
+        idx[j] = evict_slot(f);
+        if (idx[j] == NO_SLOT) {
+            return -1;
+        }
+    }
+
+    off_t const base = first * CACHE_SLOT_SIZE;
+    size_t want = 0;
+    if (base < f->disk_size) {
+        want = (size_t)n * CACHE_SLOT_SIZE;
+        if (f->disk_size - base < (off_t)want) {
+            want = f->disk_size - base;
+        }
+    }
+
+    f->stats.refills++;
+    size_t got = 0;
+    while (got < want) {
+        struct iovec iov[MAX_IOV];
+        int iovcnt = 0;
+        for (size_t at = got; at < want && iovcnt < MAX_IOV; iovcnt++) {
+            size_t const off = at % CACHE_SLOT_SIZE;
+            size_t len = CACHE_SLOT_SIZE - off;
+            if (len > want - at) {
+                len = want - at;
+            }
+            iov[iovcnt].iov_base = f->slots[idx[at / CACHE_SLOT_SIZE]].data + off;
+            iov[iovcnt].iov_len = len;
+            at += len;
+        }
+        f->stats.read_calls++;
+        ssize_t const r = iovcnt == 1
+            ? pread(f->fd, iov[0].iov_base, iov[0].iov_len, base + got)
+            : preadv(f->fd, iov, iovcnt, base + got);
+        if (r == -1) {
+            return -1;
+        } else if (r == 0) {
+            break;
+        }
+        f->stats.bytes_read += r;
+        got += r;
+    }
+
+    for (int j = 0; j < n; j++) {
+        struct cache_slot* s = &f->slots[idx[j]];
+        size_t const have = got > (size_t)j * CACHE_SLOT_SIZE
+            ? got - (size_t)j * CACHE_SLOT_SIZE : 0;
+        if (have < CACHE_SLOT_SIZE) {
+            memset(s->data + have, 0, CACHE_SLOT_SIZE - have);
+        }
+        s->page = first + j;
+        s->dirty_lo = s->dirty_hi = 0;
+        hash_insert(f, idx[j]);
+    }
+    return 0;
+}
+
+/*
+ *  Load page `page`, plus any readahead pages the access pattern calls
+ *  for, into the cache with one preadv.  Returns the slot holding
+ *  `page`, or NO_SLOT on failure.
+ */
+static int fetch_pages(struct io300_file* f, off_t page) {
+    off_t first = page;
+    int n = 1;
+
+    off_t const reach = (off_t)f->readahead * CACHE_SLOT_SIZE;
+    int forward, backward;
+    if (f->hint != IO300_NORMAL) {
+        forward = f->hint == IO300_SEQUENTIAL;
+        backward = f->hint == IO300_REVERSE;
+    } else {
+        forward = f->pattern == PATTERN_SEQUENTIAL
+            || (f->pattern == PATTERN_STRIDED && f->last_delta <= reach);
+        backward = f->pattern == PATTERN_REVERSE
+            && -f->last_delta <= reach;
+    }
+
+    // Extend the window in the direction of travel, but only over pages
+    // that exist on disk and are not cached already
+    while (n < f->readahead) {
+        if (forward && (page + n) * CACHE_SLOT_SIZE < f->disk_size
+            && hash_find(f, page + n) == NO_SLOT) {
+            n++;
+        } else if (backward && first > 0 && hash_find(f, first - 1) == NO_SLOT) {
+            first--;
+            n++;
+        } else {
+            break;
+        }
+    }
+
+    int idx[MAX_BATCH_PAGES];
+    if (load_pages(f, first, n, idx) == -1) {
+        return NO_SLOT;
+    }
+    return idx[page - first];
+}
+
+/* Make slot `i` the most recently used (and current) slot */
+static struct cache_slot* use_slot(struct io300_file* f, int i) {
+    lru_unlink(f, i);
+    lru_push_front(f, i);
+    f->current = i;
+    return &f->slots[i];
+}
+
+/*
+ *  Return the slot holding `page`, loading it (and evicting the least
+ *  recently used slot) if necessary.  Returns NULL on failure.
+ */
+static struct cache_slot* get_slot(struct io300_file* f, off_t page) {
+    if (f->slots[f->current].page == page) {
+        f->stats.hits++;
+        return &f->slots[f->current];
+    }
+
+    int i = hash_find(f, page);
+    if (i == NO_SLOT) {
+        f->stats.misses++;
+        i = fetch_pages(f, page);
+        if (i == NO_SLOT) {
+            return NULL;
+        }
+    } else {
+        f->stats.hits++;
+    }
+    return use_slot(f, i);
+}
+
+struct io300_file* io300_open(const char* const path, int mode, char* description) {
+    if (path == NULL) {
+        fprintf(stderr, "error: null file path\n");
+        return NULL;
+    }
+
+    int flags = O_CREAT | O_SYNC;
+    switch(mode) {
+    case MODE_READ:
+        flags |= O_RDONLY;
+        break;
+    case MODE_WRITE:
+        flags |= O_RDWR | O_TRUNC;
+        break;
+    case (MODE_READ|MODE_WRITE):
+        flags |= O_RDWR;
+        break;
+    default:
+        fprintf(stderr, "error: invalid file mode %02x\n", mode);
+        return NULL;
+    }
+
+    int const fd = open(path, flags, S_IRUSR | S_IWUSR);
+    if (fd == -1) {
+        fprintf(stderr, "error: could not open file: `%s`: %s\n", path,
+                strerror(errno));
+        return NULL;
+    }
+
+    struct stat st;
+    if (fstat(fd, &st) == -1 || !S_ISREG(st.st_mode)) {
+        fprintf(stderr, "error: %s is not a regular file\n", path);
+        close(fd);
+        return NULL;
+    }
+
+    struct io300_file* const ret = malloc(sizeof(*ret));
+    if (ret == NULL) {
+        fprintf(stderr, "error: could not allocate io300_file\n");
+        close(fd);
+        return NULL;
+    }
+
+    if (posix_memalign((void**)&ret->cache, sysconf(_SC_PAGESIZE),
+                       (size_t)CACHE_SLOTS * CACHE_SLOT_SIZE) != 0) {
+        fprintf(stderr, "error: could not allocate file cache\n");
+        close(fd);
+        free(ret);
+        return NULL;
+    }
+
+    ret->fd = fd;
+    ret->writable = (mode & MODE_WRITE) != 0;
+    ret->pos = 0;
+    ret->size = st.st_size;
+    ret->disk_size = st.st_size;
+    ret->description = description;
+
+    for (int b = 0; b < HASH_BUCKETS; b++) {
+        ret->buckets[b] = NO_SLOT;
+    }
+    ret->lru_head = ret->lru_tail = NO_SLOT;
+    for (int i = CACHE_SLOTS - 1; i >= 0; i--) {
+        struct cache_slot* s = &ret->slots[i];
+        s->page = NO_PAGE;
+        s->dirty_lo = s->dirty_hi = 0;
+        s->hnext = NO_SLOT;
+        s->data = ret->cache + (size_t)i * CACHE_SLOT_SIZE;
+        lru_push_front(ret, i);
+    }
+    ret->current = ret->lru_head;
+
+    ret->hint = IO300_NORMAL;
+    ret->readahead = MAX_READAHEAD;
+    ret->pattern = PATTERN_SEQUENTIAL;
+    ret->last_pos = 0;
+    ret->last_end = 0;
+    ret->last_delta = 0;
+    ret->lent = 0;
+    ret->stats = (struct io300_stats){0};
+
+    check_invariants(ret);
+    return ret;
+}
+
+/*
+ *  Write every modified slot back to the file.
+ *  Returns 0 on success, -1 on failure.
+ */
+static int flush_all(struct io300_file* f) {
+    int ret = 0;
+    for (int i = 0; i < CACHE_SLOTS; i++) {
+        if (f->slots[i].page != NO_PAGE && flush_slot(f, i) == -1) {
+            ret = -1;
+        }
+    }
+    return ret;
+}
+
+int io300_close(struct io300_file* const f) {
+    check_invariants(f);
+
+    int const ret = flush_all(f);
+    io300_report_stats(&f->stats);
+    close(f->fd);
+    free(f->cache);
+    free(f);
+    return ret;
+}
+
+off_t io300_filesize(struct io300_file* const f) {
+    check_invariants(f);
+    return f->size;
+}
+
+int io300_seek(struct io300_file* const f, off_t const pos) {
+    check_invariants(f);
+    if (pos < 0) {
+        return -1;
+    }
+    f->pos = pos;
+    return pos;
+}
+
+int io300_readc(struct io300_file* const f) {
+    check_invariants(f);
+    if (f->pos >= f->size) {
+        return -1;
+    }
+    note_access(f, f->pos, 1);
+
+    struct cache_slot* s = get_slot(f, f->pos / CACHE_SLOT_SIZE);
+    if (s == NULL) {
+        return -1;
+    }
+    unsigned char const c = s->data[f->pos % CACHE_SLOT_SIZE];
+    f->pos++;
+    return c;
+}
+
+int io300_writec(struct io300_file* f, int ch) {
+    char const c = (char)ch;
+    return io300_write(f, &c, 1) == 1 ? (unsigned char)c : -1;
+}
+
+ssize_t io300_read(struct io300_file* const f, char* const buff,
+                   size_t const sz) {
+    check_invariants(f);
+    if (f->pos >= f->size) {
+        return 0;
+    }
+
+    size_t total = sz;
+    if ((off_t)total > f->size - f->pos) {
+        total = f->size - f->pos;
+    }
+    note_access(f, f->pos, total);
+
+    size_t done = 0;
+    while (done < total) {
+        struct cache_slot* s = get_slot(f, f->pos / CACHE_SLOT_SIZE);
+        if (s == NULL) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos % CACHE_SLOT_SIZE;
+        size_t n = CACHE_SLOT_SIZE - off;
+        if (n > total - done) {
+            n = total - done;
+        }
+        memcpy(buff + done, s->data + off, n);
+        done += n;
+        f->pos += n;
+    }
+    return done;
+}
+
+ssize_t io300_write(struct io300_file* const f, const char* buff,
+                    size_t const sz) {
+    check_invariants(f);
+    if (!f->writable) {
+        return -1;
+    }
+    note_access(f, f->pos, sz);
+
+    size_t done = 0;
+    while (done < sz) {
+        struct cache_slot* s = get_slot(f, f->pos / CACHE_SLOT_SIZE);
+        if (s == NULL) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos % CACHE_SLOT_SIZE;
+        size_t n = CACHE_SLOT_SIZE - off;
+        if (n > sz - done) {
+            n = sz - done;
+        }
+        memcpy(s->data + off, buff + done, n);
+        mark_dirty(s, off, n);
+
+        done += n;
+        f->pos += n;
+        if (f->pos > f->size) {
+            f->size = f->pos;
+        }
+    }
+    return done;
+}
+
+/*
+ *  Called when request `r` of a batch misses at file offset `pos`.
+ *  Extends the miss into a run of uncached pages [*first, *first + *n)
+ *  by following the pages that the rest of request r and requests
+ *  r + 1, ... touch, for as long as each one is inside the run or next
+ *  to either end of it.
+ */
+static void batch_run(struct io300_file* f, const struct io300_iovec* iov,
+                      int iovcnt, int r, off_t pos, off_t* first, int* n) {
+    off_t lo = pos / CACHE_SLOT_SIZE, hi = lo;
+    int more = 1;
+    for (int i = r; i < iovcnt && more; i++) {
+        off_t start = i == r ? pos : iov[i].offset;
+        off_t end = iov[i].offset + (off_t)iov[i].len;
+        if (end > f->size) {
+            end = f->size;
+        }
+        if (start >= end) {
+            continue;
+        }
+
+        off_t const p_lo = start / CACHE_SLOT_SIZE;
+        off_t const p_hi = (end - 1) / CACHE_SLOT_SIZE;
+        // Walk the request's pages in the direction the run grows
+        int const backward = p_hi < lo;
+        for (off_t k = 0; k <= p_hi - p_lo && more; k++) {
+            off_t const p = backward ? p_hi - k : p_lo + k;
+            if (p >= lo && p <= hi) {
+                continue;
+            }
+            if (hi - lo + 1 >= MAX_BATCH_PAGES || hash_find(f, p) != NO_SLOT) {
+                more = 0;
+            } else if (p == hi + 1) {
+                hi++;
+            } else if (p == lo - 1) {
+                lo--;
+            } else {
+                more = 0;
+            }
+        }
+    }
+    *first = lo;
+    *n = hi - lo + 1;
+}
+
+ssize_t io300_readv(struct io300_file* const f, const struct io300_iovec* iov,
+                    int const iovcnt) {
+    check_invariants(f);
+
+    // A negative offset fails the whole batch, as io300_seek would, before
+    // anything is read (batch_run looks ahead at the later requests)
+    for (int r = 0; r < iovcnt; r++) {
+        if (iov[r].offset < 0) {
+            return -1;
+        }
+    }
+
+    ssize_t total = 0;
+    for (int r = 0; r < iovcnt; r++) {
+        if (iov[r].offset >= f->size) {
+            continue;
+        }
+        f->pos = iov[r].offset;
+        size_t len = iov[r].len;
+        if ((off_t)len > f->size - f->pos) {
+            len = f->size - f->pos;
+        }
+
+        size_t done = 0;
+        while (done < len) {
+            off_t const page = f->pos / CACHE_SLOT_SIZE;
+            struct cache_slot* s;
+            if (f->slots[f->current].page != page && hash_find(f, page) == NO_SLOT) {
+                off_t first;
+                int n;
+                int idx[MAX_BATCH_PAGES];
+                f->stats.misses++;
+                batch_run(f, iov, iovcnt, r, f->pos, &first, &n);
+                if (load_pages(f, first, n, idx) == -1) {
+                    return total > 0 ? total : -1;
+                }
+                s = use_slot(f, idx[page - first]);
+            } else {
+                s = get_slot(f, page);
+                if (s == NULL) {
+                    return total > 0 ? total : -1;
+                }
+            }
+            size_t const off = f->pos % CACHE_SLOT_SIZE;
+            size_t n = CACHE_SLOT_SIZE - off;
+            if (n > len - done) {
+                n = len - done;
+            }
+            memcpy(iov[r].buf + done, s->data + off, n);
+            done += n;
+            f->pos += n;
+        }
+        total += done;
+    }
+    return total;
+}
+
+/*
+ *  Load the uncached pages of bytes [offset, offset + len), stopping
+ *  after MAX_BATCH_PAGES pages so a large range cannot flush the whole
+ *  cache.  Returns 0 on success, -1 on failure.
+ */
+static int prefetch_range(struct io300_file* f, off_t offset, off_t len) {
+    off_t end = len == 0 ? f->disk_size : offset + len;
+    if (end > f->disk_size) {
+        end = f->disk_size;
+    }
+    if (offset >= end) {
+        return 0;
+    }
+
+    int budget = MAX_BATCH_PAGES;
+    off_t page = offset / CACHE_SLOT_SIZE;
+    off_t const last = (end - 1) / CACHE_SLOT_SIZE;
+    while (page <= last && budget > 0) {
+        if (hash_find(f, page) != NO_SLOT) {
+            page++;
+            continue;
+        }
+        int n = 1;
+        while (page + n <= last && n < budget && hash_find(f, page + n) == NO_SLOT) {
+            n++;
+        }
+        int idx[MAX_BATCH_PAGES];
+        if (load_pages(f, page, n, idx) == -1) {
+            return -1;
+        }
+        page += n;
+        budget -= n;
+    }
+    return 0;
+}
+
+int io300_advise(struct io300_file* const f, int const advice, off_t const offset,
+                 off_t const len) {
+    check_invariants(f);
+    if (offset < 0 || len < 0) {
+        return -1;
+    }
+
+    int const pattern = advice & ~IO300_WILLNEED;
+    int kernel_advice;
+    switch (pattern) {
+    case IO300_NORMAL:
+        f->readahead = MAX_READAHEAD;
+        kernel_advice = POSIX_FADV_NORMAL;
+        break;
+    case IO300_SEQUENTIAL:
+        f->readahead = MAX_HINT_READAHEAD > MAX_READAHEAD ? MAX_HINT_READAHEAD : MAX_READAHEAD;
+        kernel_advice = POSIX_FADV_SEQUENTIAL;
+        break;
+    case IO300_REVERSE:
+        f->readahead = MAX_HINT_READAHEAD > MAX_READAHEAD ? MAX_HINT_READAHEAD : MAX_READAHEAD;
+        // The kernel only ever reads ahead forwards, which is wasted
+        // work for a reverse scan
+        kernel_advice = POSIX_FADV_RANDOM;
+        break;
+    case IO300_RANDOM:
+        f->readahead = 1;
+        kernel_advice = POSIX_FADV_RANDOM;
+        break;
+    default:
+        return -1;
+    }
+    f->hint = pattern;
+
+    // Hints are only hints:  ignore errors from the kernel
+    (void)posix_fadvise(f->fd, offset, len, kernel_advice);
+    if (advice & IO300_WILLNEED) {
+        (void)posix_fadvise(f->fd, offset, len, POSIX_FADV_WILLNEED);
+        (void)prefetch_range(f, offset, len);
+    }
+    return 0;
+}
+
+ssize_t io300_peek(struct io300_file* const f, const char** ptr, size_t const max) {
+    check_invariants(f);
+    f->lent = 0;
+    if (f->pos >= f->size) {
+        return 0;
+    }
+
+    size_t const off = f->pos % CACHE_SLOT_SIZE;
+    size_t n = CACHE_SLOT_SIZE - off;
+    if (n > max) {
+        n = max;
+    }
+    if ((off_t)n > f->size - f->pos) {
+        n = f->size - f->pos;
+    }
+    note_access(f, f->pos, n);
+
+    struct cache_slot* s = get_slot(f, f->pos / CACHE_SLOT_SIZE);
+    if (s == NULL) {
+        return -1;
+    }
+    *ptr = s->data + off;
+    f->lent = n;
+    return n;
+}
+
+int io300_consume(struct io300_file* const f, size_t const nbytes) {
+    check_invariants(f);
+    if (nbytes > f->lent) {
+        return -1;
+    }
+    f->pos += nbytes;
+    f->lent = 0;
+    return 0;
+}
+
+ssize_t io300_reserve(struct io300_file* const f, char** ptr, size_t const max) {
+    check_invariants(f);
+    f->lent = 0;
+    if (!f->writable) {
+        return -1;
+    }
+
+    size_t const off = f->pos % CACHE_SLOT_SIZE;
+    size_t n = CACHE_SLOT_SIZE - off;
+    if (n > max) {
+        n = max;
+    }
+    note_access(f, f->pos, n);
+
+    struct cache_slot* s = get_slot(f, f->pos / CACHE_SLOT_SIZE);
+    if (s == NULL) {
+        return -1;
+    }
+    *ptr = s->data + off;
+    f->lent = n;
+    return n;
+}
+
+int io300_commit(struct io300_file* const f, size_t const nbytes) {
+    check_invariants(f);
+    if (nbytes > f->lent) {
+        return -1;
+    }
+    f->lent = 0;
+    if (nbytes == 0) {
+        return 0;
+    }
+
+    // Still the current slot, since io300_reserve was the last call
+    struct cache_slot* s = get_slot(f, f->pos / CACHE_SLOT_SIZE);
+    if (s == NULL) {
+        return -1;
+    }
+    mark_dirty(s, f->pos % CACHE_SLOT_SIZE, nbytes);
+    f->pos += nbytes;
+    if (f->pos > f->size) {
+        f->size = f->pos;
+    }
+    return 0;
+}
+
+int io300_get_stats(struct io300_file* const f, struct io300_stats* stats) {
+    check_invariants(f);
+    *stats = f->stats;
+    return 0;
+}
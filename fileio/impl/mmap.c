@@ -0,0 +1,341 @@
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <errno.h>
+#include <unistd.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+
+#include "../io300.h"
+
+
+/*
+    mmap.c
+
+    This implementation maps the whole file into memory and serves
+    reads, writes and seeks directly from the mapping, so copying a
+    file makes no read/write/lseek system calls at all.  Writes past
+    the end of the file grow the file (and the mapping) in page-sized
+    steps; the file is trimmed back to its real size and synced to
+    disk when it is closed.
+
+    Since the kernel fills the mapping on page faults, io300_advise
+    hints are passed straight to madvise.  io300_peek and io300_reserve
+    return pointers straight into the mapping.
+
+    The kernel's page faults are invisible from here, so in the
+    statistics every access is a hit, a refill is a (re)mapping of the
+    file and a flush is an msync.
+*/
+
+
+struct io300_file {
+    int fd;
+    /* PROT_* flags used for the mapping */
+    int prot;
+    /* start of the mapping, or NULL if nothing is mapped yet */
+    char* map;
+    /* number of bytes mapped */
+    size_t map_size;
+    /* length of the file on disk:  the real size until a write needs
+       more, then all of the mapping */
+    size_t disk_size;
+    /* logical size of the file; bytes past this in the mapping are zero */
+    off_t size;
+    /* current file position */
+    off_t pos;
+    /* bytes handed out by the last io300_peek or io300_reserve */
+    size_t lent;
+    struct io300_stats stats;
+};
+
+
+static size_t page_round_up(size_t n) {
+    size_t const page = (size_t)sysconf(_SC_PAGESIZE);
+    return (n + page - 1) & ~(page - 1);
+}
+
+/*
+ *  Make sure the file and the mapping hold at least `need` bytes,
+ *  growing both if necessary.  Returns 0 on success, -1 on failure.
+ */
+static int ensure_mapped(struct io300_file* f, size_t need) {
+    if (need <= f->disk_size) {
+        return 0;
+    }
+
+    size_t new_size = f->map_size ? f->map_size : page_round_up(1);
+    while (new_size < need) {
+        new_size *= 2;
+    }
+
+    // Writes past the end of the file would not reach it, so extend
+    // the file to the end of the mapping
+    if (ftruncate(f->fd, new_size) == -1) {
+        perror("ftruncate");
+        return -1;
+    }
+    f->disk_size = new_size;
+    if (new_size == f->map_size) {
+        return 0;
+    }
+
+    char* map;
+    if (f->map == NULL) {
+        map = mmap(NULL, new_size, f->prot, MAP_SHARED, f->fd, 0);
+    } else {
+        map = mremap(f->map, f->map_size, new_size, MREMAP_MAYMOVE);
+    }
+    if (map == MAP_FAILED) {
+        perror("mmap");
+        return -1;
+    }
+
+    f->stats.refills++;
+    f->map = map;
+    f->map_size = new_size;
+    return 0;
+}
+
+struct io300_file* io300_open(const char* path, int mode, char* description) {
+    (void)description;
+
+    int flags = O_CREAT | O_SYNC;
+    int prot = PROT_READ;
+    switch(mode) {
+    case MODE_READ:
+        flags |= O_RDONLY;
+        break;
+    case MODE_WRITE:
+        flags |= O_RDWR | O_TRUNC;
+        prot |= PROT_WRITE;
+        break;
+    case (MODE_READ|MODE_WRITE):
+        flags |= O_RDWR;
+        prot |= PROT_WRITE;
+        break;
+    default:
+        fprintf(stderr, "error: invalid file mode %02x\n", mode);
+        return NULL;
+    }
+
+    int const fd = open(path, flags, S_IRUSR | S_IWUSR);
+    if (fd == -1) {
+        fprintf(stderr, "error: could not open file: `%s`: %s\n", path,
+                strerror(errno));
+        return NULL;
+    }
+
+    struct stat s;
+    if (fstat(fd, &s) == -1 || !S_ISREG(s.st_mode)) {
+        fprintf(stderr, "error: %s is not a regular file, cannot map it\n", path);
+        close(fd);
+        return NULL;
+    }
+
+    struct io300_file* const ret = malloc(sizeof(*ret));
+    if (ret == NULL) {
+        fprintf(stderr, "error: could not allocate io300_file\n");
+        close(fd);
+        return NULL;
+    }
+
+    ret->fd = fd;
+    ret->prot = prot;
+    ret->map = NULL;
+    ret->map_size = 0;
+    ret->disk_size = s.st_size;
+    ret->size = s.st_size;
+    ret->pos = 0;
+    ret->lent = 0;
+    ret->stats = (struct io300_stats){0};
+
+    if (s.st_size > 0) {
+        // Map whole pages.  The file is only extended to the end of its
+        // last page once a write needs that page (see ensure_mapped), so
+        // a program that dies before io300_close leaves it as it was.
+        ret->map_size = page_round_up(s.st_size);
+        ret->map = mmap(NULL, ret->map_size, prot, MAP_SHARED, fd, 0);
+        if (ret->map == MAP_FAILED) {
+            fprintf(stderr, "error: could not map file: `%s`: %s\n", path,
+                    strerror(errno));
+            close(fd);
+            free(ret);
+            return NULL;
+        }
+        ret->stats.refills++;
+    }
+    return ret;
+}
+
+int io300_close(struct io300_file* f) {
+    int ret = 0;
+    if (f->map != NULL) {
+        if (f->prot & PROT_WRITE) {
+            f->stats.flushes++;
+            if (msync(f->map, f->map_size, MS_SYNC) == -1) {
+                perror("msync");
+                ret = -1;
+            }
+        }
+        munmap(f->map, f->map_size);
+    }
+    // Drop any space added past the end of the file while growing it
+    if ((f->prot & PROT_WRITE) && (off_t)f->disk_size != f->size
+        && ftruncate(f->fd, f->size) == -1) {
+        perror("ftruncate");
+        ret = -1;
+    }
+    io300_report_stats(&f->stats);
+    close(f->fd);
+    free(f);
+    return ret;
+}
+
+off_t io300_filesize(struct io300_file* f) {
+    return f->size;
+}
+
+int io300_seek(struct io300_file* f, off_t pos) {
+    if (pos < 0) {
+        return -1;
+    }
+    f->pos = pos;
+    return pos;
+}
+
+int io300_readc(struct io300_file* f) {
+    if (f->pos >= f->size) {
+        return -1;
+    }
+    f->stats.hits++;
+    return (unsigned char)f->map[f->pos++];
+}
+
+int io300_writec(struct io300_file* f, int ch) {
+    char const c = (char)ch;
+    return io300_write(f, &c, 1) == 1 ? ch : -1;
+}
+
+ssize_t io300_read(struct io300_file* f, char* buff, size_t sz) {
+    if (f->pos >= f->size) {
+        return 0;
+    }
+    size_t const left = f->size - f->pos;
+    size_t const n = sz < left ? sz : left;
+    f->stats.hits++;
+    memcpy(buff, f->map + f->pos, n);
+    f->pos += n;
+    return n;
+}
+
+ssize_t io300_write(struct io300_file* f, const char* buff, size_t sz) {
+    if (!(f->prot & PROT_WRITE)) {
+        return -1;
+    }
+    if (ensure_mapped(f, f->pos + sz) == -1) {
+        return -1;
+    }
+    f->stats.hits++;
+    memcpy(f->map + f->pos, buff, sz);
+    f->pos += sz;
+    if (f->pos > f->size) {
+        f->size = f->pos;
+    }
+    return sz;
+}
+
+int io300_advise(struct io300_file* f, int advice, off_t offset, off_t len) {
+    if (offset < 0 || len < 0) {
+        return -1;
+    }
+
+    int kernel_advice;
+    switch (advice & ~IO300_WILLNEED) {
+    case IO300_NORMAL:
+    case IO300_REVERSE:
+        // Fault-around reads the pages on both sides of a fault, which
+        // already suits a reverse scan
+        kernel_advice = MADV_NORMAL;
+        break;
+    case IO300_SEQUENTIAL:
+        kernel_advice = MADV_SEQUENTIAL;
+        break;
+    case IO300_RANDOM:
+        kernel_advice = MADV_RANDOM;
+        break;
+    default:
+        return -1;
+    }
+    if (f->map == NULL) {
+        return 0;
+    }
+
+    // Hints are only hints:  ignore errors from the kernel
+    (void)madvise(f->map, f->map_size, kernel_advice);
+    if ((advice & IO300_WILLNEED) && (size_t)offset < f->map_size) {
+        size_t const start = offset & ~((size_t)sysconf(_SC_PAGESIZE) - 1);
+        size_t end = len == 0 ? f->map_size : page_round_up(offset + len);
+        if (end > f->map_size) {
+            end = f->map_size;
+        }
+        (void)madvise(f->map + start, end - start, MADV_WILLNEED);
+    }
+    return 0;
+}
+
+ssize_t io300_peek(struct io300_file* f, const char** ptr, size_t max) {
+    f->lent = 0;
+    if (f->pos >= f->size) {
+        return 0;
+    }
+    size_t const left = f->size - f->pos;
+    size_t const n = max < left ? max : left;
+    f->stats.hits++;
+    *ptr = f->map + f->pos;
+    f->lent = n;
+    return n;
+}
+
+int io300_consume(struct io300_file* f, size_t nbytes) {
+    if (nbytes > f->lent) {
+        return -1;
+    }
+    f->pos += nbytes;
+    f->lent = 0;
+    return 0;
+}
+
+ssize_t io300_reserve(struct io300_file* f, char** ptr, size_t max) {
+    f->lent = 0;
+    if (!(f->prot & PROT_WRITE) || ensure_mapped(f, f->pos + max) == -1) {
+        return -1;
+    }
+    f->stats.hits++;
+    *ptr = f->map + f->pos;
+    f->lent = max;
+    return max;
+}
+
+int io300_commit(struct io300_file* f, size_t nbytes) {
+    if (nbytes > f->lent) {
+        return -1;
+    }
+    f->lent = 0;
+    if (nbytes == 0) {
+        return 0;
+    }
+    f->pos += nbytes;
+    if (f->pos > f->size) {
+        f->size = f->pos;
+    }
+    return 0;
+}
+
+int io300_get_stats(struct io300_file* f, struct io300_stats* stats) {
+    *stats = f->stats;
+    return 0;
+}
@@ -14,13 +14,24 @@
     naive.c
 
     This implementation wraps the read/write syscalls and performs
-    no caching.
+    no caching, so every access counts as a miss.
+
+    Like stdio.c, naive.c is a baseline the other implementations are
+    timed against, so it only counts when built with -DIO300_NAIVE_STATS
+    (make STATS=1).
 */
 
+#ifdef IO300_NAIVE_STATS
+#define STATS(...) __VA_ARGS__
+#else
+#define STATS(...)
+#endif
+
 
 struct io300_file {
     /* read,write,seek all take a file descriptor as a parameter */
     int fd;
+    STATS(struct io300_stats stats;)
 };
 
 struct io300_file* io300_open(const char* path, int mode, char* description) {
@@ -51,6 +62,7 @@ struct io300_file* io300_open(const char* path, int mode, char* description) {
             free(ret);
             return NULL;
         }
+        STATS(ret->stats = (struct io300_stats){0};)
     } else {
         fprintf(stderr, "error: could not allocate io300_file\n");
     }
@@ -58,6 +70,7 @@ struct io300_file* io300_open(const char* path, int mode, char* description) {
 }
 
 int io300_close(struct io300_file* f) {
+    STATS(io300_report_stats(&f->stats);)
     close(f->fd);
     free(f);
     return 0;
@@ -74,12 +87,38 @@ off_t io300_filesize(struct io300_file* f) {
 }
 
 int io300_seek(struct io300_file* f, off_t pos) {
+    STATS(f->stats.seek_calls++;)
     return lseek(f->fd, pos, SEEK_SET);
 }
 
+/* read() and write() on the file, counting each call (see above) */
+static ssize_t counted_read(struct io300_file* f, char* buff, size_t sz) {
+    STATS(f->stats.misses++;)
+    STATS(f->stats.read_calls++;)
+    ssize_t const n = read(f->fd, buff, sz);
+#ifdef IO300_NAIVE_STATS
+    if (n > 0) {
+        f->stats.bytes_read += n;
+    }
+#endif
+    return n;
+}
+
+static ssize_t counted_write(struct io300_file* f, const char* buff, size_t sz) {
+    STATS(f->stats.misses++;)
+    STATS(f->stats.write_calls++;)
+    ssize_t const n = write(f->fd, buff, sz);
+#ifdef IO300_NAIVE_STATS
+    if (n > 0) {
+        f->stats.bytes_written += n;
+    }
+#endif
+    return n;
+}
+
 int io300_readc(struct io300_file* f) {
     unsigned char c;
-    if (read(f->fd, &c, 1) == 1) {
+    if (counted_read(f, (char*)&c, 1) == 1) {
         return c;
     } else {
         return -1;
@@ -87,12 +126,23 @@ int io300_readc(struct io300_file* f) {
 }
 int io300_writec(struct io300_file* f, int ch) {
     char const c = (char)ch;
-    return write(f->fd, &c, 1) == 1 ? ch : -1;
+    return counted_write(f, &c, 1) == 1 ? ch : -1;
 }
 
 ssize_t io300_read(struct io300_file* f, char* buff, size_t sz) {
-    return read(f->fd, buff, sz);
+    return counted_read(f, buff, sz);
 }
 ssize_t io300_write(struct io300_file* f, const char* buff, size_t sz) {
-    return write(f->fd, buff, sz);
+    return counted_write(f, buff, sz);
+}
+
+int io300_get_stats(struct io300_file* f, struct io300_stats* stats) {
+#ifdef IO300_NAIVE_STATS
+    *stats = f->stats;
+    return 0;
+#else
+    (void)f;
+    (void)stats;
+    return -1;
+#endif
 }
@@ -14,14 +14,114 @@
     stdio.c
 
     This implementation wraps the stdio cached read/write calls.
+
+    stdio makes its system calls inside the C library, where we cannot
+    count them directly.  Instead, the statistics are worked out from
+    how each call changed the FILE's buffer pointers (glibc keeps them
+    in the public part of FILE):  a read that needed more bytes than
+    the buffer held is a miss and a refill, a write that emptied the
+    buffer is a flush, and every seek makes an lseek (glibc makes one
+    even to move within the buffer).  For the test programs, the counts
+    match what strace shows.  Without glibc the buffer cannot be seen,
+    so every access counts as a miss that made a system call.
+
+    Looking at the buffer before and after every call costs several
+    times what a buffered fgetc does, and stdio is the baseline every
+    other implementation is timed against, so the counting is only
+    compiled in with -DIO300_STDIO_STATS (make STATS=1).  Otherwise
+    io300_get_stats reports that there are no statistics.
 */
 
+#ifdef IO300_STDIO_STATS
+#define STATS(...) __VA_ARGS__
+#else
+#define STATS(...)
+#endif
+
 
 struct io300_file {
     /* stdio calls require a FILE *, not a file descriptor */
     FILE *f;
+    STATS(struct io300_stats stats;)
+};
+
+#ifdef IO300_STDIO_STATS
+
+/* The parts of a FILE's state that tell which system calls it made */
+struct buffer_state {
+    /* bytes buffered for reading, and for writing */
+    size_t readable;
+    size_t pending;
+    /* bytes the buffer was last filled with, and how many of them were used */
+    size_t filled;
+    size_t used;
+    /* file offset the stream thinks the kernel is at, or -1 */
+    off_t offset;
 };
 
+static struct buffer_state buffer_state(FILE* fp) {
+    struct buffer_state b = {0, 0, 0, 0, -1};
+#ifdef __GLIBC__
+    b.readable = fp->_IO_read_end - fp->_IO_read_ptr;
+    b.pending = fp->_IO_write_ptr - fp->_IO_write_base;
+    b.filled = fp->_IO_read_end - fp->_IO_read_base;
+    b.used = fp->_IO_read_ptr - fp->_IO_read_base;
+    b.offset = fp->_offset;
+#else
+    (void)fp;
+#endif
+    return b;
+}
+
+/* Count the write-back of buffered bytes, if the last call did one */
+static void count_flush(struct io300_file* f, struct buffer_state const* before,
+                        struct buffer_state const* after, size_t written) {
+    size_t const out = before->pending + written;
+    if (out > after->pending) {
+        f->stats.flushes++;
+        f->stats.write_calls++;
+        f->stats.bytes_written += out - after->pending;
+    }
+}
+
+/* Count a read of `sz` bytes that returned `n`, given the buffer before and after */
+static void count_read(struct io300_file* f, struct buffer_state const* before,
+                       struct buffer_state const* after, size_t sz, size_t n) {
+    count_flush(f, before, after, 0);
+#ifdef __GLIBC__
+    if (sz <= before->readable) {
+        f->stats.hits++;
+        return;
+    }
+#endif
+    f->stats.misses++;
+    f->stats.refills++;
+    f->stats.read_calls++;
+
+    // Bytes that came from neither the old nor the new buffer were read
+    // straight into the caller's memory (fread does this for big reads)
+    size_t const old_bytes = n < before->readable ? n : before->readable;
+    size_t const new_bytes = after->used < n - old_bytes ? after->used : n - old_bytes;
+    size_t const direct = n - old_bytes - new_bytes;
+    if (direct > 0 && after->filled > 0) {
+        f->stats.read_calls++;
+    }
+    f->stats.bytes_read += direct + after->filled;
+}
+
+/* Count a write of `n` bytes, given the buffer before and after */
+static void count_write(struct io300_file* f, struct buffer_state const* before,
+                        struct buffer_state const* after, size_t n) {
+    unsigned long const flushes = f->stats.flushes;
+    count_flush(f, before, after, n);
+    if (f->stats.flushes == flushes) {
+        f->stats.hits++;
+    } else {
+        f->stats.misses++;
+    }
+}
+#endif
+
 
 struct io300_file* io300_open(const char* path, int mode, char* description) {
     (void)description;
@@ -51,6 +151,7 @@ struct io300_file* io300_open(const char* path, int mode, char* description) {
             free(ret);
             return NULL;
         }
+        STATS(ret->stats = (struct io300_stats){0};)
     } else {
         fprintf(stderr, "error: could not allocate io300_file\n");
     }
@@ -58,12 +159,17 @@ struct io300_file* io300_open(const char* path, int mode, char* description) {
 }
 
 int io300_flush(struct io300_file* f) {
-    return fflush(f->f);
+    STATS(struct buffer_state const before = buffer_state(f->f);)
+    int const r = fflush(f->f);
+    STATS(struct buffer_state const after = buffer_state(f->f);)
+    STATS(count_flush(f, &before, &after, 0);)
+    return r;
 }
 
 int io300_close(struct io300_file* f) {
     io300_flush(f);
     int const ret = fclose(f->f);
+    STATS(io300_report_stats(&f->stats);)
     free(f);
     return ret;
 }
@@ -79,19 +185,49 @@ off_t io300_filesize(struct io300_file* f) {
 }
 
 int io300_seek(struct io300_file* f, off_t pos) {
-    return fseek(f->f, pos, SEEK_SET);
+    STATS(struct buffer_state const before = buffer_state(f->f);)
+    int const r = fseek(f->f, pos, SEEK_SET);
+    STATS(struct buffer_state const after = buffer_state(f->f);)
+
+#ifdef IO300_STDIO_STATS
+    count_flush(f, &before, &after, 0);
+    // glibc always makes an lseek, even to move within the buffer, plus
+    // one more to line the file up before writing back buffered bytes
+    f->stats.seek_calls += before.pending > 0 ? 2 : 1;
+    // If `pos` is outside the buffer, it seeks to the start of its block
+    // and reads from there right away
+    int const refilled = before.pending > 0 || before.filled == 0
+        || after.offset != before.offset;
+    if (refilled && after.filled > 0) {
+        f->stats.refills++;
+        f->stats.read_calls++;
+        f->stats.bytes_read += after.filled;
+    }
+#endif
+    return r;
 }
 
 int io300_readc(struct io300_file* f) {
-    return fgetc(f->f);
+    STATS(struct buffer_state const before = buffer_state(f->f);)
+    int const c = fgetc(f->f);
+    STATS(struct buffer_state const after = buffer_state(f->f);)
+    STATS(count_read(f, &before, &after, 1, c == EOF ? 0 : 1);)
+    return c;
 }
 
 int io300_writec(struct io300_file* f, int ch) {
-    return fputc(ch, f->f);
+    STATS(struct buffer_state const before = buffer_state(f->f);)
+    int const c = fputc(ch, f->f);
+    STATS(struct buffer_state const after = buffer_state(f->f);)
+    STATS(count_write(f, &before, &after, c == EOF ? 0 : 1);)
+    return c;
 }
 
 ssize_t io300_read(struct io300_file* f, char *buff, size_t sz) {
+    STATS(struct buffer_state const before = buffer_state(f->f);)
     size_t const n = fread(buff, 1, sz, f->f);
+    STATS(struct buffer_state const after = buffer_state(f->f);)
+    STATS(count_read(f, &before, &after, sz, n);)
     if (n != 0 || sz == 0 || !ferror(f->f)) {
         return n;
     } else {
@@ -100,10 +236,24 @@ ssize_t io300_read(struct io300_file* f, char *buff, size_t sz) {
 }
 
 ssize_t io300_write(struct io300_file* f, const char* buff, size_t sz) {
+    STATS(struct buffer_state const before = buffer_state(f->f);)
     size_t const n = fwrite(buff, 1, sz, f->f);
+    STATS(struct buffer_state const after = buffer_state(f->f);)
+    STATS(count_write(f, &before, &after, n);)
     if (n != 0 || sz == 0 || !ferror(f->f)) {
         return n;
     } else {
         return -1;
     }
 }
+
+int io300_get_stats(struct io300_file* f, struct io300_stats* stats) {
+#ifdef IO300_STDIO_STATS
+    *stats = f->stats;
+    return 0;
+#else
+    (void)f;
+    (void)stats;
+    return -1;
+#endif
+}
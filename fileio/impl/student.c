@@ -171,6 +171,11 @@ int io300_close(struct io300_file* const f) {
            f->description, f->stats.read_calls, f->stats.write_calls,
            f->stats.seeks);
 #endif
+    // Hand the counts to the test scripts, which show them next to each result
+    struct io300_stats stats;
+    if (io300_get_stats(f, &stats) == 0) {
+        io300_report_stats(&stats);
+    }
 
     // TODO: Implement!
 
@@ -270,3 +275,18 @@ int flush(struct io300_file* const f) {
 
     return 0;
 }
+
+/*
+ * io300_get_stats: the counts kept in f->stats, in the form the test
+ * scripts read (struct io300_stats in io300.h).  Fields your stats do
+ * not track are reported as 0.
+ */
+int io300_get_stats(struct io300_file* const f, struct io300_stats* stats) {
+    check_invariants(f);
+    *stats = (struct io300_stats){
+        .read_calls = f->stats.read_calls,
+        .write_calls = f->stats.write_calls,
+        .seek_calls = f->stats.seeks,
+    };
+    return 0;
+}
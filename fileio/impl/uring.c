@@ -0,0 +1,766 @@
+#define _GNU_SOURCE
+#include <assert.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <linux/io_uring.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/syscall.h>
+#include <sys/types.h>
+#include <unistd.h>
+
+#include "../io300.h"
+
+/*
+    uring.c
+
+    This implementation caches URING_SLOTS pages of CACHE_SIZE bytes,
+    like lru.c, but does its I/O through io_uring (using the raw
+    io_uring_setup/io_uring_enter system calls, without liburing).
+
+    Each cache miss becomes one batch of requests submitted and reaped
+    with a single io_uring_enter:
+    - a read of the missing page, plus readahead reads for up to
+      URING_QUEUE_DEPTH - 1 further pages in the direction the reader
+      is moving;
+    - write-backs of the dirty pages being evicted, each linked
+      (IOSQE_IO_LINK) to the read that reuses its buffer, plus
+      write-backs of the oldest other dirty pages, so later evictions
+      are usually clean.
+
+    If the kernel has no io_uring (or it is disabled by setting the
+    IO300_URING_DISABLE environment variable), the same batches are run
+    one request at a time with pread/pwrite.
+
+    In the statistics, each request sent through the ring counts as one
+    read or write call, each batch started by a miss is one refill, and
+    each page written back is one flush.
+*/
+
+#ifndef CACHE_SIZE
+#define CACHE_SIZE 8
+#endif
+
+#ifndef URING_SLOTS
+#define URING_SLOTS 64
+#endif
+
+#ifndef URING_QUEUE_DEPTH
+#define URING_QUEUE_DEPTH 8
+#endif
+
+#if (CACHE_SIZE < 1 || URING_QUEUE_DEPTH < 1 || URING_SLOTS < 2 * URING_QUEUE_DEPTH)
+#error "need CACHE_SIZE >= 1, URING_QUEUE_DEPTH >= 1, URING_SLOTS >= 2 * URING_QUEUE_DEPTH"
+#endif
+
+/* A batch holds at most a read and a write per page, plus extra write-backs */
+#define MAX_BATCH (3 * URING_QUEUE_DEPTH)
+
+#define NO_PAGE ((off_t)-1)
+
+struct cache_slot {
+    /* file page held by this slot, or NO_PAGE if the slot is free */
+    off_t page;
+    /* bytes [dirty_lo, dirty_hi) of the slot were modified since it was loaded */
+    size_t dirty_lo;
+    size_t dirty_hi;
+    /* value of the use counter when the slot was last used */
+    unsigned long last_used;
+    char* data;
+};
+
+enum request_op {
+    REQ_READ,
+    REQ_WRITE,
+};
+
+struct request {
+    enum request_op op;
+    int slot;
+    /* region of the slot's data to transfer */
+    size_t lo;
+    size_t hi;
+    /* file offset of the slot's first byte */
+    off_t base;
+    /* the next request in the batch must wait for this one */
+    int linked;
+    /* nonzero if the ring completed this request */
+    int ran;
+    /* bytes transferred, or -errno */
+    ssize_t result;
+};
+
+/* Shared memory of an io_uring instance */
+struct ring {
+    int fd;
+    unsigned* sq_head;
+    unsigned* sq_tail;
+    unsigned* sq_mask;
+    unsigned* sq_array;
+    struct io_uring_sqe* sqes;
+    unsigned* cq_head;
+    unsigned* cq_tail;
+    unsigned* cq_mask;
+    struct io_uring_cqe* cqes;
+    void* sq_map;
+    size_t sq_map_size;
+    void* cq_map;
+    size_t cq_map_size;
+    size_t sqes_size;
+};
+
+struct io300_file {
+    /* read,write,seek all take a file descriptor as a parameter */
+    int fd;
+    /* nonzero if the file was opened for writing */
+    int writable;
+
+    /* current file position */
+    off_t pos;
+    /* logical size of the file, including data not yet written back */
+    off_t size;
+    /* size of the file on disk:  pages past this need not be read */
+    off_t disk_size;
+
+    char* cache;
+    struct cache_slot slots[URING_SLOTS];
+    /* slot used most recently */
+    int current;
+    /* incremented on every slot use, for LRU eviction */
+    unsigned long use_clock;
+    /* page of the previous miss, to tell which way the reader moves */
+    off_t last_miss;
+
+    /* nonzero if `ring` is set up; otherwise use pread/pwrite */
+    int have_ring;
+    struct ring ring;
+
+    struct io300_stats stats;
+
+    /* Used for debugging, keep track of which io300_file is which */
+    char* description;
+};
+
+static void check_invariants(struct io300_file* f) {
+    assert(f != NULL);
+    assert(f->cache != NULL);
+    assert(f->fd >= 0);
+    assert(f->pos >= 0);
+    assert(f->disk_size <= f->size);
+}
+
+static int ring_setup(struct ring* r, unsigned entries) {
+    struct io_uring_params p;
+    memset(&p, 0, sizeof(p));
+    r->fd = syscall(__NR_io_uring_setup, entries, &p);
+    if (r->fd < 0) {
+        return -1;
+    }
+
+    r->sq_map_size = p.sq_off.array + p.sq_entries * sizeof(unsigned);
+    r->cq_map_size = p.cq_off.cqes + p.cq_entries * sizeof(struct io_uring_cqe);
+    int const single_mmap = (p.features & IORING_FEAT_SINGLE_MMAP) != 0;
+    if (single_mmap && r->cq_map_size > r->sq_map_size) {
+        r->sq_map_size = r->cq_map_size;
+    }
+
+    r->sq_map = mmap(NULL, r->sq_map_size, PROT_READ | PROT_WRITE,
+                     MAP_SHARED | MAP_POPULATE, r->fd, IORING_OFF_SQ_RING);
+    if (r->sq_map == MAP_FAILED) {
+        close(r->fd);
+        return -1;
+    }
+    if (single_mmap) {
+        r->cq_map = r->sq_map;
+    } else {
+        r->cq_map = mmap(NULL, r->cq_map_size, PROT_READ | PROT_WRITE,
+                         MAP_SHARED | MAP_POPULATE, r->fd, IORING_OFF_CQ_RING);
+        if (r->cq_map == MAP_FAILED) {
+            munmap(r->sq_map, r->sq_map_size);
+            close(r->fd);
+            return -1;
+        }
+    }
+
+    r->sqes_size = p.sq_entries * sizeof(struct io_uring_sqe);
+    r->sqes = mmap(NULL, r->sqes_size, PROT_READ | PROT_WRITE,
+                   MAP_SHARED | MAP_POPULATE, r->fd, IORING_OFF_SQES);
+    if (r->sqes == MAP_FAILED) {
+        if (r->cq_map != r->sq_map) {
+            munmap(r->cq_map, r->cq_map_size);
+        }
+        munmap(r->sq_map, r->sq_map_size);
+        close(r->fd);
+        return -1;
+    }
+
+    char* const sq = r->sq_map;
+    r->sq_head = (unsigned*)(sq + p.sq_off.head);
+    r->sq_tail = (unsigned*)(sq + p.sq_off.tail);
+    r->sq_mask = (unsigned*)(sq + p.sq_off.ring_mask);
+    r->sq_array = (unsigned*)(sq + p.sq_off.array);
+    char* const cq = r->cq_map;
+    r->cq_head = (unsigned*)(cq + p.cq_off.head);
+    r->cq_tail = (unsigned*)(cq + p.cq_off.tail);
+    r->cq_mask = (unsigned*)(cq + p.cq_off.ring_mask);
+    r->cqes = (struct io_uring_cqe*)(cq + p.cq_off.cqes);
+    return 0;
+}
+
+static void ring_teardown(struct ring* r) {
+    munmap(r->sqes, r->sqes_size);
+    if (r->cq_map != r->sq_map) {
+        munmap(r->cq_map, r->cq_map_size);
+    }
+    munmap(r->sq_map, r->sq_map_size);
+    close(r->fd);
+}
+
+/* Record the completions waiting in the ring; returns how many there were */
+static int ring_reap(struct ring* r, struct request* reqs) {
+    int reaped = 0;
+    unsigned head = *r->cq_head;
+    while (head != __atomic_load_n(r->cq_tail, __ATOMIC_ACQUIRE)) {
+        struct io_uring_cqe* cqe = &r->cqes[head & *r->cq_mask];
+        reqs[cqe->user_data].result = cqe->res;
+        reqs[cqe->user_data].ran = 1;
+        head++;
+        reaped++;
+    }
+    __atomic_store_n(r->cq_head, head, __ATOMIC_RELEASE);
+    return reaped;
+}
+
+/*
+ *  Run a batch of requests through the ring:  one io_uring_enter
+ *  submits them all and waits for every completion.
+ *  Returns 0 on success, -1 if the ring itself failed (every request
+ *  the kernel took has completed, and has `ran` set), or -2 if the ring
+ *  failed with requests still in flight.
+ */
+static int ring_run(struct io300_file* f, struct request* reqs, int n) {
+    struct ring* r = &f->ring;
+
+    unsigned tail = *r->sq_tail;
+    unsigned const first = tail;
+    unsigned const mask = *r->sq_mask;
+    for (int i = 0; i < n; i++) {
+        struct request* q = &reqs[i];
+        unsigned const idx = tail & mask;
+        struct io_uring_sqe* sqe = &r->sqes[idx];
+        memset(sqe, 0, sizeof(*sqe));
+        sqe->opcode = q->op == REQ_READ ? IORING_OP_READ : IORING_OP_WRITE;
+        sqe->fd = f->fd;
+        sqe->addr = (unsigned long)(f->slots[q->slot].data + q->lo);
+        sqe->len = q->hi - q->lo;
+        sqe->off = q->base + q->lo;
+        sqe->flags = q->linked ? IOSQE_IO_LINK : 0;
+        sqe->user_data = i;
+        q->ran = 0;
+        r->sq_array[idx] = idx;
+        tail++;
+    }
+    __atomic_store_n(r->sq_tail, tail, __ATOMIC_RELEASE);
+
+    int submitted = 0;
+    int completed = 0;
+    while (completed < n) {
+        int const ret = syscall(__NR_io_uring_enter, r->fd, n - submitted,
+                                n - completed, IORING_ENTER_GETEVENTS, NULL, 0);
+        if (ret < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            // Wait for every request the kernel already took, so none of
+            // them writes into a slot buffer after we stop using the ring
+            int const taken = __atomic_load_n(r->sq_head, __ATOMIC_ACQUIRE) - first;
+            completed += ring_reap(r, reqs);
+            while (completed < taken) {
+                if (syscall(__NR_io_uring_enter, r->fd, 0, taken - completed,
+                            IORING_ENTER_GETEVENTS, NULL, 0) < 0 && errno != EINTR) {
+                    return -2;
+                }
+                completed += ring_reap(r, reqs);
+            }
+            return -1;
+        }
+        submitted += ret;
+        completed += ring_reap(r, reqs);
+    }
+    return 0;
+}
+
+/*
+ *  Run a batch of requests, in order.  Requests that the ring could not
+ *  finish (failed, short writes, cancelled because a linked write was
+ *  short, or never run because the ring itself failed) are completed
+ *  here with pread/pwrite.  Afterwards, each request's result is the
+ *  number of bytes transferred.
+ *  Returns 0 on success, -1 on failure.
+ */
+static int run_batch(struct io300_file* f, struct request* reqs, int n) {
+    if (n == 0) {
+        return 0;
+    }
+
+    if (f->have_ring) {
+        int const ret = ring_run(f, reqs, n);
+        if (ret != 0) {
+            // Give up on the ring for good; what it did not finish is redone by hand
+            ring_teardown(&f->ring);
+            f->have_ring = 0;
+        }
+        if (ret == -2) {
+            // Requests in flight might still land in the slot buffers
+            return -1;
+        }
+    }
+
+    for (int i = 0; i < n; i++) {
+        struct request* q = &reqs[i];
+        char* const data = f->slots[q->slot].data + q->lo;
+        off_t const off = q->base + q->lo;
+        size_t const len = q->hi - q->lo;
+
+        size_t done = 0;
+        if (q->ran) {
+            if (q->op == REQ_READ) {
+                f->stats.read_calls++;
+            } else {
+                f->stats.write_calls++;
+            }
+        }
+        if (q->ran && q->result >= 0) {
+            done = q->result;
+            if (q->op == REQ_READ) {
+                f->stats.bytes_read += done;
+                // A short read from the ring means we reached EOF
+                continue;
+            }
+            f->stats.bytes_written += done;
+        }
+
+        while (done < len) {
+            ssize_t r;
+            if (q->op == REQ_READ) {
+                f->stats.read_calls++;
+                r = pread(f->fd, data + done, len - done, off + done);
+            } else {
+                f->stats.write_calls++;
+                r = pwrite(f->fd, data + done, len - done, off + done);
+            }
+            if (r == -1 || (r == 0 && q->op == REQ_WRITE)) {
+                return -1;
+            } else if (r == 0) {
+                break;
+            }
+            if (q->op == REQ_READ) {
+                f->stats.bytes_read += r;
+            } else {
+                f->stats.bytes_written += r;
+            }
+            done += r;
+        }
+        q->result = done;
+    }
+    return 0;
+}
+
+static int find_slot(struct io300_file* f, off_t page) {
+    for (int i = 0; i < URING_SLOTS; i++) {
+        if (f->slots[i].page == page) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+/* Least recently used slot that is not already part of the current batch */
+static int pick_victim(struct io300_file* f, unsigned long batch_start) {
+    int victim = -1;
+    for (int i = 0; i < URING_SLOTS; i++) {
+        struct cache_slot* s = &f->slots[i];
+        if (s->last_used > batch_start) {
+            continue;
+        }
+        if (victim == -1 || s->last_used < f->slots[victim].last_used) {
+            victim = i;
+        }
+    }
+    return victim;
+}
+
+static void add_write(struct io300_file* f, struct request* reqs, int* n,
+                      int slot, int linked) {
+    struct cache_slot* s = &f->slots[slot];
+    f->stats.flushes++;
+    reqs[*n] = (struct request){
+        .op = REQ_WRITE,
+        .slot = slot,
+        .lo = s->dirty_lo,
+        .hi = s->dirty_hi,
+        .base = s->page * CACHE_SIZE,
+        .linked = linked,
+    };
+    (*n)++;
+}
+
+/*
+ *  Load `page` (plus readahead pages) into the cache, writing back the
+ *  pages they replace.  Returns the slot holding `page`, or -1.
+ */
+static int fetch_pages(struct io300_file* f, off_t page) {
+    int const dir = page < f->last_miss ? -1 : 1;
+    f->last_miss = page;
+    f->stats.refills++;
+
+    off_t pages[URING_QUEUE_DEPTH];
+    int npages = 1;
+    pages[0] = page;
+    for (off_t p = page + dir; npages < URING_QUEUE_DEPTH; p += dir) {
+        if (p < 0 || p * CACHE_SIZE >= f->disk_size || find_slot(f, p) != -1) {
+            break;
+        }
+        pages[npages++] = p;
+    }
+
+    struct request reqs[MAX_BATCH];
+    int n = 0;
+    int writes = 0;
+    int slots[URING_QUEUE_DEPTH];
+    /* slots of the extra write-backs, which stay cached */
+    int cleaned[URING_QUEUE_DEPTH];
+    int ncleaned = 0;
+    unsigned long const batch_start = f->use_clock;
+
+    for (int j = 0; j < npages; j++) {
+        int const i = pick_victim(f, batch_start);
+        struct cache_slot* s = &f->slots[i];
+        off_t const base = pages[j] * CACHE_SIZE;
+        int const needs_read = base < f->disk_size;
+
+        if (s->page != NO_PAGE && s->dirty_hi > 0) {
+            // The read below reuses this buffer, so it must wait for the write
+            add_write(f, reqs, &n, i, needs_read);
+            writes++;
+        }
+        if (needs_read) {
+            reqs[n++] = (struct request){
+                .op = REQ_READ, .slot = i, .lo = 0, .hi = CACHE_SIZE,
+                .base = base, .linked = 0,
+            };
+        }
+        slots[j] = i;
+        s->last_used = ++f->use_clock;
+    }
+
+    // Once we are paying for a write-back, clean out other old dirty pages too
+    while (writes > 0 && writes < URING_QUEUE_DEPTH) {
+        int oldest = -1;
+        for (int i = 0; i < URING_SLOTS; i++) {
+            struct cache_slot* s = &f->slots[i];
+            if (s->page == NO_PAGE || s->dirty_hi == 0 || s->last_used > batch_start) {
+                continue;
+            }
+            int chosen = 0;
+            for (int c = 0; c < ncleaned; c++) {
+                chosen |= cleaned[c] == i;
+            }
+            if (chosen) {
+                continue;
+            }
+            if (oldest == -1 || s->last_used < f->slots[oldest].last_used) {
+                oldest = i;
+            }
+        }
+        if (oldest == -1) {
+            break;
+        }
+        add_write(f, reqs, &n, oldest, 0);
+        cleaned[ncleaned++] = oldest;
+        writes++;
+    }
+
+    // If the batch fails, the extra write-backs' pages are still dirty
+    if (run_batch(f, reqs, n) == -1) {
+        return -1;
+    }
+    for (int k = 0; k < n; k++) {
+        struct request const* q = &reqs[k];
+        struct cache_slot* s = &f->slots[q->slot];
+        int extra = 0;
+        for (int c = 0; c < ncleaned; c++) {
+            extra |= cleaned[c] == q->slot;
+        }
+        if (extra && q->op == REQ_WRITE && q->lo == s->dirty_lo && q->hi == s->dirty_hi
+            && q->result >= (ssize_t)(q->hi - q->lo)) {
+            s->dirty_lo = s->dirty_hi = 0;
+        }
+    }
+
+    for (int k = 0; k < n; k++) {
+        if (reqs[k].op == REQ_WRITE) {
+            off_t const end = reqs[k].base + reqs[k].hi;
+            if (end > f->disk_size) {
+                f->disk_size = end;
+            }
+        }
+    }
+
+    for (int j = 0; j < npages; j++) {
+        struct cache_slot* s = &f->slots[slots[j]];
+        size_t got = 0;
+        for (int k = 0; k < n; k++) {
+            if (reqs[k].op == REQ_READ && reqs[k].slot == slots[j]) {
+                got = reqs[k].result;
+            }
+        }
+        memset(s->data + got, 0, CACHE_SIZE - got);
+        s->page = pages[j];
+        s->dirty_lo = s->dirty_hi = 0;
+    }
+    return slots[0];
+}
+
+/*
+ *  Return the slot holding `page`, loading it if necessary.
+ *  Returns NULL on failure.
+ */
+static struct cache_slot* get_slot(struct io300_file* f, off_t page) {
+    int i = f->current;
+    if (f->slots[i].page != page) {
+        i = find_slot(f, page);
+        if (i == -1) {
+            f->stats.misses++;
+            i = fetch_pages(f, page);
+            if (i == -1) {
+                return NULL;
+            }
+        } else {
+            f->stats.hits++;
+        }
+        f->current = i;
+    } else {
+        f->stats.hits++;
+    }
+    f->slots[i].last_used = ++f->use_clock;
+    return &f->slots[i];
+}
+
+struct io300_file* io300_open(const char* const path, int mode, char* description) {
+    if (path == NULL) {
+        fprintf(stderr, "error: null file path\n");
+        return NULL;
+    }
+
+    int flags = O_CREAT | O_SYNC;
+    switch(mode) {
+    case MODE_READ:
+        flags |= O_RDONLY;
+        break;
+    case MODE_WRITE:
+        flags |= O_RDWR | O_TRUNC;
+        break;
+    case (MODE_READ|MODE_WRITE):
+        flags |= O_RDWR;
+        break;
+    default:
+        fprintf(stderr, "error: invalid file mode %02x\n", mode);
+        return NULL;
+    }
+
+    int const fd = open(path, flags, S_IRUSR | S_IWUSR);
+    if (fd == -1) {
+        fprintf(stderr, "error: could not open file: `%s`: %s\n", path,
+                strerror(errno));
+        return NULL;
+    }
+
+    struct stat st;
+    if (fstat(fd, &st) == -1 || !S_ISREG(st.st_mode)) {
+        fprintf(stderr, "error: %s is not a regular file\n", path);
+        close(fd);
+        return NULL;
+    }
+
+    struct io300_file* const ret = malloc(sizeof(*ret));
+    if (ret == NULL) {
+        fprintf(stderr, "error: could not allocate io300_file\n");
+        close(fd);
+        return NULL;
+    }
+
+    ret->cache = malloc((size_t)URING_SLOTS * CACHE_SIZE);
+    if (ret->cache == NULL) {
+        fprintf(stderr, "error: could not allocate file cache\n");
+        close(fd);
+        free(ret);
+        return NULL;
+    }
+
+    ret->fd = fd;
+    ret->writable = (mode & MODE_WRITE) != 0;
+    ret->pos = 0;
+    ret->size = st.st_size;
+    ret->disk_size = st.st_size;
+    ret->current = 0;
+    ret->use_clock = 0;
+    ret->last_miss = 0;
+    ret->stats = (struct io300_stats){0};
+    ret->description = description;
+    for (int i = 0; i < URING_SLOTS; i++) {
+        ret->slots[i].page = NO_PAGE;
+        ret->slots[i].dirty_lo = ret->slots[i].dirty_hi = 0;
+        ret->slots[i].last_used = 0;
+        ret->slots[i].data = ret->cache + (size_t)i * CACHE_SIZE;
+    }
+
+    ret->have_ring = getenv("IO300_URING_DISABLE") == NULL
+        && ring_setup(&ret->ring, MAX_BATCH) == 0;
+
+    check_invariants(ret);
+    return ret;
+}
+
+int io300_close(struct io300_file* const f) {
+    check_invariants(f);
+
+    // Write back every dirty page in one batch (or several, if many)
+    int ret = 0;
+    struct request reqs[MAX_BATCH];
+    int n = 0;
+    for (int i = 0; i < URING_SLOTS; i++) {
+        if (f->slots[i].page != NO_PAGE && f->slots[i].dirty_hi > 0) {
+            add_write(f, reqs, &n, i, 0);
+        }
+        if (n == MAX_BATCH || (i == URING_SLOTS - 1 && n > 0)) {
+            if (run_batch(f, reqs, n) == -1) {
+                ret = -1;
+            }
+            n = 0;
+        }
+    }
+
+    io300_report_stats(&f->stats);
+    if (f->have_ring) {
+        ring_teardown(&f->ring);
+    }
+    close(f->fd);
+    free(f->cache);
+    free(f);
+    return ret;
+}
+
+off_t io300_filesize(struct io300_file* const f) {
+    check_invariants(f);
+    return f->size;
+}
+
+int io300_seek(struct io300_file* const f, off_t const pos) {
+    check_invariants(f);
+    if (pos < 0) {
+        return -1;
+    }
+    f->pos = pos;
+    return pos;
+}
+
+int io300_readc(struct io300_file* const f) {
+    check_invariants(f);
+    if (f->pos >= f->size) {
+        return -1;
+    }
+
+    struct cache_slot* s = get_slot(f, f->pos / CACHE_SIZE);
+    if (s == NULL) {
+        return -1;
+    }
+    unsigned char const c = s->data[f->pos % CACHE_SIZE];
+    f->pos++;
+    return c;
+}
+
+int io300_writec(struct io300_file* f, int ch) {
+    char const c = (char)ch;
+    return io300_write(f, &c, 1) == 1 ? (unsigned char)c : -1;
+}
+
+ssize_t io300_read(struct io300_file* const f, char* const buff,
+                   size_t const sz) {
+    check_invariants(f);
+    if (f->pos >= f->size) {
+        return 0;
+    }
+
+    size_t total = sz;
+    if ((off_t)total > f->size - f->pos) {
+        total = f->size - f->pos;
+    }
+
+    size_t done = 0;
+    while (done < total) {
+        struct cache_slot* s = get_slot(f, f->pos / CACHE_SIZE);
+        if (s == NULL) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos % CACHE_SIZE;
+        size_t n = CACHE_SIZE - off;
+        if (n > total - done) {
+            n = total - done;
+        }
+        memcpy(buff + done, s->data + off, n);
+        done += n;
+        f->pos += n;
+    }
+    return done;
+}
+
+ssize_t io300_write(struct io300_file* const f, const char* buff,
+                    size_t const sz) {
+    check_invariants(f);
+    if (!f->writable) {
+        return -1;
+    }
+
+    size_t done = 0;
+    while (done < sz) {
+        struct cache_slot* s = get_slot(f, f->pos / CACHE_SIZE);
+        if (s == NULL) {
+            return done > 0 ? (ssize_t)done : -1;
+        }
+        size_t const off = f->pos % CACHE_SIZE;
+        size_t n = CACHE_SIZE - off;
+        if (n > sz - done) {
+            n = sz - done;
+        }
+        memcpy(s->data + off, buff + done, n);
+
+        if (s->dirty_hi == 0) {
+            s->dirty_lo = off;
+            s->dirty_hi = off + n;
+        } else {
+            if (off < s->dirty_lo) {
+                s->dirty_lo = off;
+            }
+            if (off + n > s->dirty_hi) {
+                s->dirty_hi = off + n;
+            }
+        }
+
+        done += n;
+        f->pos += n;
+        if (f->pos > f->size) {
+            f->size = f->pos;
+        }
+    }
+    return done;
+}
+
+int io300_get_stats(struct io300_file* const f, struct io300_stats* stats) {
+    check_invariants(f);
+    *stats = f->stats;
+    return 0;
+}
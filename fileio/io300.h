@@ -86,4 +86,180 @@ ssize_t io300_read(struct io300_file* f, char* buff, size_t nbytes);
 ssize_t io300_write(struct io300_file* f, const char* buff, size_t nbytes);
 
 
+/*
+    Positional and batch I/O
+
+    These calls name the file offset of every transfer explicitly, so a
+    program with a known access pattern (strided, reversed, ...) can hand
+    the library many transfers at once instead of one seek and one read
+    per block.  Each call leaves the file position at the end of the last
+    transfer it performed, just like the equivalent io300_seek followed
+    by io300_read or io300_write.
+
+    Implementations do not have to provide these:  io300_fallback.c defines
+    versions built on io300_seek, io300_read and io300_write, which are
+    used unless the implementation defines its own.
+*/
+
+/* One transfer in a batch:  `len` bytes at file offset `offset`, to or from `buf` */
+struct io300_iovec {
+    off_t offset;
+    size_t len;
+    char* buf;
+};
+
+/*
+ *  Read `nbytes` from the file, starting at `offset`, into `buff`.
+ *  On failure, return -1. On success, return the number of bytes that were
+ *  placed into the provided buffer, which is less than `nbytes` only if
+ *  the end of the file was reached.
+ */
+ssize_t io300_pread(struct io300_file* f, char* buff, size_t nbytes, off_t offset);
+
+/*
+ *  Write `nbytes` from the start of `buff` into the file at `offset`.
+ *  On failure, return -1. On success, return the number of bytes that were
+ *  written to the file.
+ */
+ssize_t io300_pwrite(struct io300_file* f, const char* buff, size_t nbytes, off_t offset);
+
+/*
+ *  Perform the `iovcnt` reads described by `iov`, in order.  Each request
+ *  reads up to `iov[i].len` bytes (fewer if it reaches the end of the
+ *  file) from `iov[i].offset` into `iov[i].buf`; a request that starts at
+ *  or past the end of the file reads nothing.  Afterwards the file
+ *  position is at the end of the last request that started before the
+ *  end of the file; if none did, it is unspecified (the default version
+ *  seeks to each request in turn), so seek before reading or writing.
+ *  If any offset is negative, nothing is read and -1 is returned.
+ *  On failure, return -1. On success, return the total number of bytes read.
+ */
+ssize_t io300_readv(struct io300_file* f, const struct io300_iovec* iov, int iovcnt);
+
+
+/*
+    Access pattern hints
+
+    A program that knows how it will access a file can say so, and the
+    library can use that to choose what to cache.  `advice` is one of
+    IO300_NORMAL, IO300_SEQUENTIAL, IO300_REVERSE or IO300_RANDOM,
+    optionally combined with IO300_WILLNEED using `|`.
+*/
+
+/* No particular pattern (the default) */
+#define IO300_NORMAL 0x0
+/* The file will be accessed from start to end */
+#define IO300_SEQUENTIAL 0x1
+/* The file will be accessed from end to start */
+#define IO300_REVERSE 0x2
+/* The file will be accessed in no particular order */
+#define IO300_RANDOM 0x4
+/* Bytes [offset, offset + len) will be accessed soon */
+#define IO300_WILLNEED 0x8
+
+/*
+ *  Give the library a hint about how the file will be accessed.  The
+ *  pattern applies to the whole file from now on (until the next call),
+ *  while IO300_WILLNEED applies to the bytes [offset, offset + len); a
+ *  `len` of 0 means "to the end of the file".  Hints never change the
+ *  result of any other call, only how fast it runs.
+ *
+ *  Return 0 on success, -1 if `advice` is not a valid combination.
+ */
+int io300_advise(struct io300_file* f, int advice, off_t offset, off_t len);
+
+
+/*
+    Zero-copy access
+
+    io300_read and io300_write copy between the caller's buffer and the
+    library's cache.  These calls instead give the caller a pointer into
+    the cache, so data can be moved from one file to another with a
+    single memcpy.  Each pointer stays valid only until the next call on
+    the same file.
+
+    Not every implementation can support them:  if io300_peek or
+    io300_reserve returns -1 on a file that is otherwise fine, use
+    io300_read and io300_write instead.
+*/
+
+/*
+ *  Set `*ptr` to the bytes at the current file position, as stored in
+ *  the library's cache, without copying them or moving the position.
+ *  Return the number of bytes available at `*ptr` (at least 1 and at
+ *  most `max`), 0 at the end of the file, or -1 on failure or if the
+ *  implementation does not support zero-copy reads.
+ */
+ssize_t io300_peek(struct io300_file* f, const char** ptr, size_t max);
+
+/*
+ *  Move the file position forward past `nbytes` bytes returned by the
+ *  last io300_peek, which must be the previous call on `f`.
+ *  Return 0 on success, -1 on failure.
+ */
+int io300_consume(struct io300_file* f, size_t nbytes);
+
+/*
+ *  Set `*ptr` to space in the library's cache for the bytes at the
+ *  current file position.  The caller fills in some prefix of it and
+ *  passes that length to io300_commit; bytes past that prefix must be
+ *  left unchanged.  Return the number of bytes of space at `*ptr` (at
+ *  least 1 and at most `max`), or -1 on failure or if the implementation
+ *  does not support zero-copy writes.
+ */
+ssize_t io300_reserve(struct io300_file* f, char** ptr, size_t max);
+
+/*
+ *  Write the first `nbytes` bytes of the space returned by the last
+ *  io300_reserve, which must be the previous call on `f`, into the file
+ *  and move the file position past them.
+ *  Return 0 on success, -1 on failure.
+ */
+int io300_commit(struct io300_file* f, size_t nbytes);
+
+
+/*
+    Statistics
+
+    Every implementation counts what its cache did and which requests
+    it made to the kernel, so a slow test can be explained without
+    strace.  What counts as an "access" depends on how the cache is
+    organized (a byte, a block, a page), but the numbers are always
+    comparable between runs of the same implementation.
+*/
+
+struct io300_stats {
+    /* accesses served from the cache */
+    unsigned long hits;
+    /* accesses that had to wait for data to be loaded into the cache */
+    unsigned long misses;
+    /* times data was loaded into the cache from the file */
+    unsigned long refills;
+    /* times modified cache contents were written back to the file */
+    unsigned long flushes;
+    /* reads, writes and seeks made on the file (read/pread/preadv,
+       write/pwrite and lseek calls, or the io_uring equivalents) */
+    unsigned long read_calls;
+    unsigned long write_calls;
+    unsigned long seek_calls;
+    /* bytes moved by those reads and writes */
+    unsigned long bytes_read;
+    unsigned long bytes_written;
+};
+
+/*
+ *  Copy the statistics collected for `f` since it was opened into `*stats`.
+ *  Return 0 on success, -1 if the implementation does not collect them.
+ */
+int io300_get_stats(struct io300_file* f, struct io300_stats* stats);
+
+/*
+ *  Report the final statistics of a file that is being closed.  Every
+ *  implementation calls this from io300_close.  If the test scripts
+ *  are running the program (IO300_TEST_RUN is set) and IO300_STATS_FD
+ *  names a file descriptor, one line describing `stats` is written to
+ *  that descriptor; otherwise this does nothing.
+ */
+void io300_report_stats(const struct io300_stats* stats);
+
 #endif
@@ -0,0 +1,118 @@
+#include <sys/types.h>
+
+#include "io300.h"
+
+/*
+    io300_fallback.c
+
+    Default versions of the optional parts of the io300 API, written in
+    terms of the core calls (io300_seek, io300_read, io300_write).  They
+    are weak symbols:  an implementation in impl/ that defines a function
+    of the same name replaces the version here at link time, so only the
+    implementations that can do better need to provide their own.
+*/
+
+#define FALLBACK __attribute__((weak))
+
+FALLBACK ssize_t io300_readv(struct io300_file* f, const struct io300_iovec* iov,
+                             int iovcnt) {
+    for (int i = 0; i < iovcnt; i++) {
+        if (iov[i].offset < 0) {
+            return -1;
+        }
+    }
+
+    // The library finds the end of the file itself:  a request that
+    // reads nothing started at or past it.  io300_filesize might not
+    // count bytes the library has not written out yet.
+    ssize_t total = 0;
+    off_t end = -1;
+    int restore = 0;
+    for (int i = 0; i < iovcnt; i++) {
+        if (io300_seek(f, iov[i].offset) == -1) {
+            return total > 0 ? total : -1;
+        }
+        ssize_t const n = io300_read(f, iov[i].buf, iov[i].len);
+        if (n == -1) {
+            return total > 0 ? total : -1;
+        }
+        if (n > 0 || iov[i].len == 0) {
+            end = iov[i].offset + n;
+            restore = 0;
+        } else {
+            restore = 1;
+        }
+        total += n;
+    }
+    // Requests past the end leave the position where the last one
+    // before it ended
+    if (restore && end != -1 && io300_seek(f, end) == -1) {
+        return -1;
+    }
+    return total;
+}
+
+FALLBACK ssize_t io300_pread(struct io300_file* f, char* buff, size_t nbytes,
+                             off_t offset) {
+    struct io300_iovec const iov = { .offset = offset, .len = nbytes, .buf = buff };
+    return io300_readv(f, &iov, 1);
+}
+
+FALLBACK ssize_t io300_pwrite(struct io300_file* f, const char* buff, size_t nbytes,
+                              off_t offset) {
+    if (io300_seek(f, offset) == -1) {
+        return -1;
+    }
+    return io300_write(f, buff, nbytes);
+}
+
+FALLBACK int io300_advise(struct io300_file* f, int advice, off_t offset, off_t len) {
+    (void)f;
+    (void)offset;
+    (void)len;
+    // At most one access pattern, optionally with IO300_WILLNEED
+    int const pattern = advice & ~IO300_WILLNEED;
+    if (pattern != IO300_NORMAL && pattern != IO300_SEQUENTIAL
+        && pattern != IO300_REVERSE && pattern != IO300_RANDOM) {
+        return -1;
+    }
+    return 0;
+}
+
+/*
+    Zero-copy access needs a pointer into the implementation's cache, so
+    there is no generic version:  report it as unsupported and let the
+    caller copy with io300_read and io300_write instead.
+*/
+
+FALLBACK ssize_t io300_peek(struct io300_file* f, const char** ptr, size_t max) {
+    (void)f;
+    (void)ptr;
+    (void)max;
+    return -1;
+}
+
+FALLBACK int io300_consume(struct io300_file* f, size_t nbytes) {
+    (void)f;
+    (void)nbytes;
+    return -1;
+}
+
+FALLBACK ssize_t io300_reserve(struct io300_file* f, char** ptr, size_t max) {
+    (void)f;
+    (void)ptr;
+    (void)max;
+    return -1;
+}
+
+FALLBACK int io300_commit(struct io300_file* f, size_t nbytes) {
+    (void)f;
+    (void)nbytes;
+    return -1;
+}
+
+FALLBACK int io300_get_stats(struct io300_file* f, struct io300_stats* stats) {
+    (void)f;
+    (void)stats;
+    return -1;
+}
@@ -0,0 +1,221 @@
+/*
+ * io300_roofline.c - The fastest this host can produce each test output
+ *
+ * A ratio against stdio says nothing about how close an implementation
+ * is to what the machine can do.  This program makes the same output as
+ * the test programs, but with whatever system calls and buffer sizes
+ * are fastest, and with no io300 library in between.  benchmark.py
+ * times it (see --roofline) and reports each implementation's
+ * throughput as a percentage of the best of these for its workload.
+ *
+ * Usage:  io300_roofline [-b block-size] [-s stride] <method> <in-file> <out-file>
+ *
+ * Methods that copy in-file to out-file:
+ *   copy_file_range   let the kernel copy, without bringing data to user space
+ *   readwrite         read and write with a 1 MiB buffer
+ *   mmap              map both files and memcpy
+ * Methods for the other output orders (as reverse_*_cat and stride_cat):
+ *   reverse           map in-file, reverse it into a 1 MiB buffer, write it
+ *   stride            map in-file, gather -b byte blocks -s bytes apart
+ *                     into a 1 MiB buffer (in stride_cat's order), write it
+ * And, for comparison, a method that only reads:
+ *   pagecache         read in-file with a 1 MiB buffer (out-file is unused)
+ *
+ * It is built with optimizations and without sanitizers:
+ *    $ make io300_roofline
+ */
+
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#define BUFFER_SIZE (1 << 20)
+
+static char buffer[BUFFER_SIZE];
+
+static int write_all(int fd, char const* buf, size_t n) {
+    while (n > 0) {
+        ssize_t const w = write(fd, buf, n);
+        if (w <= 0) {
+            return -1;
+        }
+        buf += w;
+        n -= w;
+    }
+    return 0;
+}
+
+static int copy_with_copy_file_range(int in, int out, size_t size) {
+    while (size > 0) {
+        ssize_t const n = copy_file_range(in, NULL, out, NULL, size, 0);
+        if (n <= 0) {
+            return -1;
+        }
+        size -= n;
+    }
+    return 0;
+}
+
+static int copy_with_readwrite(int in, int out) {
+    while (1) {
+        ssize_t const n = read(in, buffer, BUFFER_SIZE);
+        if (n == 0) {
+            return 0;
+        }
+        if (n < 0 || write_all(out, buffer, n) < 0) {
+            return -1;
+        }
+    }
+}
+
+static int copy_with_mmap(char const* src, int out, size_t size) {
+    if (ftruncate(out, size) < 0) {
+        return -1;
+    }
+    char* const dst = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, out, 0);
+    if (dst == MAP_FAILED) {
+        return -1;
+    }
+    memcpy(dst, src, size);
+    return munmap(dst, size);
+}
+
+static int copy_reversed(char const* src, int out, size_t size) {
+    size_t done = 0;
+    while (done < size) {
+        size_t const n = size - done < BUFFER_SIZE ? size - done : BUFFER_SIZE;
+        for (size_t i = 0; i < n; i++) {
+            buffer[i] = src[size - 1 - done - i];
+        }
+        if (write_all(out, buffer, n) < 0) {
+            return -1;
+        }
+        done += n;
+    }
+    return 0;
+}
+
+/* The same output as test_programs/reference/stride */
+static int copy_strided(char const* src, int out, size_t size, size_t block_size, size_t stride) {
+    size_t pos = 0, written = 0, buffered = 0;
+    while (written < size) {
+        size_t amount = pos + block_size <= size ? block_size : size - pos;
+        if (amount == 0) {
+            break;
+        }
+        if (buffered + amount > BUFFER_SIZE) {
+            if (write_all(out, buffer, buffered) < 0) {
+                return -1;
+            }
+            buffered = 0;
+        }
+        memcpy(buffer + buffered, src + pos, amount);
+        buffered += amount;
+        written += amount;
+
+        pos += stride;
+        if (pos >= size) {
+            pos = (pos % stride) + block_size;
+            if (pos + block_size > stride) {
+                block_size = stride - pos;
+            }
+        }
+    }
+    return write_all(out, buffer, buffered);
+}
+
+static int read_only(int in) {
+    ssize_t n;
+    while ((n = read(in, buffer, BUFFER_SIZE)) > 0) {
+    }
+    return n < 0 ? -1 : 0;
+}
+
+int main(int argc, char* argv[]) {
+    size_t block_size = 1;
+    size_t stride = 1024;
+
+    int opt;
+    while ((opt = getopt(argc, argv, "b:s:")) != -1) {
+        switch (opt) {
+        case 'b':
+            block_size = strtoul(optarg, NULL, 10);
+            break;
+        case 's':
+            stride = strtoul(optarg, NULL, 10);
+            break;
+        default:
+            return 1;
+        }
+    }
+    if (argc - optind != 3 || block_size == 0 || stride < block_size) {
+        fprintf(stderr, "usage: %s [-b block-size] [-s stride] "
+                "<copy_file_range|readwrite|mmap|reverse|stride|pagecache> <in-file> <out-file>\n",
+                argv[0]);
+        return 1;
+    }
+    char const* const method = argv[optind];
+
+    int const in = open(argv[optind + 1], O_RDONLY);
+    if (in < 0) {
+        fprintf(stderr, "error: could not open %s: %s\n", argv[optind + 1], strerror(errno));
+        return 1;
+    }
+    struct stat s;
+    if (fstat(in, &s) < 0 || !S_ISREG(s.st_mode)) {
+        fprintf(stderr, "error: %s is not a regular file\n", argv[optind + 1]);
+        return 1;
+    }
+    size_t const size = s.st_size;
+
+    if (strcmp(method, "pagecache") == 0) {
+        return read_only(in) < 0;
+    }
+
+    int const out = open(argv[optind + 2], O_RDWR | O_CREAT | O_TRUNC, 0666);
+    if (out < 0) {
+        fprintf(stderr, "error: could not open %s: %s\n", argv[optind + 2], strerror(errno));
+        return 1;
+    }
+
+    char* src = NULL;
+    if (size > 0 && (strcmp(method, "mmap") == 0 || strcmp(method, "reverse") == 0
+                     || strcmp(method, "stride") == 0)) {
+        src = mmap(NULL, size, PROT_READ, MAP_PRIVATE, in, 0);
+        if (src == MAP_FAILED) {
+            fprintf(stderr, "error: could not map %s: %s\n", argv[optind + 1], strerror(errno));
+            return 1;
+        }
+    }
+
+    int r;
+    if (strcmp(method, "copy_file_range") == 0) {
+        r = copy_with_copy_file_range(in, out, size);
+    } else if (strcmp(method, "readwrite") == 0) {
+        r = copy_with_readwrite(in, out);
+    } else if (size == 0) {
+        r = 0;
+    } else if (strcmp(method, "mmap") == 0) {
+        r = copy_with_mmap(src, out, size);
+    } else if (strcmp(method, "reverse") == 0) {
+        r = copy_reversed(src, out, size);
+    } else if (strcmp(method, "stride") == 0) {
+        r = copy_strided(src, out, size, block_size, stride);
+    } else {
+        fprintf(stderr, "error: unknown method %s\n", method);
+        return 1;
+    }
+    if (r < 0) {
+        fprintf(stderr, "error: %s failed: %s\n", method, strerror(errno));
+        return 1;
+    }
+
+    close(in);
+    return close(out) < 0;
+}
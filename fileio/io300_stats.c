@@ -0,0 +1,64 @@
+#include <errno.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <unistd.h>
+
+#include "io300.h"
+
+/*
+    io300_stats.c
+
+    Reporting of io300_stats to the test scripts.  When they run a test
+    program, the scripts set IO300_TEST_RUN and put the number of a file
+    descriptor they can read from in IO300_STATS_FD; each io300_close
+    then writes one line to it, e.g.
+
+      io300_stats hits=1021 misses=3 refills=3 flushes=1 read_calls=3 ...
+
+    Outside of the test scripts, nothing is written.
+*/
+
+#define ENV_USING_TESTER "IO300_TEST_RUN"
+#define ENV_STATS_FD "IO300_STATS_FD"
+
+/* Descriptor to report to, or -1 if statistics should not be reported */
+static int stats_fd(void) {
+    if (getenv(ENV_USING_TESTER) == NULL) {
+        return -1;
+    }
+    char const* const s = getenv(ENV_STATS_FD);
+    if (s == NULL || *s == '\0') {
+        return -1;
+    }
+    char* end;
+    long const fd = strtol(s, &end, 10);
+    if (*end != '\0' || fd < 0) {
+        return -1;
+    }
+    return (int)fd;
+}
+
+void io300_report_stats(const struct io300_stats* stats) {
+    int const fd = stats_fd();
+    if (fd == -1) {
+        return;
+    }
+
+    char line[512];
+    int const n = snprintf(line, sizeof(line),
+                           "io300_stats hits=%lu misses=%lu refills=%lu flushes=%lu"
+                           " read_calls=%lu write_calls=%lu seek_calls=%lu"
+                           " bytes_read=%lu bytes_written=%lu\n",
+                           stats->hits, stats->misses, stats->refills, stats->flushes,
+                           stats->read_calls, stats->write_calls, stats->seek_calls,
+                           stats->bytes_read, stats->bytes_written);
+    if (n <= 0 || (size_t)n >= sizeof(line)) {
+        return;
+    }
+
+    // One write, so lines from several files (or processes) never mix.
+    // Don't let a closed or bogus descriptor change errno for the caller.
+    int const saved_errno = errno;
+    (void)!write(fd, line, n);
+    errno = saved_errno;
+}
@@ -0,0 +1,373 @@
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/types.h>
+#include <sys/uio.h>
+
+/*
+    io300_trace.c
+
+    A preload library that watches the file system calls a program
+    makes and, when it exits, writes histograms of them as one line of
+    JSON.  Build it with `make io300_trace.so` and run any test program
+    under it:
+
+      $ IO300_TRACE_OUT=trace.json LD_PRELOAD=./io300_trace.so \
+            ./block_cat 4096 in out
+
+    (If IO300_TRACE_OUT is not set, the JSON goes to stderr.)  For each
+    of read, write, lseek, pread, pwrite, preadv and pwritev it records
+    the number of calls, the bytes moved, and log2 histograms of
+
+      - the request size (bytes asked for; the new offset for lseek),
+      - the seek distance:  how far the call starts from where the
+        previous call on the same descriptor ended, and
+      - the time spent in the call, in nanoseconds (CLOCK_MONOTONIC,
+        which the vDSO reads from the TSC without entering the kernel).
+
+    Bucket k of a histogram holds values v with 2^(k-1) <= |v| < 2^k
+    (bucket 0 holds 0); in the JSON, every non-empty bucket is written
+    as [lowest value, highest value, count].
+
+    If IO300_TRACE_RECORD names a file, every read and write is also
+    appended to it as a struct access_record, after an 8-byte
+    "IO300TR1" header.  Run a program built with IMPL=naive (where each
+    io300 call makes one system call) to record the accesses the test
+    program makes, and test_scripts/cachesim.py can replay them against
+    different cache designs.
+
+    Only calls that go through the dynamic linker can be seen:  the
+    system calls stdio makes inside the C library (and io_uring
+    requests) never reach us, so a stdio build shows no calls at all.
+    The performance tests trace stdio with strace instead and add its
+    log up into the same histograms (see parse_strace in
+    test_scripts/util.py).
+*/
+
+#define ENV_TRACE_OUT "IO300_TRACE_OUT"
+#define ENV_TRACE_RECORD "IO300_TRACE_RECORD"
+#define RECORD_MAGIC "IO300TR1"
+
+/* Descriptors we keep offsets for; calls on others record no distance */
+#define MAX_FDS 1024
+#define BUCKETS 65
+
+enum call { CALL_READ, CALL_WRITE, CALL_LSEEK, CALL_PREAD, CALL_PWRITE,
+            CALL_PREADV, CALL_PWRITEV, NCALLS };
+
+static char const* const call_names[NCALLS] = {
+    "read", "write", "lseek", "pread", "pwrite", "preadv", "pwritev"
+};
+
+struct call_stats {
+    unsigned long calls;
+    unsigned long errors;
+    unsigned long bytes;
+    unsigned long nsec;
+    unsigned long size[BUCKETS];
+    /* seek distances backwards and forwards (0 counts as forwards) */
+    unsigned long back[BUCKETS];
+    unsigned long forward[BUCKETS];
+    unsigned long time[BUCKETS];
+};
+
+static struct call_stats stats[NCALLS];
+
+/* The kernel's file position, and where the last call ended, for each fd */
+static off_t fd_pos[MAX_FDS];
+static off_t fd_end[MAX_FDS];
+
+/* One read or write in a recorded trace (see test_scripts/cachesim.py) */
+struct access_record {
+    int64_t offset;
+    uint32_t length;
+    uint16_t fd;
+    /* 0 for reads, 1 for writes */
+    uint8_t op;
+    uint8_t pad;
+};
+
+#define RECORD_BUFFER 4096
+static struct access_record records[RECORD_BUFFER];
+static size_t nrecords;
+/* Descriptor of the record file; -2 before it is opened, -1 if not recording */
+static int record_fd = -2;
+static char record_lock;
+
+static ssize_t (*real_read)(int, void*, size_t);
+static ssize_t (*real_write)(int, const void*, size_t);
+static off_t (*real_lseek)(int, off_t, int);
+static ssize_t (*real_pread)(int, void*, size_t, off_t);
+static ssize_t (*real_pwrite)(int, const void*, size_t, off_t);
+static ssize_t (*real_preadv)(int, const struct iovec*, int, off_t);
+static ssize_t (*real_pwritev)(int, const struct iovec*, int, off_t);
+static int (*real_close)(int);
+
+/* Look up the C library's version of `name` the first time it is needed */
+#define RESOLVE(name) do {                                                   \
+        if (real_##name == NULL) {                                           \
+            real_##name = (__typeof__(real_##name))dlsym(RTLD_NEXT, #name);  \
+        }                                                                    \
+    } while (0)
+
+static void add(unsigned long* counter, unsigned long n) {
+    // The async implementation calls us from two threads
+    __atomic_fetch_add(counter, n, __ATOMIC_RELAXED);
+}
+
+static int bucket(unsigned long v) {
+    return v == 0 ? 0 : 64 - __builtin_clzl(v);
+}
+
+static unsigned long now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000UL + ts.tv_nsec;
+}
+
+/* Write out the buffered records; call with record_lock held */
+static void flush_records(void) {
+    if (record_fd == -2) {
+        char const* const path = getenv(ENV_TRACE_RECORD);
+        record_fd = -1;
+        if (path != NULL && *path != '\0') {
+            record_fd = open(path, O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC, 0644);
+            if (record_fd == -1) {
+                fprintf(stderr, "io300_trace: could not open %s: %s\n", path, strerror(errno));
+            } else {
+                (void)!real_write(record_fd, RECORD_MAGIC, strlen(RECORD_MAGIC));
+            }
+        }
+    }
+    if (record_fd >= 0 && nrecords > 0) {
+        (void)!real_write(record_fd, records, nrecords * sizeof(records[0]));
+    }
+    nrecords = 0;
+}
+
+/* Add a read or write of `length` bytes at `offset` to the record file */
+static void save_access(int write_op, int fd, off_t offset, size_t length) {
+    if (record_fd == -1) {
+        return;
+    }
+    while (__atomic_test_and_set(&record_lock, __ATOMIC_ACQUIRE)) {
+    }
+    records[nrecords++] = (struct access_record){
+        .offset = offset, .length = length, .fd = fd, .op = write_op
+    };
+    if (nrecords == RECORD_BUFFER) {
+        RESOLVE(write);
+        flush_records();
+    }
+    __atomic_clear(&record_lock, __ATOMIC_RELEASE);
+}
+
+/*
+ *  Record one call on `fd` of kind `c` that asked for `size` bytes
+ *  starting at `start` (-1 to use the file position), returned `ret`
+ *  and took from `t0` until now.
+ */
+static void record(enum call c, int fd, size_t size, off_t start, ssize_t ret,
+                   unsigned long t0) {
+    unsigned long const ns = now_ns() - t0;
+    struct call_stats* const s = &stats[c];
+    add(&s->calls, 1);
+    add(&s->nsec, ns);
+    add(&s->time[bucket(ns)], 1);
+    add(&s->size[bucket(size)], 1);
+    if (ret < 0) {
+        add(&s->errors, 1);
+        return;
+    }
+    if (c != CALL_LSEEK) {
+        add(&s->bytes, ret);
+    }
+    if (fd < 0 || fd >= MAX_FDS) {
+        return;
+    }
+
+    off_t const pos = __atomic_load_n(&fd_pos[fd], __ATOMIC_RELAXED);
+    off_t const end = __atomic_load_n(&fd_end[fd], __ATOMIC_RELAXED);
+    if (start == -1) {
+        start = pos;
+    }
+    if (c != CALL_READ && c != CALL_WRITE) {
+        off_t const distance = start - end;
+        if (distance < 0) {
+            add(&s->back[bucket(-distance)], 1);
+        } else {
+            add(&s->forward[bucket(distance)], 1);
+        }
+    }
+
+    if (c != CALL_LSEEK && ret > 0) {
+        int const write_op = c == CALL_WRITE || c == CALL_PWRITE || c == CALL_PWRITEV;
+        save_access(write_op, fd, start, ret);
+    }
+
+    off_t const new_end = c == CALL_LSEEK ? ret : start + ret;
+    __atomic_store_n(&fd_end[fd], new_end, __ATOMIC_RELAXED);
+    if (c == CALL_READ || c == CALL_WRITE || c == CALL_LSEEK) {
+        __atomic_store_n(&fd_pos[fd], new_end, __ATOMIC_RELAXED);
+    }
+}
+
+static size_t iov_size(const struct iovec* iov, int iovcnt) {
+    size_t n = 0;
+    for (int i = 0; i < iovcnt; i++) {
+        n += iov[i].iov_len;
+    }
+    return n;
+}
+
+ssize_t read(int fd, void* buf, size_t count) {
+    unsigned long const t0 = now_ns();
+    RESOLVE(read);
+    ssize_t const r = real_read(fd, buf, count);
+    int const saved_errno = errno;
+    record(CALL_READ, fd, count, -1, r, t0);
+    errno = saved_errno;
+    return r;
+}
+
+ssize_t write(int fd, const void* buf, size_t count) {
+    unsigned long const t0 = now_ns();
+    RESOLVE(write);
+    ssize_t const r = real_write(fd, buf, count);
+    int const saved_errno = errno;
+    record(CALL_WRITE, fd, count, -1, r, t0);
+    errno = saved_errno;
+    return r;
+}
+
+off_t lseek(int fd, off_t offset, int whence) {
+    unsigned long const t0 = now_ns();
+    RESOLVE(lseek);
+    off_t const r = real_lseek(fd, offset, whence);
+    int const saved_errno = errno;
+    // The new offset is only known once the call returns
+    record(CALL_LSEEK, fd, r < 0 ? 0 : r, r < 0 ? -1 : r, r, t0);
+    errno = saved_errno;
+    return r;
+}
+
+ssize_t pread(int fd, void* buf, size_t count, off_t offset) {
+    unsigned long const t0 = now_ns();
+    RESOLVE(pread);
+    ssize_t const r = real_pread(fd, buf, count, offset);
+    int const saved_errno = errno;
+    record(CALL_PREAD, fd, count, offset, r, t0);
+    errno = saved_errno;
+    return r;
+}
+
+ssize_t pwrite(int fd, const void* buf, size_t count, off_t offset) {
+    unsigned long const t0 = now_ns();
+    RESOLVE(pwrite);
+    ssize_t const r = real_pwrite(fd, buf, count, offset);
+    int const saved_errno = errno;
+    record(CALL_PWRITE, fd, count, offset, r, t0);
+    errno = saved_errno;
+    return r;
+}
+
+ssize_t preadv(int fd, const struct iovec* iov, int iovcnt, off_t offset) {
+    unsigned long const t0 = now_ns();
+    RESOLVE(preadv);
+    ssize_t const r = real_preadv(fd, iov, iovcnt, offset);
+    int const saved_errno = errno;
+    record(CALL_PREADV, fd, iov_size(iov, iovcnt), offset, r, t0);
+    errno = saved_errno;
+    return r;
+}
+
+ssize_t pwritev(int fd, const struct iovec* iov, int iovcnt, off_t offset) {
+    unsigned long const t0 = now_ns();
+    RESOLVE(pwritev);
+    ssize_t const r = real_pwritev(fd, iov, iovcnt, offset);
+    int const saved_errno = errno;
+    record(CALL_PWRITEV, fd, iov_size(iov, iovcnt), offset, r, t0);
+    errno = saved_errno;
+    return r;
+}
+
+int close(int fd) {
+    // The next file opened with this descriptor starts at offset 0
+    if (fd >= 0 && fd < MAX_FDS) {
+        __atomic_store_n(&fd_pos[fd], 0, __ATOMIC_RELAXED);
+        __atomic_store_n(&fd_end[fd], 0, __ATOMIC_RELAXED);
+    }
+    RESOLVE(close);
+    return real_close(fd);
+}
+
+
+/*
+ *  Write the non-empty buckets of `h` as [lo, hi, count] entries, each
+ *  preceded by `*sep`.  Backwards distances are written negated, furthest
+ *  first, so that a list of them followed by forward ones stays sorted.
+ */
+static void dump_buckets(FILE* out, unsigned long const* h, int backwards,
+                         char const** sep) {
+    for (int i = 0; i < BUCKETS; i++) {
+        int const k = backwards ? BUCKETS - 1 - i : i;
+        if (h[k] == 0) {
+            continue;
+        }
+        unsigned long const lo = k == 0 ? 0 : 1UL << (k - 1);
+        unsigned long const hi = k == 0 ? 0 : (k == 64 ? ~0UL : (1UL << k) - 1);
+        if (backwards) {
+            fprintf(out, "%s[-%lu, -%lu, %lu]", *sep, hi, lo, h[k]);
+        } else {
+            fprintf(out, "%s[%lu, %lu, %lu]", *sep, lo, hi, h[k]);
+        }
+        *sep = ", ";
+    }
+}
+
+__attribute__((destructor))
+static void dump(void) {
+    RESOLVE(write);
+    flush_records();
+
+    char const* const path = getenv(ENV_TRACE_OUT);
+    FILE* out = stderr;
+    if (path != NULL && *path != '\0') {
+        // Append, so each process of a run adds its own line
+        out = fopen(path, "a");
+        if (out == NULL) {
+            fprintf(stderr, "io300_trace: could not open %s: %s\n", path, strerror(errno));
+            return;
+        }
+    }
+
+    fprintf(out, "{\"pid\": %d, \"calls\": {", (int)getpid());
+    for (int c = 0; c < NCALLS; c++) {
+        struct call_stats const* const s = &stats[c];
+        fprintf(out, "%s\"%s\": {\"calls\": %lu, \"errors\": %lu, \"bytes\": %lu, \"nsec\": %lu, ",
+                c == 0 ? "" : ", ", call_names[c], s->calls, s->errors, s->bytes, s->nsec);
+        char const* sep = "";
+        fprintf(out, "\"size\": [");
+        dump_buckets(out, s->size, 0, &sep);
+        fprintf(out, "], \"distance\": [");
+        sep = "";
+        dump_buckets(out, s->back, 1, &sep);
+        dump_buckets(out, s->forward, 0, &sep);
+        fprintf(out, "], \"time\": [");
+        sep = "";
+        dump_buckets(out, s->time, 0, &sep);
+        fprintf(out, "]}");
+    }
+    fprintf(out, "}}\n");
+
+    if (out != stderr) {
+        fclose(out);
+    }
+}
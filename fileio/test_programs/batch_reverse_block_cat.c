@@ -0,0 +1,112 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "../io300.h"
+
+// Same as reverse_block_cat, but reads BATCH_SIZE blocks at a time with
+// io300_readv instead of seeking and reading each block separately.
+
+#define BATCH_SIZE 64
+
+int main(int argc, char* argv[]) {
+    if (argc != 4) {
+        fprintf(stderr, "usage: %s <buffer-size> <in-file> <out-file>\n",
+                argv[0]);
+        return 1;
+    }
+    int const buffer_size = atoi(argv[1]);
+    if (buffer_size <= 0) {
+        fprintf(stderr,
+                "error: specify numeric buffer size > 0 bytes. you gave %s\n",
+                argv[1]);
+        return 1;
+    }
+
+    struct io300_file* in = io300_open(argv[2], MODE_READ, "in");
+    if (in == NULL) {
+        return 1;
+    }
+
+    struct io300_file* out = io300_open(argv[3], MODE_WRITE, "out");
+    if (out == NULL) {
+        io300_close(in);
+        return 1;
+    }
+
+    off_t const filesize = io300_filesize(in);
+    if (filesize <= 0) {
+        fprintf(stderr, "error: could not get filesize on empty file\n");
+        io300_close(in);
+        io300_close(out);
+        return 1;
+    }
+
+    char* const in_buffer = malloc((size_t)buffer_size * BATCH_SIZE);
+    if (in_buffer == NULL) {
+        fprintf(stderr, "error: could not allocate buffer\n");
+        io300_close(in);
+        io300_close(out);
+        return 1;
+    }
+
+    char* const out_buffer = malloc(buffer_size);
+    if (out_buffer == NULL) {
+        fprintf(stderr, "error: could not allocate out buffer\n");
+        free(in_buffer);
+        io300_close(in);
+        io300_close(out);
+        return 1;
+    }
+
+    int exit_status = 0;
+    struct io300_iovec iov[BATCH_SIZE];
+
+    off_t next = filesize - (filesize % buffer_size);
+    while (next >= 0 && exit_status == 0) {
+        // Describe the next BATCH_SIZE blocks, working backwards
+        int n = 0;
+        ssize_t expected = 0;
+        for (; n < BATCH_SIZE && next >= 0; next -= buffer_size) {
+            size_t len = buffer_size;
+            if (filesize - next < (off_t)len) {
+                len = filesize - next;
+            }
+            if (len == 0) {
+                continue;
+            }
+            iov[n].offset = next;
+            iov[n].len = len;
+            iov[n].buf = in_buffer + (size_t)n * buffer_size;
+            expected += len;
+            n++;
+        }
+        if (n == 0) {
+            break;
+        }
+
+        if (io300_readv(in, iov, n) != expected) {
+            fprintf(stderr, "error: readv should not fail\n");
+            exit_status = 1;
+            break;
+        }
+
+        for (int i = 0; i < n; i++) {
+            size_t const len = iov[i].len;
+            for (size_t j = 0; j < len; j++) {
+                out_buffer[j] = iov[i].buf[(len - 1) - j];
+            }
+            if (io300_write(out, out_buffer, len) == -1) {
+                fprintf(stderr, "error: write should not fail\n");
+                exit_status = 1;
+                break;
+            }
+        }
+    }
+
+    io300_close(in);
+    io300_close(out);
+    free(in_buffer);
+    free(out_buffer);
+
+    return exit_status;
+}
@@ -0,0 +1,91 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "../io300.h"
+
+//    Same as stride_cat, but hands the strided reads to the library
+//    BATCH_SIZE blocks at a time with io300_readv instead of seeking
+//    and reading each block separately.  The output is identical.
+
+#define BATCH_SIZE 64
+
+int main(int argc, char* argv[]) {
+    if (argc != 5) {
+        fprintf(stderr, "usage: %s <BLOCKSIZE> <STRIDE> <INFILE> <OUTFILE>\n",
+                argv[0]);
+        return 1;
+    }
+
+    size_t block_size = strtol(argv[1], NULL, 10);
+
+    // Allocate buffer, open files, measure file sizes
+    char* buf = malloc(block_size * BATCH_SIZE);
+
+    struct io300_file* inf = io300_open(argv[3], MODE_READ, "\e[0;31min\e[0m");
+
+    size_t input_size = io300_filesize(inf);
+    if ((ssize_t)input_size < 0) {
+        fprintf(stderr, "batch_stride_cat: can't get size of input file\n");
+        free(buf);
+        return 1;
+    }
+
+    struct io300_file* outf = io300_open(argv[4], MODE_WRITE, "\e[0;32mout\e[0m");
+
+    size_t stride = strtol(argv[2], NULL, 10);
+
+    // Copy file data
+    struct io300_iovec iov[BATCH_SIZE];
+    size_t pos = 0, written = 0;
+    int done = 0;
+    while (!done && written < input_size) {
+        // Describe the next batch of blocks, following the same path
+        // through the file as stride_cat
+        int n = 0;
+        size_t batch_bytes = 0;
+        while (n < BATCH_SIZE && written + batch_bytes < input_size) {
+            size_t len = block_size;
+            if (pos >= input_size) {
+                len = 0;
+            } else if (len > input_size - pos) {
+                len = input_size - pos;
+            }
+            if (len == 0) {
+                done = 1;
+                break;
+            }
+            iov[n].offset = pos;
+            iov[n].len = len;
+            iov[n].buf = buf + batch_bytes;
+            batch_bytes += len;
+            n++;
+
+            // Move to next stride
+            pos += stride;
+            if (pos >= input_size) {
+                pos = (pos % stride) + block_size;
+                if (pos + block_size > stride) {
+                    block_size = stride - pos;
+                }
+            }
+        }
+        if (n == 0) {
+            break;
+        }
+
+        ssize_t amount = io300_readv(inf, iov, n);
+        if (amount != (ssize_t)batch_bytes) {
+            fprintf(stderr, "error: readv should not fail\n");
+            io300_close(inf);
+            io300_close(outf);
+            free(buf);
+            return 1;
+        }
+        io300_write(outf, buf, amount);
+        written += amount;
+    }
+
+    io300_close(inf);
+    io300_close(outf);
+    free(buf);
+}
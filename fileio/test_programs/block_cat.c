@@ -3,6 +3,7 @@
 #include <unistd.h>
 
 #include "../io300.h"
+#include "test_helpers.h"
 
 // Copies contents of in-file into out-file in blocks of buffer-size using
 // io300_read and io300_write.
@@ -24,6 +25,7 @@ int main(int argc, char* argv[]) {
     if (in == NULL) {
         return 1;
     }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
 
     struct io300_file* out = io300_open(argv[3], MODE_WRITE, "\e[0;32mout\e[0m");
     if (out == NULL) {
@@ -2,6 +2,7 @@
 #include <unistd.h>
 
 #include "../io300.h"
+#include "test_helpers.h"
 
 // Copies contents of in-file into out-file byte by byte using io300_readc
 // and io300_writec.
@@ -30,6 +31,7 @@ int main(int argc, char* argv[]) {
         io300_close(out);
         return 1;
     }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
 
     int exit_status = 0;
     for (int i = 0; i < filesize; i++) {
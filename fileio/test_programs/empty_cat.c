@@ -0,0 +1,32 @@
+#include <stdio.h>
+
+#include "../io300.h"
+#include "test_helpers.h"
+
+// Opens in-file and out-file like the other *_cat programs, then closes
+// them without copying anything.  The performance tests time this to
+// measure what every test pays before and after its copy loop (process
+// startup, the dynamic loader, sanitizer setup, io300_open/io300_close).
+
+int main(int argc, char* argv[]) {
+    if (argc != 3) {
+        fprintf(stderr, "usage: %s <in-file> <out-file>\n", argv[0]);
+        return 1;
+    }
+
+    struct io300_file* in = io300_open(argv[1], MODE_READ, "\e[0;31min\e[0m");
+    if (in == NULL) {
+        return 1;
+    }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
+
+    struct io300_file* out = io300_open(argv[2], MODE_WRITE, "\e[0;32mout\e[0m");
+    if (out == NULL) {
+        io300_close(in);
+        return 1;
+    }
+
+    io300_close(in);
+    io300_close(out);
+    return 0;
+}
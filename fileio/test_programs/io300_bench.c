@@ -0,0 +1,266 @@
+#include <errno.h>
+#include <fcntl.h>
+#include <getopt.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "../io300.h"
+
+/*
+ * Microbenchmark of one io300 call.  Runs `ops-per-batch` calls of
+ * <op> in a tight loop, `batches` times, and prints how long each batch
+ * took in nanoseconds, one per line.  A single call is too short to
+ * time on its own (clock_gettime costs about as much as a cached
+ * io300_readc), so test_scripts/microbench.py works out per-call
+ * latencies from the batch times.
+ *
+ * The benchmark file is created (with `file-size` random bytes) before
+ * it is opened, and every call stays inside it:  when an access would
+ * run past the end, the position wraps around.  The access pattern
+ * decides where each call happens:
+ *   seq           one after the other (only wrapping around needs a seek)
+ *   reverse       backwards from the end of the file
+ *   random        anywhere in the file
+ *   stride=<N>    N bytes apart, wrapping around
+ * For any pattern but seq, each call is preceded by an io300_seek, and
+ * the seek is part of the time.  With <op> "seek", only the seeks run.
+ */
+
+enum op { OP_READC, OP_WRITEC, OP_READ, OP_WRITE, OP_SEEK };
+enum pattern { PATTERN_SEQ, PATTERN_REVERSE, PATTERN_RANDOM, PATTERN_STRIDE };
+
+static void usage(char* argv0) {
+    fprintf(stderr,
+            "usage: %s [-b ops-per-batch] [-n batches] [-w warmup-batches] [-s size]\n"
+            "          [-f file-size] [-p seq|reverse|random|stride=<N>] [-r seed]\n"
+            "          <readc|writec|read|write|seek> <file>\n",
+            argv0);
+}
+
+static long parse_number(char const* str, char const* what) {
+    char* end;
+    errno = 0;
+    long const n = strtol(str, &end, 10);
+    if (errno != 0 || *end != '\0' || n <= 0) {
+        fprintf(stderr, "error: invalid %s: %s\n", what, str);
+        exit(1);
+    }
+    return n;
+}
+
+/* Fill `path` with `size` random bytes, without going through io300 */
+static int create_file(char const* path, off_t size) {
+    int const fd = open(path, O_WRONLY | O_CREAT | O_TRUNC, 0600);
+    if (fd < 0) {
+        fprintf(stderr, "error: could not create %s: %s\n", path, strerror(errno));
+        return -1;
+    }
+    char buf[65536];
+    for (off_t done = 0; done < size; ) {
+        for (size_t i = 0; i < sizeof(buf); i++) {
+            buf[i] = (char)rand();
+        }
+        size_t const n = size - done < (off_t)sizeof(buf) ? (size_t)(size - done) : sizeof(buf);
+        ssize_t const w = write(fd, buf, n);
+        if (w <= 0) {
+            fprintf(stderr, "error: could not write %s: %s\n", path, strerror(errno));
+            close(fd);
+            return -1;
+        }
+        done += w;
+    }
+    return close(fd);
+}
+
+static long elapsed_ns(struct timespec const* start, struct timespec const* end) {
+    return (end->tv_sec - start->tv_sec) * 1000000000L + (end->tv_nsec - start->tv_nsec);
+}
+
+int main(int argc, char* argv[]) {
+    size_t ops_per_batch = 256;
+    size_t batches = 1000;
+    size_t warmup = 10;
+    size_t size = 32;
+    off_t file_size = 1 << 20;
+    char const* pattern = "seq";
+    off_t stride = 0;
+    unsigned seed = 0;
+
+    int opt;
+    while ((opt = getopt(argc, argv, "b:n:w:s:f:p:r:")) != -1) {
+        switch (opt) {
+        case 'b':
+            ops_per_batch = parse_number(optarg, "batch size");
+            break;
+        case 'n':
+            batches = parse_number(optarg, "number of batches");
+            break;
+        case 'w':
+            warmup = strcmp(optarg, "0") == 0 ? 0 : parse_number(optarg, "warmup batches");
+            break;
+        case 's':
+            size = parse_number(optarg, "access size");
+            break;
+        case 'f':
+            file_size = parse_number(optarg, "file size");
+            break;
+        case 'p':
+            pattern = optarg;
+            break;
+        case 'r':
+            seed = parse_number(optarg, "seed");
+            break;
+        default:
+            usage(argv[0]);
+            return 1;
+        }
+    }
+    if (argc - optind != 2) {
+        usage(argv[0]);
+        return 1;
+    }
+
+    enum op op;
+    char const* const op_name = argv[optind];
+    if (strcmp(op_name, "readc") == 0) {
+        op = OP_READC;
+    } else if (strcmp(op_name, "writec") == 0) {
+        op = OP_WRITEC;
+    } else if (strcmp(op_name, "read") == 0) {
+        op = OP_READ;
+    } else if (strcmp(op_name, "write") == 0) {
+        op = OP_WRITE;
+    } else if (strcmp(op_name, "seek") == 0) {
+        op = OP_SEEK;
+    } else {
+        usage(argv[0]);
+        return 1;
+    }
+    if (op == OP_READC || op == OP_WRITEC || op == OP_SEEK) {
+        size = 1;
+    }
+    enum pattern pat;
+    if (strcmp(pattern, "seq") == 0) {
+        pat = PATTERN_SEQ;
+    } else if (strcmp(pattern, "reverse") == 0) {
+        pat = PATTERN_REVERSE;
+    } else if (strcmp(pattern, "random") == 0) {
+        pat = PATTERN_RANDOM;
+    } else if (strncmp(pattern, "stride=", 7) == 0) {
+        pat = PATTERN_STRIDE;
+        stride = parse_number(pattern + 7, "stride");
+    } else {
+        fprintf(stderr, "error: unknown access pattern %s\n", pattern);
+        return 1;
+    }
+    if ((off_t)size > file_size) {
+        fprintf(stderr, "error: access size is larger than the file\n");
+        return 1;
+    }
+
+    srand(seed);
+    char const* const path = argv[optind + 1];
+    if (create_file(path, file_size) < 0) {
+        return 1;
+    }
+
+    // Work out every position up front, so rand() is not timed
+    size_t const total = (warmup + batches) * ops_per_batch;
+    off_t* const positions = malloc(total * sizeof(off_t));
+    long* const batch_ns = malloc(batches * sizeof(long));
+    char* const buf = malloc(size);
+    if (positions == NULL || batch_ns == NULL || buf == NULL) {
+        fprintf(stderr, "error: could not allocate memory\n");
+        return 1;
+    }
+    memset(buf, 'x', size);
+
+    off_t const last = file_size - size;
+    off_t pos = pat == PATTERN_REVERSE ? last : 0;
+    for (size_t i = 0; i < total; i++) {
+        positions[i] = pos;
+        switch (pat) {
+        case PATTERN_SEQ:
+            pos = pos + (off_t)size > last ? 0 : pos + (off_t)size;
+            break;
+        case PATTERN_REVERSE:
+            pos = pos >= (off_t)size ? pos - (off_t)size : last;
+            break;
+        case PATTERN_RANDOM:
+            pos = (off_t)(((unsigned long)rand() << 16 ^ (unsigned long)rand()) % (last + 1));
+            break;
+        case PATTERN_STRIDE:
+            // Wrap around to the next access within the first stride
+            pos += stride;
+            if (pos > last) {
+                pos = (pos + (off_t)size) % stride;
+                pos = pos > last ? 0 : pos;
+            }
+            break;
+        }
+    }
+
+    struct io300_file* f = io300_open(path, MODE_READ | MODE_WRITE, "\e[0;34mbench\e[0m");
+    if (f == NULL) {
+        return 1;
+    }
+
+    // Where the file position is after the last call, so sequential
+    // calls do not seek
+    off_t at = 0;
+    int failed = 0;
+    for (size_t b = 0; b < warmup + batches && !failed; b++) {
+        struct timespec start, end;
+        clock_gettime(CLOCK_MONOTONIC, &start);
+        for (size_t i = b * ops_per_batch; i < (b + 1) * ops_per_batch; i++) {
+            if (op == OP_SEEK || positions[i] != at) {
+                failed |= io300_seek(f, positions[i]) < 0;
+            }
+            switch (op) {
+            case OP_READC:
+                failed |= io300_readc(f) < 0;
+                break;
+            case OP_WRITEC:
+                failed |= io300_writec(f, 'x') < 0;
+                break;
+            case OP_READ:
+                failed |= io300_read(f, buf, size) != (ssize_t)size;
+                break;
+            case OP_WRITE:
+                failed |= io300_write(f, buf, size) != (ssize_t)size;
+                break;
+            case OP_SEEK:
+                break;
+            }
+            at = positions[i] + (op == OP_SEEK ? 0 : (off_t)size);
+        }
+        clock_gettime(CLOCK_MONOTONIC, &end);
+        if (b >= warmup) {
+            batch_ns[b - warmup] = elapsed_ns(&start, &end);
+        }
+    }
+    if (failed) {
+        fprintf(stderr, "error: %s failed\n", op_name);
+        io300_close(f);
+        return 1;
+    }
+
+    struct timespec start, end;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    io300_close(f);
+    clock_gettime(CLOCK_MONOTONIC, &end);
+
+    printf("# op=%s size=%zu pattern=%s ops_per_batch=%zu close_ns=%ld\n",
+           op_name, size, pattern, ops_per_batch, elapsed_ns(&start, &end));
+    for (size_t b = 0; b < batches; b++) {
+        printf("%ld\n", batch_ns[b]);
+    }
+
+    free(positions);
+    free(batch_ns);
+    free(buf);
+    return 0;
+}
@@ -35,7 +35,7 @@ size_t num_ops = 1000;
 int seeking = 0;
 
 /* The functions that perform/test the chosen operations to test. */
-perform_func operations[4] = {NULL, NULL, NULL, NULL};
+perform_func operations[9] = {NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL};
 
 /* The number of operations to test (i.e. the number of non-`NULL` elements in `operations) */
 int num_test_ops = 0;
@@ -79,7 +79,8 @@ FILE* user_provided_input = NULL;
  * were performed correctly.
  *
  * Takes in the following command line arguments:
- *  - A list of functions to test - any combination of "readc", "writec", "read", "write", or "seek".
+ *  - A list of functions to test - any combination of "readc", "writec", "read", "write", "readv",
+ *    "pwrite", "advise", "peek", "reserve", or "seek".
  *    For "read" or "write", by default a randomly sized buffer of size 1 to `MAX_BLOCK_SIZE` will be
  *    used for each iteration. To specify a fixed size, one can format the argument instead as
  *    "read=<size>" or "write=<size>".
@@ -245,6 +246,23 @@ int main(int argc, char* argv[]) {
             writing = 1;
             operations[num_test_ops] = perform_write;
             num_test_ops++;
+        } else if (!strcmp(argv[i], "readv")) {
+            operations[num_test_ops] = perform_readv;
+            num_test_ops++;
+        } else if (!strcmp(argv[i], "pwrite")) {
+            operations[num_test_ops] = perform_pwrite;
+            num_test_ops++;
+            writing = 1;
+        } else if (!strcmp(argv[i], "advise")) {
+            operations[num_test_ops] = perform_advise;
+            num_test_ops++;
+        } else if (!strcmp(argv[i], "peek")) {
+            operations[num_test_ops] = perform_peek;
+            num_test_ops++;
+        } else if (!strcmp(argv[i], "reserve")) {
+            operations[num_test_ops] = perform_reserve;
+            num_test_ops++;
+            writing = 1;
         } else {
             fprintf(stderr, "Error: invalid command line argument \"%s\"\n",
                     argv[i]);
@@ -349,6 +367,16 @@ void usage(char* argv[]) {
     fprintf(stderr,
             "  write[=<size>] : Test `io300_write`, with optionally a fixed "
             "given buffer size\n");
+    fprintf(stderr,
+            "  readv          : Test `io300_readv` with batches of random reads\n");
+    fprintf(stderr,
+            "  pwrite         : Test `io300_pwrite` at random offsets\n");
+    fprintf(stderr,
+            "  advise         : Give random `io300_advise` hints between other operations\n");
+    fprintf(stderr,
+            "  peek           : Test `io300_peek` and `io300_consume`\n");
+    fprintf(stderr,
+            "  reserve        : Test `io300_reserve` and `io300_commit`\n");
 }
 
 /*
@@ -669,6 +697,258 @@ int perform_write(struct io300_file* file, size_t* loc_ptr,
     return 0;
 }
 
+/*
+ * Performs/tests `io300_readv` using the given opened file:  reads a batch
+ * of up to `MAX_BATCH_SIZE` randomly placed blocks (some possibly past the
+ * end of the file), and checks every block and the new file position
+ * `loc_ptr`, which should be at the end of the last block that started
+ * before the end of the file (if none did, the position is unspecified,
+ * so it seeks back to `loc_ptr`).  One batch in 8 has a block at a negative
+ * offset, which must fail without reading anything or moving `loc_ptr`.
+ *
+ * Returns 0 if the test succeeds, and on failure prints an appropriate error message
+ * and returns -1.
+ */
+int perform_readv(struct io300_file* file, size_t* loc_ptr,
+                  unsigned char* contents) {
+    int const count = (rand() % MAX_BATCH_SIZE) + 1;
+    struct io300_iovec iov[MAX_BATCH_SIZE];
+    unsigned char buffer[MAX_BATCH_SIZE][MAX_BLOCK_SIZE];
+    memset(buffer, POISON_BYTE, sizeof(buffer));
+
+    ssize_t expected_total = 0;
+    size_t expected[MAX_BATCH_SIZE];
+    for (int i = 0; i < count; i++) {
+        iov[i].offset = rand() % max_size;
+        iov[i].len = (rand() % MAX_BLOCK_SIZE) + 1;
+        iov[i].buf = (char*)buffer[i];
+
+        expected[i] = 0;
+        if ((size_t)iov[i].offset < file_size) {
+            expected[i] = MIN(iov[i].len, file_size - iov[i].offset);
+        }
+        expected_total += expected[i];
+    }
+
+    if (rand() % 8 == 0) {
+        iov[rand() % count].offset = -(off_t)(rand() % max_size) - 1;
+        ssize_t const r = io300_readv(file, iov, count);
+        if (r != -1) {
+            fprintf(stderr,
+                    "Error: `io300_readv` of %d blocks, one at a negative offset, "
+                    "returned %ld, expected -1\n", count, r);
+            return -1;
+        }
+        for (int i = 0; i < count; i++) {
+            for (size_t j = 0; j < iov[i].len; j++) {
+                if (buffer[i][j] != (unsigned char)POISON_BYTE) {
+                    fprintf(stderr,
+                            "Error: `io300_readv` with a negative offset wrote "
+                            "into block %d of the batch\n", i);
+                    return -1;
+                }
+            }
+        }
+        return 0;
+    }
+
+    ssize_t const bytes_read = io300_readv(file, iov, count);
+    if (bytes_read != expected_total) {
+        fprintf(stderr,
+                "Error: `io300_readv` of %d blocks returned %ld, expected %ld "
+                "(file size %ld)\n",
+                count, bytes_read, expected_total, file_size);
+        return -1;
+    }
+
+    for (int i = 0; i < count; i++) {
+        for (size_t j = 0; j < expected[i]; j++) {
+            if (buffer[i][j] != contents[iov[i].offset + j]) {
+                fprintf(stderr,
+                        "Error: bytes returned by `io300_readv` did not match "
+                        "at position %ld:  expected 0x%02x, got 0x%02x\n",
+                        iov[i].offset + j,
+                        (unsigned char)contents[iov[i].offset + j],
+                        (unsigned char)buffer[i][j]);
+                return -1;
+            }
+        }
+    }
+    int last = count - 1;
+    while (last >= 0 && (size_t)iov[last].offset >= file_size) {
+        last--;
+    }
+    if (last >= 0) {
+        *loc_ptr = iov[last].offset + expected[last];
+    } else if (io300_seek(file, *loc_ptr) == -1) {
+        // With every block past the end, the position is unspecified
+        fprintf(stderr, "Error: `io300_seek` back to %ld after `io300_readv` failed\n",
+                *loc_ptr);
+        return -1;
+    }
+    return 0;
+}
+
+/*
+ * Performs/tests `io300_pwrite` using the given opened file:  writes a
+ * random block at a random offset (possibly past the end of the file)
+ * and updates `loc_ptr` to the end of the block.
+ *
+ * Returns 0 if the test succeeds, and on failure prints an appropriate error message
+ * and returns -1.
+ */
+int perform_pwrite(struct io300_file* file, size_t* loc_ptr,
+                   unsigned char* contents) {
+    size_t const offset = rand() % max_size;
+    int buffer_size = (rand() % MAX_BLOCK_SIZE) + 1;
+    if (offset + buffer_size > max_size) buffer_size = max_size - offset;
+    for (int j = 0; j < buffer_size; j++)
+        contents[offset + j] = rand() % UCHAR_MAX;
+
+    ssize_t const bytes_written =
+        io300_pwrite(file, (char*)&contents[offset], buffer_size, offset);
+    if (bytes_written != buffer_size) {
+        fprintf(stderr,
+                "Error: `io300_pwrite` at position %ld returned %ld, "
+                "expected %d\n",
+                offset, bytes_written, buffer_size);
+        return -1;
+    }
+    *loc_ptr = offset + bytes_written;
+    file_size = MAX(file_size, *loc_ptr);
+    return 0;
+}
+
+/*
+ * Performs/tests `io300_advise` using the given opened file:  gives a random
+ * access pattern hint, sometimes with IO300_WILLNEED for a random range.
+ * Hints must not change the results of the other operations, which keep
+ * checking the file contents as usual.
+ *
+ * Returns 0 if the test succeeds, and on failure prints an appropriate error message
+ * and returns -1.
+ */
+int perform_advise(struct io300_file* file, size_t* loc_ptr,
+                   unsigned char* contents) {
+    (void)loc_ptr;
+    (void)contents;
+    int const patterns[] = {IO300_NORMAL, IO300_SEQUENTIAL, IO300_REVERSE,
+                            IO300_RANDOM};
+    int advice = patterns[rand() % 4];
+    if (rand() % 2) {
+        advice |= IO300_WILLNEED;
+    }
+    off_t const offset = rand() % max_size;
+    off_t const len = rand() % max_size;
+
+    if (io300_advise(file, advice, offset, len) != 0) {
+        fprintf(stderr, "Error: `io300_advise(%#x, %ld, %ld)` failed\n",
+                advice, offset, len);
+        return -1;
+    }
+    return 0;
+}
+
+/*
+ * Performs/tests `io300_peek` and `io300_consume` using the given opened
+ * file:  peeks at a random number of bytes, checks them, and consumes a
+ * random part of them.  Does nothing if the implementation does not
+ * support zero-copy reads.
+ *
+ * Returns 0 if the test succeeds, and on failure prints an appropriate error message
+ * and returns -1.
+ */
+int perform_peek(struct io300_file* file, size_t* loc_ptr,
+                 unsigned char* contents) {
+    size_t const max = (rand() % MAX_BLOCK_SIZE) + 1;
+    const char* ptr;
+    ssize_t const n = io300_peek(file, &ptr, max);
+    if (n == -1) {
+        return 0;
+    }
+
+    if (n == 0) {
+        if (*loc_ptr < file_size) {
+            fprintf(stderr,
+                    "Error: `io300_peek` returned 0 bytes before end of file "
+                    "(position %ld, file size %ld)\n",
+                    *loc_ptr, file_size);
+            return -1;
+        }
+        return 0;
+    }
+    if ((size_t)n > max || *loc_ptr + n > file_size) {
+        fprintf(stderr,
+                "Error: `io300_peek` of at most %ld bytes at position %ld "
+                "returned %ld (file size %ld)\n",
+                max, *loc_ptr, n, file_size);
+        return -1;
+    }
+    for (ssize_t j = 0; j < n; j++) {
+        if ((unsigned char)ptr[j] != contents[*loc_ptr + j]) {
+            fprintf(stderr,
+                    "Error: bytes returned by `io300_peek` did not match "
+                    "at position %ld:  expected 0x%02x, got 0x%02x\n",
+                    *loc_ptr + j, (unsigned char)contents[*loc_ptr + j],
+                    (unsigned char)ptr[j]);
+            return -1;
+        }
+    }
+
+    size_t const used = rand() % (n + 1);
+    if (io300_consume(file, used) != 0) {
+        fprintf(stderr, "Error: `io300_consume` failed\n");
+        return -1;
+    }
+    *loc_ptr += used;
+    return 0;
+}
+
+/*
+ * Performs/tests `io300_reserve` and `io300_commit` using the given opened
+ * file:  reserves space for a random number of bytes, fills in a random
+ * part of it and commits that part.  Does nothing if the implementation
+ * does not support zero-copy writes.
+ *
+ * Returns 0 if the test succeeds, and on failure prints an appropriate error message
+ * and returns -1.
+ */
+int perform_reserve(struct io300_file* file, size_t* loc_ptr,
+                    unsigned char* contents) {
+    if (*loc_ptr >= max_size) {
+        return 0;
+    }
+    size_t max = (rand() % MAX_BLOCK_SIZE) + 1;
+    if (*loc_ptr + max > max_size) max = max_size - *loc_ptr;
+
+    char* ptr;
+    ssize_t const n = io300_reserve(file, &ptr, max);
+    if (n == -1) {
+        return 0;
+    }
+    if (n == 0 || (size_t)n > max) {
+        fprintf(stderr,
+                "Error: `io300_reserve` of at most %ld bytes returned %ld\n",
+                max, n);
+        return -1;
+    }
+
+    size_t const used = rand() % (n + 1);
+    for (size_t j = 0; j < used; j++) {
+        contents[*loc_ptr + j] = rand() % UCHAR_MAX;
+        ptr[j] = contents[*loc_ptr + j];
+    }
+    if (io300_commit(file, used) != 0) {
+        fprintf(stderr, "Error: `io300_commit` failed\n");
+        return -1;
+    }
+    if (used > 0) {
+        *loc_ptr += used;
+        file_size = MAX(file_size, *loc_ptr);
+    }
+    return 0;
+}
+
 /*
  * Verifies that the file contents for the file located at `path`
  * the same as that contained in `contents`, whose size is given by `size`.
@@ -10,7 +10,9 @@
 #include "../io300.h"
 
 #define MAX(x, y) ((x) > (y) ? (x) : (y))
+#define MIN(x, y) ((x) < (y) ? (x) : (y))
 #define MAX_BLOCK_SIZE 30
+#define MAX_BATCH_SIZE 8
 
 typedef int (*perform_func)(struct io300_file* file, size_t* loc_ptr,
                             unsigned char* contents);
@@ -31,6 +33,16 @@ int perform_read(struct io300_file* file, size_t* loc_ptr,
                  unsigned char* contents);
 int perform_write(struct io300_file* file, size_t* loc_ptr,
                   unsigned char* contents);
+int perform_readv(struct io300_file* file, size_t* loc_ptr,
+                  unsigned char* contents);
+int perform_pwrite(struct io300_file* file, size_t* loc_ptr,
+                   unsigned char* contents);
+int perform_advise(struct io300_file* file, size_t* loc_ptr,
+                   unsigned char* contents);
+int perform_peek(struct io300_file* file, size_t* loc_ptr,
+                 unsigned char* contents);
+int perform_reserve(struct io300_file* file, size_t* loc_ptr,
+                    unsigned char* contents);
 
 int verify_contents(const char* path, unsigned char* contents, size_t size);
 
@@ -0,0 +1,63 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "../io300.h"
+#include "test_helpers.h"
+
+#define MAX_RECORD_SIZE 200
+// Writes out-file like a log:  reads in-file in records of random sizes
+// and appends each to out-file as a line with a sequence number and
+// length in front, using several small io300_write calls per record.
+// Every write extends out-file.
+
+int main(int argc, char* argv[]) {
+    if (argc != 3) {
+        fprintf(stderr, "usage: %s <in-file> <out-file>\n", argv[0]);
+        return 1;
+    }
+
+    struct io300_file* in = io300_open(argv[1], MODE_READ, "\e[0;31min\e[0m");
+    if (in == NULL) {
+        return 1;
+    }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
+
+    struct io300_file* out = io300_open(argv[2], MODE_WRITE, "\e[0;32mout\e[0m");
+    if (out == NULL) {
+        io300_close(in);
+        return 1;
+    }
+    apply_advice(out, IO300_SEQUENTIAL, 0, 0);
+
+    int exit_status = 0;
+    srand(strlen("cs300 rules"));
+
+    char record[MAX_RECORD_SIZE];
+    char header[32];
+    for (unsigned long seq = 0; ; seq++) {
+        size_t const record_size = (rand() % MAX_RECORD_SIZE) + 1;
+        ssize_t const r = io300_read(in, record, record_size);
+        if (r == 0) {
+            break;
+        }
+        if (r == -1) {
+            fprintf(stderr, "error: read should not fail.\n");
+            exit_status = 1;
+            break;
+        }
+
+        int const header_size = snprintf(header, sizeof(header), "%08lu %3zd ", seq, r);
+        if (io300_write(out, header, header_size) != header_size
+            || io300_write(out, record, r) != r
+            || io300_writec(out, '\n') == -1) {
+            fprintf(stderr, "error: write should not fail.\n");
+            exit_status = 1;
+            break;
+        }
+    }
+
+    io300_close(in);
+    io300_close(out);
+    return exit_status;
+}
@@ -0,0 +1,99 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/stat.h>
+
+#include "../io300.h"
+#include "test_helpers.h"
+
+// Copies in-file into out-file without seeking or asking for the file
+// size, so either can be a pipe or a FIFO (e.g. /dev/stdin and
+// /dev/stdout).  With block-size 1, it copies a byte at a time with
+// io300_readc and io300_writec; otherwise, in blocks with io300_read
+// and io300_write, where a read from a pipe may return fewer bytes
+// than asked for.  It also checks that io300_filesize is -1 for a file
+// that is not a regular file.
+
+static int check_filesize(struct io300_file* f, char const* path) {
+    struct stat s;
+    if (stat(path, &s) != 0 || S_ISREG(s.st_mode)) {
+        return 0;
+    }
+    off_t const size = io300_filesize(f);
+    if (size != -1) {
+        fprintf(stderr, "error: io300_filesize should be -1 for %s (not a regular file), got %ld\n",
+                path, (long)size);
+        return -1;
+    }
+    return 0;
+}
+
+int main(int argc, char* argv[]) {
+    if (argc != 4) {
+        fprintf(stderr, "usage: %s <block-size> <in-file> <out-file>\n", argv[0]);
+        return 1;
+    }
+
+    size_t const block_size = strtol(argv[1], NULL, 10);
+    if (block_size == 0) {
+        fprintf(stderr, "error: invalid block size\n");
+        return 1;
+    }
+
+    struct io300_file* in = io300_open(argv[2], MODE_READ, "\e[0;31min\e[0m");
+    if (in == NULL) {
+        return 1;
+    }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
+
+    struct io300_file* out = io300_open(argv[3], MODE_WRITE, "\e[0;32mout\e[0m");
+    if (out == NULL) {
+        io300_close(in);
+        return 1;
+    }
+
+    char* const buffer = malloc(block_size);
+    if (buffer == NULL) {
+        fprintf(stderr, "error: could not allocate buffer\n");
+        io300_close(in);
+        io300_close(out);
+        return 1;
+    }
+
+    int exit_status = 0;
+    if (check_filesize(in, argv[2]) < 0 || check_filesize(out, argv[3]) < 0) {
+        exit_status = 1;
+    }
+
+    while (exit_status == 0) {
+        if (block_size == 1) {
+            int const ch = io300_readc(in);
+            if (ch == -1) {
+                break;
+            }
+            if (io300_writec(out, ch) == -1) {
+                fprintf(stderr, "error: write should not fail\n");
+                exit_status = 1;
+            }
+            continue;
+        }
+
+        ssize_t const r = io300_read(in, buffer, block_size);
+        if (r == 0) {
+            break;
+        }
+        if (r == -1) {
+            fprintf(stderr, "error: read should not fail\n");
+            exit_status = 1;
+            break;
+        }
+        if (io300_write(out, buffer, r) != r) {
+            fprintf(stderr, "error: write should not fail\n");
+            exit_status = 1;
+        }
+    }
+
+    free(buffer);
+    io300_close(in);
+    io300_close(out);
+    return exit_status;
+}
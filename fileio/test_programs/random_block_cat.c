@@ -3,6 +3,7 @@
 #include <string.h>
 
 #include "../io300.h"
+#include "test_helpers.h"
 
 #define MAX_BLOCK_SIZE 30
 // Copies the contents of in-file into out-file in blocks of random
@@ -41,6 +42,7 @@ int main(int argc, char* argv[]) {
         free(buffer);
         return 1;
     }
+    apply_advice(in, IO300_RANDOM, 0, 0);
 
     int exit_status = 0;
     srand(strlen("cs300 rules"));
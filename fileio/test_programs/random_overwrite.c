@@ -0,0 +1,68 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "../io300.h"
+#include "test_helpers.h"
+
+// Overwrites file in place, one block of size block-size at a time, at
+// random offsets, using io300_seek and io300_write.  It makes as many
+// writes as there are blocks in the file.  The offsets and contents
+// depend only on the file size, so running it again changes nothing.
+
+int main(int argc, char* argv[]) {
+    if (argc != 3) {
+        fprintf(stderr, "usage: %s <block-size> <file>\n", argv[0]);
+        return 1;
+    }
+
+    size_t const block_size = strtol(argv[1], NULL, 10);
+    if (block_size == 0) {
+        fprintf(stderr, "error: invalid block size\n");
+        return 1;
+    }
+
+    struct io300_file* f = io300_open(argv[2], MODE_RDWR, "\e[0;31mfile\e[0m");
+    if (f == NULL) {
+        return 1;
+    }
+
+    off_t const filesize = io300_filesize(f);
+    if (filesize < (off_t)block_size) {
+        fprintf(stderr, "error: could not get filesize or file is smaller than a block\n");
+        io300_close(f);
+        return 1;
+    }
+    apply_advice(f, IO300_RANDOM, 0, 0);
+
+    char* const buffer = malloc(block_size);
+    if (buffer == NULL) {
+        fprintf(stderr, "error: could not allocate buffer\n");
+        io300_close(f);
+        return 1;
+    }
+
+    int exit_status = 0;
+    srand(strlen("cs300 rules"));
+
+    for (off_t i = 0; i < filesize / (off_t)block_size; i++) {
+        off_t const pos = rand() % (filesize - block_size + 1);
+        for (size_t j = 0; j < block_size; j++) {
+            buffer[j] = (char)(i + j);
+        }
+        if (io300_seek(f, pos) == -1) {
+            fprintf(stderr, "error: seek should not fail.\n");
+            exit_status = 1;
+            break;
+        }
+        if (io300_write(f, buffer, block_size) != (ssize_t)block_size) {
+            fprintf(stderr, "error: write should not fail.\n");
+            exit_status = 1;
+            break;
+        }
+    }
+
+    free(buffer);
+    io300_close(f);
+    return exit_status;
+}
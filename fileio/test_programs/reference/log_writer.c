@@ -0,0 +1,52 @@
+/*
+ * log_writer.c - Reference program for log_writer
+ *
+ * This program writes the same log as log_writer, but does not use our
+ * io300 library.
+ *
+ * Our testing scripts use this program to compute the expected output
+ * when running log_writer.  To check your own output, you can run:
+ *   test_programs/reference/log_writer <infile> <outfile>
+ * and then compare <outfile> to a file produced by running ./log_writer
+ * on the same input file.
+ */
+
+#include <errno.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define MAX_RECORD_SIZE 200
+
+
+int main(int argc, char* argv[]) {
+    if (argc != 3) {
+	fprintf(stderr, "Usage:  %s <infile> <outfile>\n", argv[0]);
+	exit(1);
+    }
+
+    FILE* in = fopen(argv[1], "r");
+    FILE* out = fopen(argv[2], "w");
+    if (!in || !out) {
+	fprintf(stderr, "Unable to open file:  %s\n", strerror(errno));
+	exit(1);
+    }
+
+    srand(strlen("cs300 rules"));
+
+    char record[MAX_RECORD_SIZE];
+    for (unsigned long seq = 0; ; seq++) {
+	size_t const record_size = (rand() % MAX_RECORD_SIZE) + 1;
+	size_t const r = fread(record, 1, record_size, in);
+	if (r == 0) {
+	    break;
+	}
+	fprintf(out, "%08lu %3zu ", seq, r);
+	fwrite(record, 1, r, out);
+	fputc('\n', out);
+    }
+
+    fclose(in);
+    fclose(out);
+    return 0;
+}
@@ -0,0 +1,73 @@
+/*
+ * random_overwrite.c - Reference program for random_overwrite
+ *
+ * This program makes the same writes as random_overwrite, but does not
+ * use our io300 library.
+ *
+ * Our testing scripts use this program to compute the expected output
+ * when running random_overwrite.  To check your own output, copy a file,
+ * run ./random_overwrite on one copy and this program on the other,
+ * with the same block size, and compare them:
+ *   test_programs/reference/random_overwrite <block_size> <file>
+ */
+
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/stat.h>
+
+
+off_t get_file_size(int fd) {
+    struct stat s;
+    int const r = fstat(fd, &s);
+    if (r >= 0 && S_ISREG(s.st_mode)) {
+        return s.st_size;
+    } else {
+	perror("Unable to get filesize");
+	exit(1);
+    }
+}
+
+
+int main(int argc, char* argv[]) {
+    if (argc != 3) {
+	fprintf(stderr, "Usage:  %s <block_size> <file>\n", argv[0]);
+	exit(1);
+    }
+
+    size_t const block_size = strtol(argv[1], NULL, 10);
+    int fd = open(argv[2], O_RDWR);
+    if (fd < 0) {
+	fprintf(stderr, "Unable to open file:  %s\n", strerror(errno));
+	exit(1);
+    }
+
+    off_t const file_size = get_file_size(fd);
+    char* buffer = malloc(block_size);
+    if (block_size == 0 || file_size < (off_t)block_size || !buffer) {
+	fprintf(stderr, "Invalid block size\n");
+	exit(1);
+    }
+
+    int rv = 0;
+    srand(strlen("cs300 rules"));
+
+    for (off_t i = 0; i < file_size / (off_t)block_size; i++) {
+	off_t const pos = rand() % (file_size - block_size + 1);
+	for (size_t j = 0; j < block_size; j++) {
+	    buffer[j] = (char)(i + j);
+	}
+	if (pwrite(fd, buffer, block_size, pos) != (ssize_t)block_size) {
+	    perror("pwrite");
+	    rv = 1;
+	    break;
+	}
+    }
+
+    free(buffer);
+    close(fd);
+    return rv;
+}
@@ -2,6 +2,7 @@
 #include <stdlib.h>
 
 #include "../io300.h"
+#include "test_helpers.h"
 
 // Copies the contents of in-file into out-file reversed in blocks of
 // buffer-size using io300_seek, io300_read and io300_write.
@@ -38,6 +39,7 @@ int main(int argc, char* argv[]) {
         io300_close(out);
         return 1;
     }
+    apply_advice(in, IO300_REVERSE, 0, 0);
 
     char* const in_buffer = malloc(buffer_size);
     if (in_buffer == NULL) {
@@ -2,6 +2,7 @@
 #include <stdlib.h>
 
 #include "../io300.h"
+#include "test_helpers.h"
 
 // Copies the contents of in-file into out-file reversed byte
 // by byte using io300_seek, io300_readc and io300_writec.
@@ -31,6 +32,7 @@ int main(int argc, char* argv[]) {
 	io300_close(out);
         return 1;
     }
+    apply_advice(in, IO300_REVERSE, 0, 0);
 
     for (int i = filesize - 1; i >= 0; i--) {
         if (io300_seek(in, i) == -1) {
@@ -1,5 +1,6 @@
 #include <stdio.h>
 #include "../io300.h"
+#include "test_helpers.h"
 // Uses ROT13, a simple cipher, to obscure the contents of
 // in-file character by character.
 
@@ -30,6 +31,7 @@ int main(int argc, char* argv[]) {
 	io300_close(in);
 	return 1;
     }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
     for (int i = 0; i < filesize; i++) {
 	if (io300_seek(in, i) == -1) {
 	    fprintf(stderr, "error: seek should not fail.\n");
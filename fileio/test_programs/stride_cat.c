@@ -2,6 +2,7 @@
 #include <stdlib.h>
 
 #include "../io300.h"
+#include "test_helpers.h"
 
 //    Copies the input INFILE to OUTFILE in blocks, shuffling its
 //    contents. Reads INFILE in a strided access pattern and writes
@@ -34,6 +35,8 @@ int main(int argc, char* argv[]) {
         free(buf);
         return 1;
     }
+    // Every byte of the file will be read, just not in order
+    apply_advice(inf, IO300_WILLNEED, 0, 0);
 
     struct io300_file* outf = io300_open(argv[4], MODE_WRITE, "\e[0;32mout\e[0m");
 
@@ -3,6 +3,7 @@
 #include <unistd.h>
 
 #include "test_helpers.h"
+#include "../io300.h"
 
 /* Helper function to clean up old output files
  * left over from a previous test run
@@ -18,3 +19,16 @@ void cleanup_output_file(char *path) {
 	}
     }
 }
+
+/* Pass an access pattern hint to the io300 library, unless hints are
+ * turned off by setting IO300_NO_ADVICE in the environment (so the
+ * performance tests can measure what the hints are worth)
+ */
+void apply_advice(struct io300_file* f, int advice, off_t offset, off_t len) {
+    if (getenv("IO300_NO_ADVICE") != NULL) {
+        return;
+    }
+    if (io300_advise(f, advice, offset, len) == -1) {
+        fprintf(stderr, "warning: io300_advise(%#x) failed\n", advice);
+    }
+}
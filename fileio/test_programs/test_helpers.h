@@ -1,6 +1,10 @@
 #ifndef TEST_HELPERS_H
 #define TEST_HELPERS_H
 
+#include <sys/types.h>
+
+struct io300_file;
+
 /*
  * This file defines helper functions used by various tests.
  */
@@ -10,4 +14,10 @@
  */
 void cleanup_output_file(char* path);
 
+/*
+ * Give the io300 library an access pattern hint (see io300_advise),
+ * unless IO300_NO_ADVICE is set in the environment
+ */
+void apply_advice(struct io300_file* f, int advice, off_t offset, off_t len);
+
 #endif
@@ -0,0 +1,116 @@
+#include <dirent.h>
+#include <errno.h>
+#include <limits.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "../io300.h"
+#include "test_helpers.h"
+
+// Copies every file under in-dir to the same place under out-dir,
+// creating directories as needed, using io300_read and io300_write with
+// a buffer of size block-size.  Meant for trees of many small files,
+// where opening and closing each file costs as much as copying it.
+
+static char* buffer;
+static size_t block_size;
+
+static int copy_file(char const* in_path, char const* out_path) {
+    struct io300_file* in = io300_open(in_path, MODE_READ, "\e[0;31min\e[0m");
+    if (in == NULL) {
+        return -1;
+    }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
+
+    struct io300_file* out = io300_open(out_path, MODE_WRITE, "\e[0;32mout\e[0m");
+    if (out == NULL) {
+        io300_close(in);
+        return -1;
+    }
+
+    int status = 0;
+    while (1) {
+        ssize_t const r = io300_read(in, buffer, block_size);
+        if (r == 0) {
+            break;
+        }
+        if (r == -1) {
+            fprintf(stderr, "error: read should not fail (%s)\n", in_path);
+            status = -1;
+            break;
+        }
+        if (io300_write(out, buffer, r) != r) {
+            fprintf(stderr, "error: write should not fail (%s)\n", out_path);
+            status = -1;
+            break;
+        }
+    }
+
+    io300_close(in);
+    io300_close(out);
+    return status;
+}
+
+// Copies the tree under in_dir to out_dir; returns the number of files
+// copied, or -1 on error
+static long copy_tree(char const* in_dir, char const* out_dir) {
+    if (mkdir(out_dir, 0755) != 0 && errno != EEXIST) {
+        fprintf(stderr, "error: could not create %s: %s\n", out_dir, strerror(errno));
+        return -1;
+    }
+    DIR* dir = opendir(in_dir);
+    if (dir == NULL) {
+        fprintf(stderr, "error: could not open %s: %s\n", in_dir, strerror(errno));
+        return -1;
+    }
+
+    long files = 0;
+    struct dirent* entry;
+    while (files >= 0 && (entry = readdir(dir)) != NULL) {
+        if (strcmp(entry->d_name, ".") == 0 || strcmp(entry->d_name, "..") == 0) {
+            continue;
+        }
+        char in_path[PATH_MAX], out_path[PATH_MAX];
+        snprintf(in_path, sizeof(in_path), "%s/%s", in_dir, entry->d_name);
+        snprintf(out_path, sizeof(out_path), "%s/%s", out_dir, entry->d_name);
+
+        struct stat s;
+        if (lstat(in_path, &s) != 0) {
+            fprintf(stderr, "error: could not stat %s: %s\n", in_path, strerror(errno));
+            files = -1;
+        } else if (S_ISDIR(s.st_mode)) {
+            long const n = copy_tree(in_path, out_path);
+            files = n < 0 ? -1 : files + n;
+        } else if (S_ISREG(s.st_mode)) {
+            files = copy_file(in_path, out_path) < 0 ? -1 : files + 1;
+        }
+    }
+
+    closedir(dir);
+    return files;
+}
+
+int main(int argc, char* argv[]) {
+    if (argc != 4) {
+        fprintf(stderr, "usage: %s <block-size> <in-dir> <out-dir>\n", argv[0]);
+        return 1;
+    }
+
+    block_size = strtol(argv[1], NULL, 10);
+    if (block_size == 0) {
+        fprintf(stderr, "error: invalid block size\n");
+        return 1;
+    }
+    buffer = malloc(block_size);
+    if (buffer == NULL) {
+        fprintf(stderr, "error: could not allocate buffer\n");
+        return 1;
+    }
+
+    long const files = copy_tree(argv[2], argv[3]);
+    free(buffer);
+    return files < 0 ? 1 : 0;
+}
@@ -0,0 +1,103 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "../io300.h"
+#include "test_helpers.h"
+
+// Copies contents of in-file into out-file in blocks of at most
+// buffer-size, like block_cat, but moves each block straight from the
+// input file's cache to the output file's cache with io300_peek and
+// io300_reserve, so every byte is copied once instead of twice.  Falls
+// back to io300_read and io300_write if the implementation does not
+// support zero-copy access.
+
+int main(int argc, char* argv[]) {
+    if (argc != 4) {
+        fprintf(stderr, "usage: %s <buffer-size> <in-file> <out-file>\n",
+                argv[0]);
+        return 1;
+    }
+    int const buffer_size = atoi(argv[1]);
+    if (buffer_size <= 0) {
+        fprintf(stderr,
+                "error: specify numeric buffer size > 0 bytes. you gave %s\n",
+                argv[1]);
+        return 1;
+    }
+
+    struct io300_file* in = io300_open(argv[2], MODE_READ, "\e[0;31min\e[0m");
+    if (in == NULL) {
+        return 1;
+    }
+    apply_advice(in, IO300_SEQUENTIAL, 0, 0);
+
+    struct io300_file* out = io300_open(argv[3], MODE_WRITE, "\e[0;32mout\e[0m");
+    if (out == NULL) {
+        io300_close(in);
+        return 1;
+    }
+
+    char* const buffer = malloc(buffer_size);
+    if (buffer == NULL) {
+        fprintf(stderr, "error: could not allocate buffer\n");
+        io300_close(in);
+        io300_close(out);
+        return 1;
+    }
+
+    int exit_status = 0;
+    while (1) {
+        const char* src;
+        ssize_t r = io300_peek(in, &src, buffer_size);
+        if (r == -1) {
+            // No zero-copy reads:  copy through our own buffer
+            r = io300_read(in, buffer, buffer_size);
+            src = buffer;
+        }
+        if (r == 0 || r == -1) {
+            // input file empty
+            break;
+        }
+
+        if (src == buffer) {
+            if (io300_write(out, buffer, r) != r) {
+                fprintf(stderr, "error: all writes should succeed\n");
+                exit_status = 1;
+                break;
+            }
+            continue;
+        }
+
+        char* dst;
+        ssize_t const w = io300_reserve(out, &dst, r);
+        if (w == -1) {
+            if (io300_write(out, src, r) != r) {
+                fprintf(stderr, "error: all writes should succeed\n");
+                exit_status = 1;
+                break;
+            }
+        } else {
+            // Take only what fits in the output cache; the rest of the
+            // input block is peeked at again next time round
+            memcpy(dst, src, w);
+            if (io300_commit(out, w) == -1) {
+                fprintf(stderr, "error: commit should not fail\n");
+                exit_status = 1;
+                break;
+            }
+            r = w;
+        }
+
+        if (io300_consume(in, r) == -1) {
+            fprintf(stderr, "error: consume should not fail\n");
+            exit_status = 1;
+            break;
+        }
+    }
+
+    free(buffer);
+    io300_close(in);
+    io300_close(out);
+    return exit_status;
+}
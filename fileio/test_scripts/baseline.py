@@ -0,0 +1,171 @@
+# baseline.py - Reuse stdio's performance results from earlier runs
+#
+# stdio's times only change when the machine, the kernel, the file
+# system the tests run on, the test file size or the build change, but
+# every `make perf` used to build and time the whole stdio suite again.
+# A BaselineCache keeps each test's stdio trials, and stdio's startup
+# time, in a JSON file.  They are keyed by a fingerprint of all of these
+# (fingerprint() below).  Entries younger than
+# PERFORMANCE_BASELINE_MAX_AGE are reused.
+#
+# After every PERFORMANCE_BASELINE_CHECK_EVERY reuses, stdio is built
+# anyway and a few cached tests run again as a spot check.  If one of
+# them is further from the cached mean than its confidence interval,
+# PERFORMANCE_BASELINE_DRIFT of it and WARN_TIME_THRESHOLD, something
+# the fingerprint does not see has changed, and every entry for this
+# fingerprint is thrown away.
+#
+# Graded runs (performance_test.run with grader_mode) do not use the
+# cache at all:  the ratios they report compare stdio and student times
+# taken in the same run.
+
+import os
+import glob
+import math
+import json
+import time
+import hashlib
+import subprocess
+
+import defaults
+from trials import mean_ci
+
+# Version 2:  trials are timed with perf_counter and wait4 rather than
+# /usr/bin/time, whose 10 ms resolution version 1's results have
+VERSION = 2
+
+# Everything a stdio test program is built from
+BUILD_INPUTS = ["Makefile", "io300.h", "io300_fallback.c", "io300_stats.c", "impl/stdio.c",
+                "test_programs/*.c", "test_programs/*.h"]
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in ("model name", "Hardware", "cpu model"):
+                    return value.strip()
+    except OSError:
+        pass
+    return os.uname().machine
+
+
+def _fs_type(path):
+    """Type of the file system path is on (its longest mount point)"""
+    path = os.path.realpath(path)
+    best, fs = "", None
+    with open("/proc/mounts", "r") as f:
+        for line in f:
+            fields = line.split()
+            mount = fields[1]
+            if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) > len(best):
+                best, fs = mount, fields[2]
+    return fs
+
+
+def _compiler():
+    try:
+        out = subprocess.run([os.environ.get("CC", "cc"), "--version"], capture_output=True, text=True)
+        return out.stdout.splitlines()[0] if out.stdout else None
+    except OSError:
+        return None
+
+
+def _sources_hash():
+    h = hashlib.sha256()
+    for pattern in BUILD_INPUTS:
+        for path in sorted(glob.glob(pattern)):
+            h.update(path.encode())
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def fingerprint(test_dir, makecmd):
+    """What stdio's times depend on, other than the test and its file size"""
+    return {
+        "cpu_model": _cpu_model(),
+        "kernel": os.uname().release,
+        "fs_type": _fs_type(test_dir),
+        "makecmd": makecmd,
+        "cflags": os.environ.get("CFLAGS", ""),
+        "san": os.environ.get("SAN"),
+        "compiler": _compiler(),
+        "sources": _sources_hash(),
+    }
+
+
+class BaselineCache:
+    """
+    stdio's results from earlier runs on this fingerprint.  get() and
+    put() take a test's name, its TestSpec and its file size.
+    """
+    def __init__(self, path, fp, max_age=defaults.PERFORMANCE_BASELINE_MAX_AGE):
+        self.path = os.path.expanduser(path)
+        self.fingerprint = fp
+        self.key = hashlib.sha256(json.dumps(fp, sort_keys=True).encode()).hexdigest()[:16]
+        self.max_age = max_age
+        self.data = {"version": VERSION, "machines": {}}
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == VERSION:
+                self.data = data
+        except (OSError, ValueError):
+            pass
+        self.machine = self.data["machines"].setdefault(
+            self.key, {"fingerprint": fp, "reuses": 0, "entries": {}})
+
+    @staticmethod
+    def _entry_key(testname, spec, size):
+        return f"{testname}/{spec!r}/{size}"
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry["created"] <= self.max_age
+
+    def get(self, testname, spec, size):
+        """The cached stdio trials of the test, or None"""
+        entry = self.machine["entries"].get(self._entry_key(testname, spec, size))
+        return entry["trials"] if self._fresh(entry) else None
+
+    def put(self, testname, spec, size, trials):
+        self.machine["entries"][self._entry_key(testname, spec, size)] = {
+            "created": time.time(), "trials": trials}
+
+    def get_startup(self):
+        entry = self.machine["entries"].get("startup")
+        return entry["startup"] if self._fresh(entry) else None
+
+    def put_startup(self, startup):
+        self.machine["entries"]["startup"] = {"created": time.time(), "startup": startup}
+
+    def check_due(self):
+        """True if the cached results should be spot-checked this run"""
+        return self.machine["reuses"] >= defaults.PERFORMANCE_BASELINE_CHECK_EVERY
+
+    def reused(self):
+        self.machine["reuses"] += 1
+
+    def checked(self):
+        self.machine["reuses"] = 0
+
+    def drifted(self, trials, wtime):
+        """True if a new stdio time is out of line with the cached trials"""
+        mean, halfwidth = mean_ci([t["wtime"] for t in trials])
+        if math.isinf(halfwidth):
+            halfwidth = 0.0
+        # Differences too short to time reliably don't count
+        return abs(wtime - mean) > max(halfwidth, defaults.PERFORMANCE_BASELINE_DRIFT * mean,
+                                       defaults.WARN_TIME_THRESHOLD)
+
+    def invalidate(self):
+        self.machine["entries"] = {}
+        self.machine["reuses"] = 0
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
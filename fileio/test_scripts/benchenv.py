@@ -0,0 +1,249 @@
+# benchenv.py - Record and steady the machine state around benchmark trials
+#
+# Timings can only be compared if nothing else competed for the CPU or
+# the disk while they were taken.  preflight() records the CPU frequency
+# governor, turbo, SMT, load average and any processes known to make
+# noise (package managers, indexers), and choose_core() picks a core to
+# pin the test programs to.  A TrialMonitor then watches each trial.  It
+# measures how much *other* work ran on that core, whether the core's
+# frequency moved, and which other processes did disk I/O, so noisy
+# trials can be flagged and run again.
+#
+# Everything here reads /proc and /sys; whatever a machine (or a
+# container) does not expose is recorded as None and not checked.
+
+import os
+import time
+
+import defaults
+
+SYS_CPU = "/sys/devices/system/cpu"
+
+# Processes that do a lot of disk or CPU work in the background
+NOISY_COMMANDS = {
+    "apt", "apt-get", "aptitude", "dpkg", "unattended-upgr", "packagekitd",
+    "yum", "dnf", "rpm", "snapd", "updatedb", "updatedb.mlocate", "mandb",
+    "tracker-miner-f", "baloo_file", "fstrim", "e2scrub", "btrfs",
+}
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_cpu_list(text):
+    """CPUs in a kernel list like "0-3,8"""
+    cpus = []
+    for part in (text or "").split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.extend(range(int(lo), int(hi) + 1))
+        elif part.strip():
+            cpus.append(int(part))
+    return cpus
+
+
+def core_of(cpu):
+    """The CPU and its SMT siblings"""
+    siblings = _parse_cpu_list(_read(f"{SYS_CPU}/cpu{cpu}/topology/thread_siblings_list"))
+    return sorted(siblings) if siblings else [cpu]
+
+
+def cpu_times():
+    """Busy and total time of each CPU since boot, in seconds"""
+    tick = os.sysconf("SC_CLK_TCK")
+    times = {}
+    with open("/proc/stat", "r") as f:
+        for line in f:
+            name, *fields = line.split()
+            if not name.startswith("cpu") or name == "cpu":
+                continue
+            values = [int(x) for x in fields]
+            # idle and iowait
+            idle = values[3] + (values[4] if len(values) > 4 else 0)
+            # guest time is already counted in user time
+            total = sum(values[:8])
+            times[int(name[3:])] = ((total - idle) / tick, total / tick)
+    return times
+
+
+def cpu_freqs_khz(cpus):
+    freqs = {}
+    for cpu in cpus:
+        khz = _read(f"{SYS_CPU}/cpu{cpu}/cpufreq/scaling_cur_freq")
+        if khz is not None:
+            freqs[cpu] = int(khz)
+    return freqs
+
+
+def governors():
+    """How many CPUs use each cpufreq governor"""
+    counts = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        gov = _read(f"{SYS_CPU}/cpu{cpu}/cpufreq/scaling_governor")
+        if gov is not None:
+            counts[gov] = counts.get(gov, 0) + 1
+    return counts
+
+
+def turbo_enabled():
+    no_turbo = _read(f"{SYS_CPU}/intel_pstate/no_turbo")
+    if no_turbo is not None:
+        return no_turbo == "0"
+    boost = _read(f"{SYS_CPU}/cpufreq/boost")
+    if boost is not None:
+        return boost == "1"
+    return None
+
+
+def noisy_processes():
+    found = []
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
+            comm = _read(f"/proc/{pid}/comm")
+            if comm in NOISY_COMMANDS:
+                found.append(f"{comm}({pid})")
+    return found
+
+
+def process_io():
+    """Bytes each other process has read from and written to storage"""
+    io = {}
+    me = os.getpid()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit() or int(pid) == me:
+            continue
+        text = _read(f"/proc/{pid}/io")
+        if text is None:
+            continue
+        fields = dict(line.split(": ") for line in text.splitlines() if ": " in line)
+        io[int(pid)] = (_read(f"/proc/{pid}/comm"),
+                        int(fields.get("read_bytes", 0)) + int(fields.get("write_bytes", 0)))
+    return io
+
+
+def choose_core(sample_sec=0.2):
+    """
+    CPUs (one core and its SMT siblings) to pin the test programs to:
+    an isolated core if the kernel has any, otherwise the core that was
+    least busy over a short sample, avoiding CPU 0 (which handles most
+    interrupts) when there is a choice.
+    """
+    allowed = os.sched_getaffinity(0)
+    isolated = [c for c in _parse_cpu_list(_read(f"{SYS_CPU}/isolated")) if c in allowed]
+    if isolated:
+        return core_of(isolated[0])
+
+    cores = []
+    for cpu in sorted(allowed):
+        core = [c for c in core_of(cpu) if c in allowed]
+        if core not in cores:
+            cores.append(core)
+    if len(cores) > 1:
+        cores = [core for core in cores if 0 not in core] or cores
+
+    before = cpu_times()
+    time.sleep(sample_sec)
+    after = cpu_times()
+
+    def _busy(core):
+        return sum(after[c][0] - before[c][0] for c in core if c in before and c in after)
+    return min(cores, key=_busy)
+
+
+def pin(cpus):
+    """Restrict the calling process to `cpus` (for use in preexec_fn)"""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+
+def preflight(cpus):
+    """Snapshot of the machine state, with warnings about what could add noise"""
+    load = os.getloadavg()
+    env = {
+        "cpus_online": _read(f"{SYS_CPU}/online"),
+        "pinned_cpus": cpus,
+        "governors": governors() or None,
+        "turbo": turbo_enabled(),
+        "smt_active": {"1": True, "0": False}.get(_read(f"{SYS_CPU}/smt/active")),
+        "freq_khz": cpu_freqs_khz(cpus) or None,
+        "loadavg": list(load),
+        "noisy_processes": noisy_processes(),
+        "warnings": [],
+    }
+
+    warnings = env["warnings"]
+    if env["governors"] and set(env["governors"]) != {"performance"}:
+        warnings.append("CPU frequency governor is {} (not performance)".format(
+            "/".join(sorted(env["governors"]))))
+    if env["turbo"]:
+        warnings.append("turbo boost is on, so the clock speed depends on temperature")
+    if load[0] > defaults.ENV_MAX_LOAD:
+        warnings.append("load average is {:.2f}".format(load[0]))
+    if env["noisy_processes"]:
+        warnings.append("busy background processes: {}".format(
+            ", ".join(env["noisy_processes"])))
+    return env
+
+
+class TrialMonitor:
+    """
+    Watches the pinned CPUs and the rest of the machine during one trial.
+    stop() returns what it saw; its "noisy" list says why the trial
+    should not be trusted (and is empty if it can be).
+    """
+    def __init__(self, cpus):
+        self.cpus = cpus
+
+    def start(self):
+        self.io = process_io()
+        self.freqs = cpu_freqs_khz(self.cpus)
+        self.times = cpu_times()
+        self.start_time = time.monotonic()
+
+    def stop(self, own_cpu_sec=0.0):
+        wall = time.monotonic() - self.start_time
+        times = cpu_times()
+        freqs = cpu_freqs_khz(self.cpus)
+        io = process_io()
+
+        busy = sum(times[c][0] - self.times[c][0] for c in self.cpus
+                   if c in times and c in self.times)
+        # Clock ticks are coarse, so short trials can't be judged
+        other_cpu = max(0.0, busy - own_cpu_sec)
+        other_fraction = min(1.0, other_cpu / (wall * len(self.cpus))) if wall > 0.1 else 0.0
+
+        freq_change = 0.0
+        for cpu, khz in freqs.items():
+            if self.freqs.get(cpu):
+                freq_change = max(freq_change, abs(khz - self.freqs[cpu]) / self.freqs[cpu])
+
+        other_io = {}
+        for pid, (comm, nbytes) in io.items():
+            if pid in self.io:
+                delta = nbytes - self.io[pid][1]
+                if delta > 0:
+                    other_io[f"{comm}({pid})"] = delta
+
+        noisy = []
+        if other_fraction > defaults.ENV_MAX_OTHER_CPU:
+            noisy.append("other work used {:.0%} of the test's CPU".format(other_fraction))
+        if freq_change > defaults.ENV_MAX_FREQ_CHANGE:
+            noisy.append("CPU frequency changed by {:.0%}".format(freq_change))
+        busy_io = sorted((name for name, n in other_io.items()
+                          if n > defaults.ENV_MAX_OTHER_IO_BYTES))
+        if busy_io:
+            noisy.append("disk I/O by {}".format(", ".join(busy_io)))
+
+        return {
+            "wall_sec": wall,
+            "other_cpu_fraction": other_fraction,
+            "freq_change": freq_change if freqs else None,
+            "loadavg": os.getloadavg()[0],
+            "other_io_bytes": sum(other_io.values()),
+            "noisy": noisy,
+        }
@@ -4,8 +4,13 @@ import re
 import os
 import sys
 import json
+import time
+import random
+import shutil
 import signal
+import hashlib
 import pathlib
+import threading
 import argparse
 import tempfile
 import subprocess
@@ -14,6 +19,10 @@ import datetime
 from dataclasses import dataclass, field
 
 import util
+import cgroup
+import defaults
+import benchenv
+from trials import TrialBudget, mean_ci, percentile, priority
 from correctness_test import TestByteCat, TestReverseByteCat, \
     TestBlockCat, TestReverseBlockCat, TestRandomBlockCat, \
     TestStrideCat, TestDiabolicalByteCat, shell_return
@@ -36,6 +45,12 @@ GRADER_MODE = False
 # PGID of running test program
 RUNNING_PGID = None
 
+# CPUs the test programs are pinned to, or None
+PINNED_CPUS = None
+
+# Groups the timed test programs run in (see cgroup.py), or None
+CGROUPS = None
+
 
 log_lines = []
 
@@ -80,11 +95,12 @@ def silent_shell(cmd, echo=False):
     if echo:
         print("-> {}".format(cmd))
 
+    argv, env = util.split_command(cmd)
     sp = subprocess.run(
-        cmd,
+        argv,
+        env=env,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True
+        stderr=subprocess.PIPE
     )
     if sp.returncode != 0:
         print(f'fatal: the command `${cmd}` failed')
@@ -103,6 +119,12 @@ def get_sec(time_str):
 def _get_usec(d: datetime.timedelta):
     return int((d.seconds * 1e6) + d.microseconds)
 
+def _start_test_program():
+    os.setpgrp()
+    benchenv.pin(PINNED_CPUS)
+    if CGROUPS is not None:
+        CGROUPS.enter()
+
 def time_program(progcmd):
     global TIMEOUT_SEC
     global RUNNING_PGID
@@ -112,10 +134,12 @@ def time_program(progcmd):
     sp = None
     failed = False
     cmd = ['/usr/bin/time', '--verbose', '--'] + progcmd.split(' ')
+    if CGROUPS is not None:
+        CGROUPS.start()
     proc = subprocess.Popen(cmd,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE,
-                            preexec_fn=os.setpgrp)
+                            preexec_fn=_start_test_program)
 
     RUNNING_PGID = os.getpgid(proc.pid)
     stdout, stderr = bytes(), bytes()
@@ -126,6 +150,7 @@ def time_program(progcmd):
         os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
         #log(FAIL + f"timed out after {TIMEOUT_SEC} seconds" + ENDC)
         failed = True
+    usage = CGROUPS.stop() if CGROUPS is not None else None
 
     returncode = proc.returncode
     if failed or returncode != 0:
@@ -149,6 +174,7 @@ def time_program(progcmd):
         # we couldn't parse the output, so the command probably failed
         return None
     else:
+        perf_data['cgroup'] = usage
         return perf_data
 
 
@@ -183,6 +209,9 @@ def reverse_byte_cat(infile, outfile):
 def block_cat(infile, outfile):
     return f'./block_cat 32 {infile} {outfile}'
 
+def zero_copy_block_cat(infile, outfile):
+    return f'./zero_copy_block_cat 32 {infile} {outfile}'
+
 def reverse_block_cat(infile, outfile):
     return f'./reverse_block_cat 32 {infile} {outfile}'
 
@@ -192,16 +221,54 @@ def random_block_cat(infile, outfile):
 def stride_cat(infile, outfile):
     return f'./stride_cat 1 1024 {infile} {outfile}'
 
+def batch_reverse_block_cat(infile, outfile):
+    return f'./batch_reverse_block_cat 32 {infile} {outfile}'
+
+def batch_stride_cat(infile, outfile):
+    return f'./batch_stride_cat 1 1024 {infile} {outfile}'
+
+def _without_advice(run_func):
+    # The test programs skip their io300_advise calls if this is set
+    return lambda infile, outfile: "env IO300_NO_ADVICE=1 " + run_func(infile, outfile)
+
+LARGE_FILE_BLOCK_SIZE = 65536
+
+def large_block_cat(infile, outfile):
+    return f'./block_cat {LARGE_FILE_BLOCK_SIZE} {infile} {outfile}'
+
+def _timed_trial(progcmd, before_trial=None):
+    """
+    Time progcmd.  If the test programs are pinned, each trial is
+    watched by a TrialMonitor and run again (after before_trial) while
+    it looks noisy; the result's "environment" says what was seen.
+    """
+    monitor = benchenv.TrialMonitor(PINNED_CPUS) if PINNED_CPUS else None
+    for attempt in range(defaults.ENV_MAX_RERUNS + 1):
+        if before_trial is not None:
+            before_trial()
+        if monitor is not None:
+            monitor.start()
+        perf_results = time_program(progcmd)
+        if monitor is None or perf_results is None:
+            return perf_results
+        perf_results["environment"] = monitor.stop(perf_results["utime"] + perf_results["stime"])
+        perf_results["environment"]["reruns"] = attempt
+        if not perf_results["environment"]["noisy"]:
+            break
+        print("[noisy] ", end="")
+    return perf_results
+
+
 def _run_benchmark(prefix, run_func, file_size):
     _prefix = pathlib.Path(prefix)
     infile = str(_prefix / "infile")
     outfile = str(_prefix / "outfile")
 
-    silent_shell(f"rm -f {infile} {outfile}")
-    silent_shell(f'dd if=/dev/urandom of={infile} bs={file_size} count=1')
+    util.remove_files(outfile)
+    util.random_file(infile, file_size)
 
-    perf_results = time_program(run_func(infile, outfile))
-    silent_shell(f"rm -f {infile} {outfile}")
+    perf_results = _timed_trial(run_func(infile, outfile))
+    util.remove_files(infile, outfile)
 
     return perf_results
 
@@ -209,7 +276,527 @@ def _run_benchmark(prefix, run_func, file_size):
 TIMEOUT_STR = "[timed out]"
 SKIPPED_STR = "[skipped]"
 
-def do_run(uname: str, impl: str, prefix: str, trials=1):
+
+def meminfo_cached_kb():
+    with open("/proc/meminfo", "r") as fd:
+        for line in fd:
+            if line.startswith("Cached:"):
+                return int(line.split()[1])
+    return None
+
+
+def _drop_from_page_cache(path):
+    # Ask the kernel to forget the file's cached pages, so each trial
+    # starts cold and only the program under test fills the page cache
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def supports_o_direct(directory):
+    """Whether files in directory can be opened with O_DIRECT, as impl/direct.c tries to"""
+    fd, path = tempfile.mkstemp(dir=directory)
+    os.close(fd)
+    try:
+        os.close(os.open(path, os.O_RDWR | os.O_DIRECT))
+        return True
+    except OSError:
+        return False
+    finally:
+        os.remove(path)
+
+
+def do_large_file_run(uname: str, impl: str, prefix: str, file_size: int, trials=1,
+                      o_direct=True):
+    """
+    Copy one large file with block_cat and report its throughput, along
+    with how much the page cache ("Cached:" in /proc/meminfo) grew while
+    it ran.  Buffered implementations leave the whole file in the page
+    cache; IMPL=direct should leave almost nothing, if it could open
+    the files with O_DIRECT (o_direct).
+    """
+    silent_shell("make clean")
+    silent_shell('CFLAGS=-DCACHE_SIZE=4096 make -B IMPL={}'.format(impl), echo=True)
+
+    _prefix = pathlib.Path(prefix)
+    infile = str(_prefix / "large_infile")
+    outfile = str(_prefix / "large_outfile")
+    size_mb = file_size / (1024 * 1024)
+
+    util.remove_files(outfile)
+    util.random_file(infile, int(size_mb) * 1024 * 1024)
+
+    print("\nRunning large-file benchmark {}:{}:{}M => ".format(prefix, impl, size_mb), end="")
+    sys.stdout.flush()
+
+    results = []
+    for t in range(0, trials):
+        cached_before = None
+
+        def _before_trial():
+            nonlocal cached_before
+            util.remove_files(outfile)
+            _drop_from_page_cache(infile)
+            cached_before = meminfo_cached_kb()
+
+        runtime = _timed_trial(large_block_cat(infile, outfile), before_trial=_before_trial)
+        cached_after = meminfo_cached_kb()
+
+        res: dict = {
+            "trial": t,
+            "benchmark": "large_block_cat",
+            "impl": impl,
+            "size": file_size,
+            "cached_delta_kb": cached_after - cached_before,
+        }
+        if impl == "direct":
+            res["o_direct"] = o_direct
+        if runtime is None:
+            res["time"] = TIMEOUT_STR
+            print("[timed out] ", end="")
+        else:
+            res["time"] = runtime["wtime"]
+            res["environment"] = runtime.get("environment")
+            res["cgroup"] = runtime.get("cgroup")
+            res["throughput_mb_s"] = size_mb / max(runtime["wtime"], 0.001)
+            print("{:.3f}s ({:.1f} MB/s, Cached {:+d} kB) ".format(
+                runtime["wtime"], res["throughput_mb_s"], res["cached_delta_kb"]), end="")
+        sys.stdout.flush()
+        results.append(res)
+
+    print("")
+    util.remove_files(infile, outfile)
+    return results
+
+# Benchmarks for the concurrency run, from one copy up to one per core
+CONCURRENCY_BENCHMARKS = {
+    'byte_cat': byte_cat,
+    'block_cat': block_cat,
+    'reverse_block_cat': reverse_block_cat,
+    'stride_cat': stride_cat,
+}
+
+CONCURRENCY_MODES = ["separate", "shared"]
+
+
+def _copy_counts(max_copies):
+    """1, 2, 4, ... copies, up to and including max_copies"""
+    counts = []
+    n = 1
+    while n < max_copies:
+        counts.append(n)
+        n *= 2
+    counts.append(max_copies)
+    return counts
+
+
+def _run_concurrently(progcmds):
+    """
+    Start all of progcmds at once.  Returns the seconds from the start
+    until each finished, or None if any of them failed or they did not
+    all finish within TIMEOUT_SEC.
+    """
+    deadline = time.monotonic() + TIMEOUT_SEC if TIMEOUT_SEC > 0 else None
+    started = time.monotonic()
+    # The copies are not pinned:  the point is to spread them over the cores
+    procs = [subprocess.Popen(cmd.split(' '),
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL,
+                              preexec_fn=os.setpgrp)
+             for cmd in progcmds]
+    finished = [None] * len(procs)
+    try:
+        while None in finished:
+            for i, proc in enumerate(procs):
+                if finished[i] is None and proc.poll() is not None:
+                    finished[i] = time.monotonic() - started
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(0.001)
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                os.killpg(proc.pid, signal.SIGTERM)
+                proc.wait()
+
+    if any(proc.returncode != 0 for proc in procs):
+        return None
+    return finished
+
+
+def do_concurrency_run(uname: str, impl: str, prefix: str, file_size: int,
+                       max_copies: int, trials=1):
+    """
+    Run N copies of each of CONCURRENCY_BENCHMARKS at once, for N from
+    1 to max_copies, and report their aggregate throughput, how it
+    scaled compared with one copy, and when the copies finished.  In
+    "separate" mode each copy reads an input file of its own; in
+    "shared" mode they all read the same one.  Each copy always writes
+    its own output file.
+    """
+    silent_shell("make clean")
+    silent_shell('CFLAGS=-DCACHE_SIZE=4096 make -B IMPL={}'.format(impl), echo=True)
+
+    _prefix = pathlib.Path(prefix)
+    size_mb = file_size / (1024 * 1024)
+    infiles = [str(_prefix / f"concurrent_infile_{i}") for i in range(max_copies)]
+    outfiles = [str(_prefix / f"concurrent_outfile_{i}") for i in range(max_copies)]
+    for infile in infiles:
+        util.random_file(infile, file_size)
+
+    results = []
+    for name, func in CONCURRENCY_BENCHMARKS.items():
+        for mode in CONCURRENCY_MODES:
+            # Aggregate MB/s of a single copy, to scale the others by
+            single_throughput = None
+            for copies in _copy_counts(max_copies):
+                print("\nRunning concurrency benchmark {}:{}:{}M, {} copies, {} input => ".format(
+                    impl, name, size_mb, copies, mode), end="")
+                sys.stdout.flush()
+
+                progcmds = [func(infiles[0] if mode == "shared" else infiles[i], outfiles[i])
+                            for i in range(copies)]
+                completions = []
+                throughputs = []
+                for t in range(0, trials):
+                    util.remove_files(*outfiles)
+                    finished = _run_concurrently(progcmds)
+                    if finished is None:
+                        print("[timed out] ", end="")
+                        continue
+                    completions.extend(finished)
+                    throughputs.append(copies * size_mb / max(max(finished), 0.001))
+                    print("{:.3f}s ".format(max(finished)), end="")
+                    sys.stdout.flush()
+
+                res: dict = {
+                    "benchmark": name,
+                    "impl": impl,
+                    "prefix": prefix,
+                    "uname": uname,
+                    "mode": mode,
+                    "copies": copies,
+                    "size": file_size,
+                    "completion_times": completions,
+                }
+                if not throughputs:
+                    res["time"] = TIMEOUT_STR
+                    results.append(res)
+                    print(f"\nAll trials of {copies} copies timed out, skipping more copies")
+                    break
+
+                throughput = sum(throughputs) / len(throughputs)
+                if copies == 1:
+                    single_throughput = throughput
+                res["throughput_mb_s"] = throughput
+                res["scaling_efficiency"] = throughput / (copies * single_throughput) \
+                    if single_throughput else None
+                res["completion_p50"] = percentile(completions, 50)
+                res["completion_p99"] = percentile(completions, 99)
+                res["completion_max"] = max(completions)
+                results.append(res)
+                print("=> {:.1f} MB/s{}, finished p50 {:.3f}s p99 {:.3f}s max {:.3f}s".format(
+                    throughput,
+                    "" if res["scaling_efficiency"] is None else
+                    " ({:.0%} efficiency)".format(res["scaling_efficiency"]),
+                    res["completion_p50"], res["completion_p99"], res["completion_max"]), end="")
+
+    print("")
+    util.remove_files(*infiles, *outfiles)
+    return results
+
+# pipe_cat block sizes and transports for the streaming run
+STREAM_BLOCK_SIZES = [1, 32, 4096]
+STREAM_TRANSPORTS = ["pipe", "fifo"]
+# Largest write the producer makes; each write is a random size up to
+# this, so the program sees short reads
+STREAM_MAX_CHUNK = 8192
+
+
+def _stream_trial(block_size, transport, data, rate_mb_s, workdir):
+    """
+    Feed data to pipe_cat through an anonymous pipe or a FIFO, at up to
+    rate_mb_s MB/s (0 for as fast as it will take it), and read its
+    output through another.  Returns (seconds from starting pipe_cat
+    until the last byte came out, seconds between the last byte going in and coming out, whether
+    the output was right, error message or None), or None on a timeout.
+    """
+    if transport == "pipe":
+        in_r, in_w = os.pipe()
+        out_r, out_w = os.pipe()
+        in_path, out_path = f"/dev/fd/{in_r}", f"/dev/fd/{out_w}"
+        pass_fds = (in_r, out_w)
+    else:
+        in_path, out_path = os.path.join(workdir, "in.fifo"), os.path.join(workdir, "out.fifo")
+        for path in (in_path, out_path):
+            if os.path.exists(path):
+                os.remove(path)
+            os.mkfifo(path)
+        pass_fds = ()
+
+    # stdout is not used:  some implementations print debugging output there
+    launched = time.monotonic()
+    proc = subprocess.Popen(["./pipe_cat", str(block_size), in_path, out_path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            pass_fds=pass_fds, preexec_fn=_start_test_program)
+    if transport == "pipe":
+        os.close(in_r)
+        os.close(out_w)
+
+    rng = random.Random(0)
+    times = {}
+    digest = hashlib.sha256()
+    received = 0
+
+    def _produce():
+        fd = in_w if transport == "pipe" else os.open(in_path, os.O_WRONLY)
+        times["start"] = time.monotonic()
+        try:
+            sent = 0
+            while sent < len(data):
+                n = rng.randint(1, STREAM_MAX_CHUNK)
+                sent += os.write(fd, data[sent:sent + n])
+                if rate_mb_s > 0:
+                    ahead = times["start"] + sent / (rate_mb_s * 1024 * 1024) - time.monotonic()
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except BrokenPipeError:
+            pass
+        finally:
+            times["sent"] = time.monotonic()
+            os.close(fd)
+
+    def _consume():
+        nonlocal received
+        fd = out_r if transport == "pipe" else os.open(out_path, os.O_RDONLY)
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                received += len(chunk)
+        finally:
+            times["received"] = time.monotonic()
+            os.close(fd)
+
+    threads = [threading.Thread(target=_produce), threading.Thread(target=_consume)]
+    for t in threads:
+        t.start()
+
+    timed_out = False
+    try:
+        _, stderr = proc.communicate(timeout=TIMEOUT_SEC if TIMEOUT_SEC > 0 else None)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGTERM)
+        _, stderr = proc.communicate()
+        timed_out = True
+
+    while any(t.is_alive() for t in threads):
+        if transport == "fifo":
+            # If pipe_cat never opened a FIFO, open its other end, so the
+            # thread waiting to open it can finish
+            for path, flags in ((in_path, os.O_RDONLY), (out_path, os.O_WRONLY)):
+                try:
+                    os.close(os.open(path, flags | os.O_NONBLOCK))
+                except OSError:
+                    pass
+        for t in threads:
+            t.join(timeout=0.05)
+    if transport == "fifo":
+        os.remove(in_path)
+        os.remove(out_path)
+
+    if timed_out:
+        return None
+    error = None
+    if proc.returncode != 0:
+        lines = stderr.decode("utf-8", errors="backslashreplace").strip().splitlines()
+        error = lines[0] if lines else f"exited with status {proc.returncode}"
+    correct = received == len(data) and digest.digest() == hashlib.sha256(data).digest()
+    return (times["received"] - launched, max(0.0, times["received"] - times["sent"]),
+            correct, error)
+
+
+def do_stream_run(uname: str, impl: str, prefix: str, file_size: int, rates, trials=1):
+    """
+    Copy a stream with pipe_cat, reading it from and writing it to an
+    anonymous pipe or a FIFO, with a producer writing random-sized
+    chunks at each of `rates` MB/s (0 for unlimited).  Reports the
+    throughput, how long the last byte took to come out after it went
+    in, and whether the output was right.  Implementations that need a
+    regular file fail here; their error is recorded.
+    """
+    silent_shell("make clean")
+    silent_shell('CFLAGS=-DCACHE_SIZE=4096 make -B IMPL={} pipe_cat'.format(impl), echo=True)
+
+    size_mb = file_size / (1024 * 1024)
+    data = os.urandom(file_size)
+    workdir = tempfile.mkdtemp(prefix="io300_stream_", dir=prefix)
+
+    results = []
+    try:
+        for transport in STREAM_TRANSPORTS:
+            for block_size in STREAM_BLOCK_SIZES:
+                for rate in rates:
+                    print("\nRunning stream benchmark {}:pipe_cat {}:{}:{}M at {} => ".format(
+                        impl, block_size, transport, size_mb,
+                        "{} MB/s".format(rate) if rate > 0 else "full speed"), end="")
+                    sys.stdout.flush()
+                    for t in range(0, trials):
+                        res: dict = {
+                            "trial": t,
+                            "benchmark": "pipe_cat",
+                            "impl": impl,
+                            "uname": uname,
+                            "transport": transport,
+                            "block_size": block_size,
+                            "rate_mb_s": rate,
+                            "size": file_size,
+                        }
+                        trial = _stream_trial(block_size, transport, data, rate, workdir)
+                        results.append(res)
+                        if trial is None:
+                            res["time"] = TIMEOUT_STR
+                            print("[timed out] ", end="")
+                            continue
+                        elapsed, drain, correct, error = trial
+                        res.update(time=elapsed, drain_sec=drain, correct=correct, error=error)
+                        if error is not None or not correct:
+                            print("[failed: {}]".format(error or "wrong output"), end="")
+                            break
+                        res["throughput_mb_s"] = size_mb / max(elapsed, 0.001)
+                        print("{:.3f}s ({:.1f} MB/s, last byte {:.1f}ms) ".format(
+                            elapsed, res["throughput_mb_s"], drain * 1000), end="")
+                        sys.stdout.flush()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("")
+    return results
+
+# How the fastest program on this host could make each benchmark's
+# output:  the methods of io300_roofline (see io300_roofline.c) for each
+# access pattern, and the pattern of each benchmark.  "read" only reads
+# the input, to compare with the others, so no benchmark has it.
+ROOFLINE_METHODS = {
+    "copy": ["copy_file_range", "readwrite", "mmap"],
+    "reverse": ["reverse"],
+    "stride": ["stride"],
+    "read": ["pagecache"],
+}
+ROOFLINE_PATTERNS = {
+    "byte_cat": "copy",
+    "reverse_byte_cat": "reverse",
+    "block_cat": "copy",
+    "zero_copy_block_cat": "copy",
+    "reverse_block_cat": "reverse",
+    "random_block_cat": "copy",
+    "stride_cat": "stride",
+    "batch_reverse_block_cat": "reverse",
+    "batch_stride_cat": "stride",
+}
+
+
+def roofline_method(method):
+    # stride_cat's arguments (see stride_cat above)
+    return lambda infile, outfile: \
+        f'./io300_roofline -b 1 -s 1024 {method} {infile} {outfile}'
+
+
+def do_roofline_run(prefix: str, trials=1):
+    """
+    Time each io300_roofline method on each benchmark size, keeping the
+    best trial, and work out the ceiling of each access pattern:  the
+    throughput of its fastest method.  Returns the methods' results and
+    the ceilings, keyed by (size, pattern).
+    """
+    silent_shell("make io300_roofline", echo=True)
+
+    results = []
+    ceilings = {}
+    for curr_size in [int(x * (1024 * 1024)) for x in SIZES_MB]:
+        size_mb = curr_size / (1024 * 1024)
+        for pattern, methods in ROOFLINE_METHODS.items():
+            for method in methods:
+                print("\nRunning roofline {}:{}:{}M => ".format(prefix, method, size_mb), end="")
+                times = []
+                for t in range(0, trials):
+                    runtime = _run_benchmark(prefix, roofline_method(method), curr_size)
+                    if runtime is None:
+                        print("[failed] ", end="")
+                        continue
+                    times.append(runtime["wtime"])
+                    print("{:.3f}s ".format(runtime["wtime"]), end="")
+                    sys.stdout.flush()
+                if len(times) == 0:
+                    continue
+
+                res = {
+                    "prefix": "tmpfs" if prefix == TMPFS_PREFIX else "base",
+                    "size": curr_size,
+                    "size_mb": "{}M".format(size_mb),
+                    "pattern": pattern,
+                    "method": method,
+                    "times": times,
+                    "time": min(times),
+                    "throughput_mb_s": size_mb / max(min(times), 0.001),
+                }
+                results.append(res)
+                best = ceilings.get((curr_size, pattern))
+                if best is None or res["throughput_mb_s"] > best["throughput_mb_s"]:
+                    ceilings[(curr_size, pattern)] = res
+    print("")
+    util.remove_files("io300_roofline")
+    return results, ceilings
+
+
+def apply_roofline(size_results, ceilings):
+    """
+    Add each finished trial's throughput, and that as a percentage of
+    the ceiling for its benchmark's access pattern, to do_run's results
+    """
+    for res_this_size in size_results:
+        size_mb = res_this_size["size"] / (1024 * 1024)
+        for res in res_this_size["tests"]:
+            pattern = ROOFLINE_PATTERNS.get(res["benchmark"].removesuffix("_noadvice"))
+            ceiling = ceilings.get((res_this_size["size"], pattern))
+            if ceiling is None or res["time"] is TIMEOUT_STR:
+                continue
+            res["throughput_mb_s"] = size_mb / max(res["time"], 0.001)
+            res["roofline_method"] = ceiling["method"]
+            res["pct_of_ceiling"] = 100 * res["throughput_mb_s"] / ceiling["throughput_mb_s"]
+
+
+def print_roofline_summary(fs, size_results, ceilings):
+    """Median percentage of the ceiling of each benchmark, at the largest size"""
+    size = int(SIZES_MB[-1] * 1024 * 1024)
+    rows = [r for r in size_results if r["size"] == size and r["prefix"] == fs]
+    if len(rows) == 0:
+        return
+    names = list(dict.fromkeys(t["benchmark"] for r in rows for t in r["tests"]))
+
+    print("\nPercentage of the best this host can do ({}, {}M):".format(fs, SIZES_MB[-1]))
+    for pattern in ROOFLINE_METHODS:
+        ceiling = ceilings.get((size, pattern))
+        if ceiling is not None:
+            print("  {:<8} ceiling {:>8.1f} MB/s ({})".format(
+                pattern, ceiling["throughput_mb_s"], ceiling["method"]))
+    print("{:<10}".format("impl") + "".join(" {:>12.12}".format(n) for n in names))
+    for r in rows:
+        line = "{:<10}".format(r["impl"])
+        for name in names:
+            pcts = [t["pct_of_ceiling"] for t in r["tests"]
+                    if t["benchmark"] == name and "pct_of_ceiling" in t]
+            line += " {:>11.1f}%".format(percentile(pcts, 50)) if pcts else " {:>12}".format("-")
+        print(line)
+
+
+def do_run(uname: str, impl: str, prefix: str, trials=1, compare_advice=False,
+           time_budget=0):
     global TIMEOUT_SEC
     global TMPFS_PREFIX
 
@@ -225,26 +812,36 @@ def do_run(uname: str, impl: str, prefix: str, trials=1):
         return "tmpfs" if s == TMPFS_PREFIX else "base"
 
 
+    budget = TrialBudget(time_budget) if time_budget > 0 else None
+
     silent_shell("make clean")
     silent_shell('CFLAGS=-DCACHE_SIZE=4096 make -B IMPL={}'.format(impl), echo=True)
 
     size_min = 0.5 * 1024 * 1024
     size_max = 32 * 1024 * 1024
     size_inc = lambda x: x * 2
-    sizes_mb = [0.5, 1, 4, 8, 16, 32]
-    sizes_bytes = [int(x * (1024 * 1024)) for x in sizes_mb]
+    sizes_bytes = [int(x * (1024 * 1024)) for x in SIZES_MB]
 
     benchmarks = {
         'byte_cat': byte_cat,
         'reverse_byte_cat': reverse_byte_cat,
         'block_cat': block_cat,
+        'zero_copy_block_cat': zero_copy_block_cat,
         'reverse_block_cat': reverse_block_cat,
         #'random_block_cat': random_block_cat,
         'stride_cat': stride_cat,
+        'batch_reverse_block_cat': batch_reverse_block_cat,
+        'batch_stride_cat': batch_stride_cat,
     }
+    if compare_advice:
+        for name, func in list(benchmarks.items()):
+            benchmarks[f"{name}_noadvice"] = _without_advice(func)
 
     results = []
     skip = set()
+    # Times of each (size index, benchmark) so far, and how long its last trial took
+    samples = {}
+    trial_cost = {}
 
     #curr_size = int(size_min)
     for curr_size in sizes_bytes:
@@ -267,11 +864,13 @@ def do_run(uname: str, impl: str, prefix: str, trials=1):
                 print(SKIPPED_STR)
                 continue
 
-            times_this_benchmark = []
+            times_this_benchmark = samples.setdefault((len(results), name), [])
             for t in range(0, trials):
                 signal.signal(signal.SIGINT, _signit_handler)
 
+                started = time.monotonic()
                 runtime = _run_benchmark(prefix, func, curr_size)
+                trial_cost[(len(results), name)] = time.monotonic() - started
 
                 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
@@ -284,6 +883,9 @@ def do_run(uname: str, impl: str, prefix: str, trials=1):
 
                 times_this_benchmark.append(t_run)
                 res["time"] = t_run
+                if runtime is not None:
+                    res["environment"] = runtime.get("environment")
+                    res["cgroup"] = runtime.get("cgroup")
 
                 b_results.append(res)
                 if runtime is None:
@@ -305,17 +907,78 @@ def do_run(uname: str, impl: str, prefix: str, trials=1):
         res_this_size["tests"] = b_results
         results.append(res_this_size)
 
+    if budget is not None:
+        _spend_budget(budget, prefix, benchmarks, sizes_bytes, results, samples, trial_cost,
+                      min_trials=trials)
+
     return results
 
 
+def _spend_budget(budget, prefix, benchmarks, sizes_bytes, results, samples, trial_cost,
+                  min_trials):
+    """
+    Run extra trials of the benchmarks whose times are least certain
+    (see trials.py) until the budget runs out, adding them to results
+    """
+    print("\nSpending {:.0f}s left of this run's time budget on extra trials".format(
+        budget.remaining()))
+    while True:
+        candidates = []
+        for key, times in samples.items():
+            finished = [t for t in times if t is not TIMEOUT_STR]
+            if len(finished) == 0:
+                continue
+            mean, halfwidth = mean_ci(finished)
+            candidates.append((key, priority(len(finished), mean, halfwidth,
+                                             min_trials=min_trials), trial_cost[key]))
+
+        key = budget.pick(candidates)
+        if key is None:
+            break
+        size_index, name = key
+        print("\nRunning extra trial {}:{}M => ".format(name, sizes_bytes[size_index] / (1024 * 1024)),
+              end="")
+
+        started = time.monotonic()
+        runtime = _run_benchmark(prefix, benchmarks[name], sizes_bytes[size_index])
+        trial_cost[key] = time.monotonic() - started
+
+        t_run = runtime["wtime"] if runtime is not None else TIMEOUT_STR
+        res: dict = {
+            "trial": len(samples[key]),
+            "benchmark": name,
+            "time": t_run,
+        }
+        if runtime is not None:
+            res["environment"] = runtime.get("environment")
+            res["cgroup"] = runtime.get("cgroup")
+            print("{:.3f}s".format(t_run), end="")
+        else:
+            print("[timed out]", end="")
+        sys.stdout.flush()
+        samples[key].append(t_run)
+        results[size_index]["tests"].append(res)
+    print("")
+
+
 IMPLS = [
     "stdio",
-    "naive"
+    "naive",
+    # Serves everything from a mapping of the file, so it makes no
+    # read/write/lseek calls:  an upper bound for the cached versions
+    "mmap",
+    "lru",
+    "adaptive",
+    "async",
+    "uring",
+    "direct",
 ]
 
 
 TMPFS_PREFIX = "/tmp/io300_benchmark"
 
+SIZES_MB = [0.5, 1, 4, 8, 16, 32]
+
 PREFIXES = [
     "/tmp",
     TMPFS_PREFIX,
@@ -346,12 +1009,47 @@ def _do_setup_tmpfs():
 DEFAULT_TRIALS = 3
 def main(input_args):
     global TIMEOUT_SEC
+    global PINNED_CPUS
+    global CGROUPS
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--timeout", type=int, default=TIMEOUT_SEC)
     parser.add_argument("--trials", type=int, default=DEFAULT_TRIALS)
     parser.add_argument("--output-file", default="benchmark.json")
     parser.add_argument("--key", type=str, default=None)
+    parser.add_argument("--large-file-size", type=str, default=None,
+                        help="Also copy a file of this size (e.g. 4G) with each implementation "
+                        "and report throughput and page cache growth")
+    parser.add_argument("--large-file-dir", type=str, default=PREFIXES[0],
+                        help="Directory for the large-file benchmark; it must not be on tmpfs "
+                        "(default: %(default)s)")
+    parser.add_argument("--concurrency-file-size", type=str, default=None,
+                        help="Also run 1 up to --max-copies copies of the benchmarks at once, "
+                        "on files of this size, and report how throughput scales")
+    parser.add_argument("--max-copies", type=int, default=len(os.sched_getaffinity(0)),
+                        help="Most copies to run at once in the concurrency benchmark "
+                        "(default: the number of CPUs)")
+    parser.add_argument("--stream-size", type=str, default=None,
+                        help="Also copy a stream of this size through pipes and FIFOs with pipe_cat")
+    parser.add_argument("--stream-rate", type=float, action="append",
+                        help="MB/s the stream is produced at; 0 for as fast as it is read "
+                        "(repeat for several; default: 0 and 16)")
+    parser.add_argument("--compare-advice", action="store_true",
+                        help="Also run every benchmark with the programs' io300_advise hints turned off")
+    parser.add_argument("--time-budget", type=float, default=0,
+                        help="Seconds to spend on the benchmarks (split evenly between the runs); "
+                        "time left after --trials trials goes to the least certain results")
+    parser.add_argument("--no-stabilize", action="store_true",
+                        help="Don't pin the test programs to a core or rerun noisy trials")
+    parser.add_argument("--no-cgroups", action="store_true",
+                        help="Don't run the test programs in cgroups of their own")
+    parser.add_argument("--memory-max", type=str, default=defaults.PERFORMANCE_MEMORY_MAX,
+                        help="Kill a test program that uses more memory than this (e.g. 1G)")
+    parser.add_argument("--pids-max", type=int, default=defaults.PERFORMANCE_PIDS_MAX,
+                        help="Most processes and threads a test program may have")
+    parser.add_argument("--roofline", action="store_true",
+                        help="Also time the fastest way this host can make each benchmark's "
+                        "output (io300_roofline), and report each result as a percentage of it")
 
     args = parser.parse_args(input_args)
 
@@ -380,16 +1078,103 @@ def main(input_args):
     if key:
         json_out["key"] = key
 
-    results = []
-    for prefix in PREFIXES:
-        for impl in IMPLS:
-            if prefix == TMPFS_PREFIX and (not tmpfs_ok):
-                continue
+    if defaults.PERFORMANCE_STABILIZE and not args.no_stabilize:
+        PINNED_CPUS = benchenv.choose_core()
+        json_out["environment"] = benchenv.preflight(PINNED_CPUS)
+        print("Running test programs on CPU {}".format(",".join(str(c) for c in PINNED_CPUS)))
+        for warning in json_out["environment"]["warnings"]:
+            print("{}WARNING:  {}{}".format(WARNING, warning, ENDC))
+
+    if defaults.PERFORMANCE_CGROUPS and not args.no_cgroups:
+        try:
+            CGROUPS = cgroup.setup(memory_max=cgroup.parse_limit(args.memory_max),
+                                   pids_max=args.pids_max)
+        except ValueError as e:
+            print("{}WARNING:  {}, running without limits{}".format(WARNING, e, ENDC))
+            CGROUPS = cgroup.setup()
+        if CGROUPS is not None:
+            print("Accounting for each test program in {} ({})".format(
+                CGROUPS.path, ", ".join(sorted(CGROUPS.controllers)) or "cpu.stat only"))
+            json_out["cgroup"] = {
+                "controllers": sorted(CGROUPS.controllers),
+                "memory_max": CGROUPS.memory_max,
+                "pids_max": CGROUPS.pids_max,
+            }
+
+    prefixes = [prefix for prefix in PREFIXES if prefix != TMPFS_PREFIX or tmpfs_ok]
+
+    # Measured before the implementations, as building them cleans it up
+    ceilings = {}
+    if args.roofline:
+        roofline_results = []
+        for prefix in prefixes:
+            prefix_results, prefix_ceilings = do_roofline_run(prefix, trials=args.trials)
+            roofline_results.extend(prefix_results)
+            ceilings[prefix] = prefix_ceilings
+        json_out["roofline"] = roofline_results
 
-            impl_results = do_run(uname, impl, prefix, trials=args.trials)
-            results.extend(impl_results)
+    results = []
+    runs = [(prefix, impl) for prefix in prefixes for impl in IMPLS]
+    budget = TrialBudget(args.time_budget) if args.time_budget > 0 else None
+    for (i, (prefix, impl)) in enumerate(runs):
+        # Each run gets an equal share of what is left
+        run_budget = budget.remaining() / (len(runs) - i) if budget is not None else 0
+
+        impl_results = do_run(uname, impl, prefix, trials=args.trials,
+                              compare_advice=args.compare_advice,
+                              time_budget=run_budget)
+        if args.roofline:
+            apply_roofline(impl_results, ceilings[prefix])
+        results.extend(impl_results)
 
     json_out["results"] = results
+    if args.roofline:
+        for prefix in prefixes:
+            print_roofline_summary("tmpfs" if prefix == TMPFS_PREFIX else "base",
+                                   results, ceilings[prefix])
+
+    if args.large_file_size is not None and util.path_is_on_tmpfs(args.large_file_dir):
+        # tmpfs lives in the page cache, so what the programs add to it
+        # says nothing there
+        print("{}WARNING:  {} is on tmpfs, skipping the large-file benchmark "
+              "(choose another directory with --large-file-dir){}".format(
+                  WARNING, args.large_file_dir, ENDC))
+        json_out["large_file"] = []
+    elif args.large_file_size is not None:
+        large_size = parse_size(args.large_file_size)
+        o_direct = supports_o_direct(args.large_file_dir)
+        if not o_direct and "direct" in IMPLS:
+            print("{}WARNING:  {} does not support O_DIRECT, so IMPL=direct will go "
+                  "through the page cache too{}".format(WARNING, args.large_file_dir, ENDC))
+        large_results = []
+        for impl in IMPLS:
+            large_results.extend(do_large_file_run(uname, impl, args.large_file_dir,
+                                                   large_size, trials=args.trials,
+                                                   o_direct=o_direct))
+        json_out["large_file"] = large_results
+        json_out["large_file_dir"] = args.large_file_dir
+
+    if args.concurrency_file_size is not None:
+        concurrency_size = parse_size(args.concurrency_file_size)
+        concurrency_results = []
+        for impl in IMPLS:
+            concurrency_results.extend(do_concurrency_run(uname, impl, PREFIXES[0],
+                                                          concurrency_size, args.max_copies,
+                                                          trials=args.trials))
+        json_out["concurrency"] = concurrency_results
+
+    if args.stream_size is not None:
+        stream_size = parse_size(args.stream_size)
+        stream_results = []
+        for impl in IMPLS:
+            stream_results.extend(do_stream_run(uname, impl, PREFIXES[0], stream_size,
+                                                args.stream_rate or [0, 16],
+                                                trials=args.trials))
+        json_out["stream"] = stream_results
+
+    if CGROUPS is not None:
+        CGROUPS.close()
+        CGROUPS = None
 
     output_file = args.output_file if args.output_file is not None else \
         "{}.json".format(key)
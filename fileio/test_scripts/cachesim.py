@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+#
+# Predict how a cache design would do on a recorded access trace, before
+# writing it in C.
+# Usage:
+#    test_scripts/cachesim.py record <trace> -- ./byte_cat in out
+#    test_scripts/cachesim.py simulate <trace> [--cache-size 4096 ...]
+#
+# `record` runs a test program under io300_trace.so (see io300_trace.c).
+# Build the test programs with IMPL=naive first:  naive makes exactly one
+# system call per io300 call, so the calls it makes are the accesses any
+# other implementation would see.  A trace can also be taken with strace:
+#    strace -o trace.txt -e trace=openat,close,read,write,lseek,pread64,pwrite64 \
+#        ./byte_cat in out
+#
+# `simulate` replays the trace against each policy for each CACHE_SIZE and
+# prints the predicted hit rate and system calls.  The model is simple:
+# the cache holds CACHE_SIZE-aligned blocks, every miss loads its block
+# (even for a write) with one read call, and dirty blocks are written
+# back with one write call each (or every write is passed straight
+# through, with --write-through).  Seeks are not counted, as if every
+# call were a pread or pwrite.
+#
+# Traces are decoded and split into blocks in NumPy batches; only
+# the runs of accesses to different blocks are replayed one at a time.
+#
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+try:
+    import numpy as np
+except ImportError:
+    print("cachesim.py needs NumPy:  pip install numpy", file=sys.stderr)
+    sys.exit(1)
+
+import util
+
+# Layout of struct access_record in io300_trace.c
+RECORD_MAGIC = b"IO300TR1"
+RECORD_DTYPE = np.dtype([("offset", "<i8"), ("length", "<u4"), ("fd", "<u2"),
+                         ("op", "u1"), ("pad", "u1")])
+OP_READ = 0
+OP_WRITE = 1
+
+RECORD_ENV = "IO300_TRACE_RECORD"
+
+# Records decoded at a time
+BATCH_SIZE = 1 << 20
+
+DEFAULT_CACHE_SIZES = [512, 4096, 32768]
+# Defaults of impl/lru.c and impl/adaptive.c
+DEFAULT_SLOTS = 256
+DEFAULT_READAHEAD = 8
+
+
+def _read_records(path):
+    with open(path, "rb") as f:
+        f.seek(len(RECORD_MAGIC))
+        while True:
+            batch = np.fromfile(f, dtype=RECORD_DTYPE, count=BATCH_SIZE)
+            if len(batch) == 0:
+                break
+            yield batch
+
+
+def _read_strace(path):
+    """Turn the calls in an strace log into records, keeping file offsets"""
+    positions = {}
+    batch = []
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            m = util.STRACE_CALL.match(line)
+            if m is None:
+                continue
+            call, args, ret = m.group(1), util.strace_args(m.group(2)), int(m.group(3))
+            if call in ("open", "openat", "creat"):
+                path_arg = re.search(r'"((?:[^"\\]|\\.)*)"', m.group(2))
+                if ret >= 0 and not (path_arg and util.STRACE_SKIP_PATH.search(path_arg.group(1))):
+                    positions[ret] = 0
+                continue
+            if ret < 0 or not args[0].isdigit() or int(args[0]) not in positions:
+                continue
+            fd = int(args[0])
+            if call == "close":
+                del positions[fd]
+            elif call == "lseek":
+                positions[fd] = ret
+            elif call in ("read", "write") and ret > 0:
+                batch.append((positions[fd], ret, fd, OP_READ if call == "read" else OP_WRITE, 0))
+                positions[fd] += ret
+            elif call in ("pread64", "pwrite64", "preadv", "pwritev") and ret > 0:
+                op = OP_READ if call.startswith("pread") else OP_WRITE
+                batch.append((int(args[-1]), ret, fd, op, 0))
+            if len(batch) == BATCH_SIZE:
+                yield np.array(batch, dtype=RECORD_DTYPE)
+                batch = []
+    if batch:
+        yield np.array(batch, dtype=RECORD_DTYPE)
+
+
+def read_trace(path):
+    """Yield the accesses in a recorded or strace trace, in batches"""
+    with open(path, "rb") as f:
+        is_recorded = f.read(len(RECORD_MAGIC)) == RECORD_MAGIC
+    return _read_records(path) if is_recorded else _read_strace(path)
+
+
+def block_runs(batch, cache_size):
+    """
+    Split a batch of accesses into the blocks they touch, and merge
+    consecutive accesses to the same block of a file.  Every file has
+    a cache of its own, so the accesses are grouped by file first.
+    Returns lists of the fd, block, number of accesses and whether any
+    was a write, per run.
+    """
+    batch = batch[np.argsort(batch["fd"], kind="stable")]
+    first = batch["offset"] // cache_size
+    last = (batch["offset"] + batch["length"].astype(np.int64) - 1) // cache_size
+    nblocks = last - first + 1
+
+    # One entry per (access, block) pair
+    access = np.repeat(np.arange(len(batch)), nblocks)
+    starts = np.cumsum(nblocks) - nblocks
+    block = first[access] + (np.arange(len(access)) - starts[access])
+    fd = batch["fd"][access]
+    is_write = batch["op"][access] == OP_WRITE
+
+    new_run = np.ones(len(block), dtype=bool)
+    new_run[1:] = (block[1:] != block[:-1]) | (fd[1:] != fd[:-1])
+    run_starts = np.flatnonzero(new_run)
+    counts = np.diff(np.append(run_starts, len(block)))
+    writes = np.add.reduceat(is_write.astype(np.int64), run_starts)
+    return (fd[run_starts].tolist(), block[run_starts].tolist(),
+            counts.tolist(), (writes > 0).tolist())
+
+
+@dataclass
+class SimResult:
+    policy: str
+    cache_size: int
+    accesses: int = 0
+    hits: int = 0
+    misses: int = 0
+    read_calls: int = 0
+    write_calls: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.accesses if self.accesses else 0.0
+
+
+class Policy:
+    """
+    The cache of one file, holding `slots` blocks.  Subclasses decide
+    which block to evict (_touch, _insert) and which blocks a miss
+    loads (_fetch).
+    """
+    name = None
+
+    def __init__(self, cache_size, slots, write_back=True):
+        self.cache_size = cache_size
+        self.slots = slots
+        self.write_back = write_back
+        self.dirty = set()
+        self.result = SimResult(self.label(), cache_size)
+
+    def label(self):
+        return "{}({})".format(self.name, self.slots)
+
+    def _touch(self, key):
+        """Note an access to `key`; return whether it is cached"""
+        raise NotImplementedError
+
+    def _insert(self, key):
+        """Add `key`; return the key evicted to make room, or None"""
+        raise NotImplementedError
+
+    def _fetch(self, block):
+        """Blocks (a contiguous range) loaded by a miss on `block`"""
+        return [block]
+
+    def access(self, block, count, write):
+        r = self.result
+        r.accesses += count
+        if self._touch(block):
+            r.hits += count
+        else:
+            r.hits += count - 1
+            r.misses += 1
+            blocks = self._fetch(block)
+            r.read_calls += 1
+            r.bytes_read += len(blocks) * self.cache_size
+            for b in blocks:
+                if b != block and self._touch(b):
+                    continue
+                self._evicted(self._insert(b))
+            self._touch(block)
+        if write and self.write_back:
+            self.dirty.add(block)
+
+    def _evicted(self, key):
+        if key in self.dirty:
+            self.dirty.remove(key)
+            self.result.write_calls += 1
+            self.result.bytes_written += self.cache_size
+
+    def finish(self):
+        """Write back whatever is still dirty, as closing the files would"""
+        for key in list(self.dirty):
+            self._evicted(key)
+        return self.result
+
+
+class LRU(Policy):
+    name = "lru"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blocks = OrderedDict()
+
+    def _touch(self, key):
+        if key in self.blocks:
+            self.blocks.move_to_end(key)
+            return True
+        return False
+
+    def _insert(self, key):
+        evicted = None
+        if len(self.blocks) >= self.slots:
+            evicted, _ = self.blocks.popitem(last=False)
+        self.blocks[key] = True
+        return evicted
+
+
+class SingleBuffer(LRU):
+    """One block of cache, as in the handout's design"""
+    name = "single"
+
+    def __init__(self, cache_size, slots, write_back=True):
+        super().__init__(cache_size, 1, write_back)
+
+    def label(self):
+        return self.name
+
+
+class Clock(Policy):
+    """Second chance:  a hand sweeps the slots, sparing recently used blocks"""
+    name = "clock"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.keys = []
+        self.referenced = []
+        self.index = {}
+        self.hand = 0
+
+    def _touch(self, key):
+        i = self.index.get(key)
+        if i is None:
+            return False
+        self.referenced[i] = True
+        return True
+
+    def _insert(self, key):
+        if len(self.keys) < self.slots:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.referenced.append(False)
+            return None
+        while self.referenced[self.hand]:
+            self.referenced[self.hand] = False
+            self.hand = (self.hand + 1) % self.slots
+        evicted = self.keys[self.hand]
+        del self.index[evicted]
+        self.keys[self.hand] = key
+        self.referenced[self.hand] = False
+        self.index[key] = self.hand
+        self.hand = (self.hand + 1) % self.slots
+        return evicted
+
+
+class Prefetch(LRU):
+    """
+    LRU that, when a miss is next to the previous one on the same file,
+    loads `readahead` blocks in the direction the file is being read
+    (even past its end:  the trace does not say where that is)
+    """
+    name = "prefetch"
+
+    def __init__(self, cache_size, slots, write_back=True, readahead=DEFAULT_READAHEAD):
+        self.readahead = max(1, min(readahead, slots))
+        super().__init__(cache_size, slots, write_back)
+        self.last_miss = None
+
+    def label(self):
+        return "{}({}x{})".format(self.name, self.slots, self.readahead)
+
+    def _fetch(self, block):
+        last = self.last_miss
+        self.last_miss = block
+        if last is not None and block > last and block - last <= self.readahead:
+            return list(range(block, block + self.readahead))
+        if last is not None and block < last and last - block <= self.readahead:
+            return list(range(max(0, block - self.readahead + 1), block + 1))
+        return [block]
+
+
+class PerFile:
+    """A policy's caches for all the files in a trace"""
+    def __init__(self, make_cache):
+        self.make_cache = make_cache
+        self.caches = {}
+
+    def access(self, fd, block, count, write):
+        cache = self.caches.get(fd)
+        if cache is None:
+            cache = self.caches[fd] = self.make_cache()
+        cache.access(block, count, write)
+
+    def finish(self, result):
+        for cache in self.caches.values():
+            r = cache.finish()
+            for key in ["accesses", "hits", "misses", "read_calls", "write_calls",
+                        "bytes_read", "bytes_written"]:
+                setattr(result, key, getattr(result, key) + getattr(r, key))
+        return result
+
+
+POLICIES = {
+    "single": SingleBuffer,
+    "lru": LRU,
+    "clock": Clock,
+    "prefetch": Prefetch,
+}
+
+
+def simulate(trace_path, cache_sizes, policy_names, slots=DEFAULT_SLOTS,
+             readahead=DEFAULT_READAHEAD, write_back=True):
+    """Replay the trace against each policy and cache size; returns SimResults"""
+    results = []
+    for cache_size in cache_sizes:
+        policies = []
+        for name in policy_names:
+            kwargs = {"readahead": readahead} if name == "prefetch" else {}
+            make_cache = lambda cls=POLICIES[name], kw=kwargs: \
+                cls(cache_size, slots, write_back, **kw)
+            policies.append((make_cache().label(), PerFile(make_cache)))
+
+        write_through_calls = 0
+        write_through_bytes = 0
+        for batch in read_trace(trace_path):
+            if not write_back:
+                writes = batch["op"] == OP_WRITE
+                write_through_calls += int(np.count_nonzero(writes))
+                write_through_bytes += int(batch["length"][writes].sum())
+            runs = block_runs(batch, cache_size)
+            for _, policy in policies:
+                access = policy.access
+                for fd, block, count, write in zip(*runs):
+                    access(fd, block, count, write)
+
+        for label, policy in policies:
+            result = policy.finish(SimResult(label, cache_size))
+            result.write_calls += write_through_calls
+            result.bytes_written += write_through_bytes
+            results.append(result)
+    return results
+
+
+def print_results(results):
+    header = "{:>10}  {:<18} {:>12} {:>8} {:>12} {:>12} {:>10} {:>10}".format(
+        "CACHE_SIZE", "policy", "accesses", "hits", "read calls", "write calls",
+        "read", "written")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print("{:>10}  {:<18} {:>12} {:>7.2%} {:>12} {:>12} {:>10} {:>10}".format(
+            r.cache_size, r.policy, r.accesses, r.hit_rate, r.read_calls, r.write_calls,
+            util._fmt_bytes(r.bytes_read), util._fmt_bytes(r.bytes_written)))
+
+
+def record(trace_path, program):
+    """Run the test program under io300_trace.so, recording its accesses"""
+    subprocess.run(["make", "io300_trace.so"], check=True, stdout=subprocess.DEVNULL)
+    env = util.trace_env(os.devnull)
+    env[RECORD_ENV] = os.path.abspath(trace_path)
+    return subprocess.run(program, env=env).returncode
+
+
+def main(input_args):
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Record the accesses a test program makes")
+    rec.add_argument("trace")
+    rec.add_argument("program", nargs=argparse.REMAINDER,
+                     help="Test program and its arguments (after --)")
+
+    sim = sub.add_parser("simulate", help="Replay a trace against cache policies")
+    sim.add_argument("trace", help="Recorded trace, or strace output")
+    sim.add_argument("--cache-size", type=int, action="append",
+                     help="Block size to simulate (repeat for several; default: {})".format(
+                         ", ".join(str(s) for s in DEFAULT_CACHE_SIZES)))
+    sim.add_argument("--policy", choices=list(POLICIES), action="append",
+                     help="Policy to simulate (repeat for several; default: all)")
+    sim.add_argument("--slots", type=int, default=DEFAULT_SLOTS,
+                     help="Blocks the cache holds (except for `single`)")
+    sim.add_argument("--readahead", type=int, default=DEFAULT_READAHEAD,
+                     help="Blocks the prefetch policy loads per miss")
+    sim.add_argument("--write-through", action="store_true",
+                     help="Pass every write straight to the file instead of writing back")
+    sim.add_argument("--json", type=str, default=None,
+                     help="Also write the results to this file")
+
+    args = parser.parse_args(input_args)
+
+    if args.command == "record":
+        program = args.program[1:] if args.program[:1] == ["--"] else args.program
+        if not program:
+            parser.error("record needs a program to run")
+        return record(args.trace, program)
+
+    results = simulate(args.trace,
+                       cache_sizes=args.cache_size or DEFAULT_CACHE_SIZES,
+                       policy_names=args.policy or list(POLICIES),
+                       slots=args.slots,
+                       readahead=args.readahead,
+                       write_back=(not args.write_through))
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([{**asdict(r), "hit_rate": r.hit_rate} for r in results], f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,234 @@
+# cgroup.py - Account for (and limit) what each timed trial uses, with cgroup v2
+#
+# Timing a test program says nothing about what else it used.  Where a
+# cgroup v2 hierarchy is mounted and this process may make groups in
+# it, each timed trial runs in a transient group of its own, so the
+# kernel charges everything the program does to that group:  its peak
+# memory (including the page cache it fills), its block I/O and its CPU
+# time.  The group can also set memory.max and pids.max, so that a
+# runaway implementation is killed instead of taking the machine down.
+#
+# The memory, io and pids controllers are only there if they are
+# enabled for this process's group (cgroup.subtree_control), which the
+# kernel only allows for a group with no processes of its own:  the
+# root of a container, say, or a group delegated to the tests.  cpu.stat
+# is always there.  What a machine does not have is recorded as None,
+# as in benchenv.py, and without a writable cgroup v2 hierarchy setup()
+# returns None and the trials run as before.
+
+import os
+import time
+import signal
+
+CONTROLLERS = ["cpu", "io", "memory", "pids"]
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _flat_keyed(text):
+    """Fields of a "key value" file (cpu.stat, memory.stat, ...), or {}"""
+    fields = {}
+    for line in (text or "").splitlines():
+        key, value = line.split()
+        fields[key] = int(value)
+    return fields
+
+
+def _io_totals(text):
+    """io.stat's "rbytes=... wbytes=..." fields, summed over devices"""
+    totals = {}
+    for line in (text or "").splitlines():
+        for field in line.split()[1:]:
+            key, value = field.split("=")
+            totals[key] = totals.get(key, 0) + int(value)
+    return totals
+
+
+def own_group():
+    """Directory of this process's group in the cgroup v2 hierarchy, or None"""
+    mount = None
+    for line in (_read("/proc/self/mountinfo") or "").splitlines():
+        fields, _, fs = line.partition(" - ")
+        if fs.split()[0] == "cgroup2":
+            mount = fields.split()[4]
+            break
+    if mount is None:
+        return None
+    for line in (_read("/proc/self/cgroup") or "").splitlines():
+        if line.startswith("0::"):
+            return os.path.join(mount, line[3:].lstrip("/"))
+    return None
+
+
+def parse_limit(text):
+    """A memory size like "512M" or "2G" in bytes (None stays None)"""
+    if text is None:
+        return None
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+
+class TrialGroups:
+    """
+    Makes a group for each trial under one group for this run.  start()
+    makes the next trial's group (with the limits), enter() moves the
+    calling process into it (for use in preexec_fn) and stop() returns
+    what was charged to it and removes it.
+    """
+    def __init__(self, path, controllers, memory_max=None, pids_max=None):
+        self.path = path
+        self.controllers = controllers
+        self.memory_max = memory_max
+        self.pids_max = pids_max
+        self.trials = 0
+        self.current = None
+
+    def start(self):
+        self.trials += 1
+        self.current = os.path.join(self.path, f"trial{self.trials}")
+        os.mkdir(self.current)
+        if self.memory_max is not None:
+            _write(os.path.join(self.current, "memory.max"), str(self.memory_max))
+            # Otherwise going over the limit only pushes pages out to swap
+            if os.path.exists(os.path.join(self.current, "memory.swap.max")):
+                _write(os.path.join(self.current, "memory.swap.max"), "0")
+        if self.pids_max is not None:
+            _write(os.path.join(self.current, "pids.max"), str(self.pids_max))
+
+    def enter(self):
+        if self.current is not None:
+            _write(os.path.join(self.current, "cgroup.procs"), "0")
+
+    def _file(self, name):
+        return _read(os.path.join(self.current, name))
+
+    def _int(self, name):
+        text = self._file(name)
+        return int(text) if text is not None and text != "max" else None
+
+    def stop(self):
+        """What the trial's group used; None fields were not accounted"""
+        if self.current is None:
+            return None
+        cpu = _flat_keyed(self._file("cpu.stat"))
+        memory_stat = _flat_keyed(self._file("memory.stat"))
+        memory_events = _flat_keyed(self._file("memory.events"))
+        pids_events = _flat_keyed(self._file("pids.events"))
+        # io.stat has no line for a group that did no block I/O
+        io = _io_totals(self._file("io.stat"))
+        io_total = lambda key: io.get(key, 0) if "io" in self.controllers else None
+        usage = {
+            "cpu_usec": cpu.get("usage_usec"),
+            "cpu_user_usec": cpu.get("user_usec"),
+            "cpu_system_usec": cpu.get("system_usec"),
+            "memory_peak_bytes": self._int("memory.peak"),
+            "page_cache_bytes": memory_stat.get("file"),
+            "oom_kills": memory_events.get("oom_kill"),
+            "io_read_bytes": io_total("rbytes"),
+            "io_write_bytes": io_total("wbytes"),
+            "io_read_ops": io_total("rios"),
+            "io_write_ops": io_total("wios"),
+            "pids_peak": self._int("pids.peak"),
+            "pids_max_hits": pids_events.get("max"),
+        }
+        self._remove(self.current)
+        self.current = None
+        return usage
+
+    def _remove(self, group):
+        # Anything the trial left running (after a timeout, say) has to
+        # go before the group can
+        events = _flat_keyed(_read(os.path.join(group, "cgroup.events")))
+        if events.get("populated"):
+            if os.path.exists(os.path.join(group, "cgroup.kill")):
+                _write(os.path.join(group, "cgroup.kill"), "1")
+            else:
+                for pid in (_read(os.path.join(group, "cgroup.procs")) or "").split():
+                    try:
+                        os.kill(int(pid), signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+        for _ in range(100):
+            try:
+                os.rmdir(group)
+                return
+            except OSError:
+                time.sleep(0.01)
+
+    def close(self):
+        if self.current is not None:
+            self._remove(self.current)
+        self._remove(self.path)
+
+
+def setup(memory_max=None, pids_max=None):
+    """
+    TrialGroups under this process's group, or None if there is no
+    cgroup v2 hierarchy it can write to.  Raises ValueError if a limit
+    was asked for but its controller is not available.
+    """
+    own = own_group()
+    if own is None or not os.access(own, os.W_OK):
+        return None
+
+    available = (_read(os.path.join(own, "cgroup.controllers")) or "").split()
+    enabled = set((_read(os.path.join(own, "cgroup.subtree_control")) or "").split())
+    for controller in CONTROLLERS:
+        if controller in available and controller not in enabled:
+            try:
+                _write(os.path.join(own, "cgroup.subtree_control"), "+" + controller)
+                enabled.add(controller)
+            except OSError:
+                # EBUSY:  the group has processes of its own
+                pass
+
+    path = os.path.join(own, f"io300-{os.getpid()}")
+    try:
+        os.mkdir(path)
+    except OSError:
+        return None
+    # Pass the controllers on down to the trials' groups
+    for controller in CONTROLLERS:
+        if controller in enabled:
+            try:
+                _write(os.path.join(path, "cgroup.subtree_control"), "+" + controller)
+            except OSError:
+                enabled.discard(controller)
+
+    groups = TrialGroups(path, enabled, memory_max=memory_max, pids_max=pids_max)
+    for controller, limit in [("memory", memory_max), ("pids", pids_max)]:
+        if limit is not None and controller not in enabled:
+            groups.close()
+            raise ValueError(f"cannot set {controller}.max:  the {controller} controller "
+                             f"is not enabled for {own}")
+    return groups
+
+
+def format_usage(usage):
+    """One line summing up what stop() returned"""
+    if usage is None:
+        return "no cgroup accounting"
+    parts = []
+    if usage["cpu_usec"] is not None:
+        parts.append("cpu {:.3f}s".format(usage["cpu_usec"] / 1e6))
+    if usage["memory_peak_bytes"] is not None:
+        parts.append("peak memory {:.1f} MiB".format(usage["memory_peak_bytes"] / (1 << 20)))
+    if usage["page_cache_bytes"] is not None:
+        parts.append("page cache {:.1f} MiB".format(usage["page_cache_bytes"] / (1 << 20)))
+    if usage["io_read_bytes"] is not None:
+        parts.append("block I/O {:.1f} MiB read, {:.1f} MiB written".format(
+            usage["io_read_bytes"] / (1 << 20), usage["io_write_bytes"] / (1 << 20)))
+    return ", ".join(parts) or "no cgroup accounting"
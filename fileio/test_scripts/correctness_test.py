@@ -3,7 +3,10 @@
 import os
 import sys
 import json
+import math
 import random
+import shutil
+import filecmp
 import pathlib
 import argparse
 import subprocess
@@ -36,6 +39,9 @@ IMPLS_SEEN = set()
 import util
 import defaults
 
+# io300 statistics reported by the test programs while runtests() runs
+STATS = util.StatsCollector()
+
 ######################################################################
 #########          Test definitions                          #########
 ######################################################################
@@ -54,6 +60,14 @@ class TestSpec:
     def check(self, infile, outfile, outfile2) -> bool:
         return files_same(infile, outfile) # Default implementation
 
+    def prepare(self, infile, outfile):
+        """Set up whatever else the test program reads, once infile is written"""
+        pass
+
+    def cleanup(self, infile, outfile):
+        """Remove whatever prepare() and the test program created"""
+        pass
+
     def run_and_check(self, infile, outfile, outfile2) -> bool:
         return self.run(infile, outfile, outfile2) \
             and self.check(infile, outfile, outfile2)
@@ -100,6 +114,74 @@ class TestBlockCat(TestSpec):
     def check(self, infile, outfile, outfile2):
         return files_same(infile, outfile)
 
+@dataclass
+class TestZeroCopyBlockCat(TestBlockCat):
+    def bin_path(self):
+        return './zero_copy_block_cat'
+
+    def run_cmd(self, infile, outfile, outfile2):
+        return f'./zero_copy_block_cat {self.block_size} {infile} {outfile}'
+
+@dataclass
+class TestTreeCat(TestSpec):
+    """
+    Copies a directory tree of small files.  prepare() splits infile
+    into files of 1 to 64 KiB (log-uniformly distributed, so most are
+    small), 16 to a directory; the tree is copied to outfile + ".d".
+    """
+    block_size: int
+    min_file_size: int = 1024
+    max_file_size: int = 64 * 1024
+    files_per_dir: int = 16
+
+    def bin_path(self):
+        return './tree_cat'
+
+    def run_cmd(self, infile, outfile, outfile2):
+        return f'./tree_cat {self.block_size} {infile}.d {outfile}.d'
+
+    def prepare(self, infile, outfile):
+        self.cleanup(infile, outfile)
+        rng = random.Random(0)
+        log_min, log_max = math.log(self.min_file_size), math.log(self.max_file_size)
+        self.num_files = 0
+        with open(infile, "rb") as f:
+            while True:
+                data = f.read(int(math.exp(rng.uniform(log_min, log_max))))
+                if not data:
+                    break
+                i = self.num_files
+                d = pathlib.Path(f"{infile}.d/{i // (self.files_per_dir ** 2)}/{i // self.files_per_dir}")
+                d.mkdir(parents=True, exist_ok=True)
+                (d / f"f{i}").write_bytes(data)
+                self.num_files += 1
+
+    def cleanup(self, infile, outfile):
+        shutil.rmtree(f"{infile}.d", ignore_errors=True)
+        shutil.rmtree(f"{outfile}.d", ignore_errors=True)
+
+    def run_and_check(self, infile, outfile, outfile2):
+        self.prepare(infile, outfile)
+        try:
+            return super().run_and_check(infile, outfile, outfile2)
+        finally:
+            self.cleanup(infile, outfile)
+
+    def check(self, infile, outfile, outfile2):
+        def _files(root):
+            return sorted(str(p.relative_to(root)) for p in pathlib.Path(root).rglob("*")
+                          if p.is_file())
+        expected, actual = _files(f"{infile}.d"), _files(f"{outfile}.d")
+        if expected != actual:
+            print_test_result(1, "Copied {} files, expected {} (first missing: {})".format(
+                len(actual), len(expected), next((p for p in expected if p not in actual), None)))
+            return False
+        for p in expected:
+            if not filecmp.cmp(f"{infile}.d/{p}", f"{outfile}.d/{p}", shallow=False):
+                print_test_result(1, f"{outfile}.d/{p} differs from {infile}.d/{p}")
+                return False
+        return True
+
 @dataclass
 class TestReverseBlockCat(TestSpec):
     block_size: int
@@ -140,6 +222,22 @@ class TestStrideCat(TestSpec):
 
         return check_reference(_check, infile, outfile, outfile2)
 
+@dataclass
+class TestBatchReverseBlockCat(TestReverseBlockCat):
+    def bin_path(self):
+        return './batch_reverse_block_cat'
+
+    def run_cmd(self, infile, outfile, outfile2):
+        return f'./batch_reverse_block_cat {self.block_size} {infile} {outfile}'
+
+@dataclass
+class TestBatchStrideCat(TestStrideCat):
+    def bin_path(self):
+        return './batch_stride_cat'
+
+    def run_cmd(self, infile, outfile, outfile2):
+        return f'./batch_stride_cat {self.block_size} {self.stride} {infile} {outfile}'
+
 @dataclass
 class FuzzTest(TestSpec):
     functions: str
@@ -170,15 +268,22 @@ class TestRot13(TestSpec):
     def bin_path(self):
         return './rot13'
 
+    def run_cmd(self, infile, outfile, outfile2):
+        return f'./rot13 {outfile}'
+
+    # rot13 works in place on a copy of infile
+    def prepare(self, infile, outfile):
+        shutil.copyfile(infile, outfile)
+
     def run(self, infile, outfile, outfile2):
-        assert shell_return(f'cp {infile} {outfile}') == 0
-        rotate1 = shell_return(f'./rot13 {outfile}') == 0
+        self.prepare(infile, outfile)
+        rotate1 = shell_return(self.run_cmd(infile, outfile, outfile2)) == 0
         if not rotate1:
             return False
         return rotate1
 
     def check(self, infile, outfile, outfile2):
-        shell_return(f'cp {infile} {outfile2}')
+        shutil.copyfile(infile, outfile2)
 
         ref_ok = shell_return(f'./test_programs/reference/rot13 {outfile2}') == 0
         if not ref_ok:
@@ -188,6 +293,43 @@ class TestRot13(TestSpec):
 
         return files_same(outfile2, outfile)
 
+@dataclass
+class TestRandomOverwrite(TestSpec):
+    block_size: int
+
+    def bin_path(self):
+        return './random_overwrite'
+
+    def run_cmd(self, infile, outfile, outfile2):
+        return f'./random_overwrite {self.block_size} {outfile}'
+
+    # Like rot13, random_overwrite changes a copy of infile in place
+    def prepare(self, infile, outfile):
+        shutil.copyfile(infile, outfile)
+
+    def run(self, infile, outfile, outfile2):
+        self.prepare(infile, outfile)
+        return shell_return(self.run_cmd(infile, outfile, outfile2)) == 0
+
+    def check(self, infile, outfile, outfile2):
+        def _check(inf, outf, outf2):
+            shutil.copyfile(inf, outf2)
+            return shell_return(f'./test_programs/reference/random_overwrite {self.block_size} {outf2}') == 0
+        return check_reference(_check, infile, outfile, outfile2)
+
+@dataclass
+class TestLogWriter(TestSpec):
+    def bin_path(self):
+        return './log_writer'
+
+    def run_cmd(self, infile, outfile, outfile2):
+        return f'./log_writer {infile} {outfile}'
+
+    def check(self, infile, outfile, outfile2):
+        def _check(inf, outf, outf2):
+            return shell_return(f'./test_programs/reference/log_writer {inf} {outf2}') == 0
+        return check_reference(_check, infile, outfile, outfile2)
+
 @dataclass
 class UnitTest(TestSpec):
     path: str
@@ -217,6 +359,58 @@ def create_unit_tests():
 
     return test_dict
 
+def create_fuzz_tests(rand_seeds):
+    return {
+        'basic_readc': FuzzTest("readc", rand_seeds),
+        'basic_writec': FuzzTest("writec", rand_seeds),
+        'complex_readc_writec': FuzzTest("readc writec", rand_seeds),
+        'complex_readc_writec_seek': FuzzTest("readc writec seek", rand_seeds),
+        'basic_read': FuzzTest("read=17", rand_seeds),
+        'basic_read_random_amounts': FuzzTest("read", rand_seeds, file_size=4129),
+        'basic_write': FuzzTest("write=17", rand_seeds),
+        'basic_write_random_amounts': FuzzTest("write", rand_seeds, file_size=4129),
+        'complex_read_write': FuzzTest("read write", rand_seeds),
+        'complex_read_write_seek': FuzzTest("read write seek", rand_seeds),
+        'complex_seek_beyond_eof': FuzzTest("readc writec seek", rand_seeds, file_size=0, max_file_size=4096, num_ops=1000),
+        'complex_all_read_write': FuzzTest("readc writec read write", rand_seeds),
+        'complex_all_operations': FuzzTest("readc writec read write seek", rand_seeds),
+        'batch_readv_pwrite': FuzzTest("readv pwrite read write", rand_seeds),
+        'advise_all_operations': FuzzTest("readc writec read write readv advise seek", rand_seeds),
+        'zero_copy_peek_reserve': FuzzTest("peek reserve read write seek", rand_seeds),
+    }
+
+def create_e2e_tests():
+    return {
+        'byte_cat': TestByteCat(),
+        #'diabolical_byte_cat': TestDiabolicalByteCat(),
+        'reverse_byte_cat': TestReverseByteCat(),
+        'block_cat_1': TestBlockCat(1),
+        'block_cat_32': TestBlockCat(32),
+        'block_cat_17': TestBlockCat(17),
+        'block_cat_334': TestBlockCat(334),
+        'block_cat_huge': TestBlockCat(8192),
+        'block_cat_gargantuan': TestBlockCat(32768),
+        'zero_copy_block_cat_17': TestZeroCopyBlockCat(17),
+        'zero_copy_block_cat_huge': TestZeroCopyBlockCat(8192),
+        'reverse_block_cat_1': TestReverseBlockCat(1),
+        'reverse_block_cat_32': TestReverseBlockCat(32),
+        'reverse_block_cat_13': TestReverseBlockCat(13),
+        'reverse_block_cat_987': TestReverseBlockCat(987),
+        'reverse_block_cat_huge': TestReverseBlockCat(8192),
+        'random_block_cat': TestRandomBlockCat(),
+        'stride_cat': TestStrideCat(1, 1024),
+        'batch_reverse_block_cat_13': TestBatchReverseBlockCat(13),
+        'batch_reverse_block_cat_huge': TestBatchReverseBlockCat(8192),
+        'batch_stride_cat': TestBatchStrideCat(1, 1024),
+        'rot13': TestRot13(),
+        'tree_cat': TestTreeCat(4096),
+        'tree_cat_17': TestTreeCat(17),
+        'random_overwrite_32': TestRandomOverwrite(32),
+        'random_overwrite_huge': TestRandomOverwrite(8192),
+        'log_writer': TestLogWriter(),
+    }
+
+
 ######################################################################
 #########              End test definitions                  #########
 ######################################################################
@@ -240,11 +434,13 @@ def pass_fail_str(rv):
 def shell_return(shell_cmd, suppress=False, output_on_fail=True):
     if not suppress:
         log('-> ' + shell_cmd)
+    argv, env = util.split_command(shell_cmd)
     proc = subprocess.run(
-        shell_cmd,
+        argv,
+        env=env,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        shell=True
+        pass_fds=STATS.pass_fds()
     )
     if output_on_fail:
         if proc.returncode != 0:
@@ -287,10 +483,11 @@ def files_same(expected, actual, output_on_fail=True):
     if not same_size:
         return False
 
-    same_contents = shell_return(f'diff {expected} {actual}',
-                                 suppress=True, output_on_fail=output_on_fail) == 0
+    offset = util.first_difference(expected, actual)
+    if offset is not None and output_on_fail:
+        print_test_result(1, f"Files differ at byte {offset}:  expected {expected}, got {actual}\n")
 
-    return same_size and same_contents
+    return same_size and offset is None
 
 def check_reference(reference_proc, infile, outfile, outfile2):
     # Reference_proc must be a lambda that runs the reference_program
@@ -318,27 +515,22 @@ def runtests(tests, suite_name, results: util.TestResults,
     global last_log
 
     os.environ["IO300_TEST_RUN"] = str(1);
+    STATS.start()
 
     infile = f'{TEST_FILE_PREFIX}/infile'
     outfile = f'{TEST_FILE_PREFIX}/outfile'
     outfile2 = f'{TEST_FILE_PREFIX}/expected'
     integrity = f'{TEST_FILE_PREFIX}/integrity'
-    assert shell_return(f'touch {infile}', suppress=True) == 0
-    assert shell_return(f'dd if=/dev/urandom of={infile} bs=4096 count=20', suppress=True) == 0
-    assert shell_return(f'touch {integrity}', suppress=True) == 0
-    assert shell_return(f'cp {infile} {integrity}', suppress=True) == 0
+    util.random_file(infile, 4096 * 20)
+    shutil.copyfile(infile, integrity)
 
     for (i, test) in enumerate(tests):
         # Truncate output files
-
-        def _truncate_file(f):
-            assert shell_return(f"rm -f {f}", suppress=True) == 0
-            assert shell_return(f"touch {f}", suppress=True) == 0
-
-        _truncate_file(outfile)
-        _truncate_file(outfile2)
+        util.empty_file(outfile)
+        util.empty_file(outfile2)
 
         log(f'{OKBLUE}{i + 1}. {test}{ENDC}')
+        STATS.take()
 
         testclass = tests[test]
 
@@ -348,12 +540,10 @@ def runtests(tests, suite_name, results: util.TestResults,
             IMPLS_SEEN.add(this_impl)
 
         if test == "ascii_independence":
-            assert shell_return(f'touch man_nonascii.txt', suppress=True) == 0
             f = open("man_nonascii.txt", 'w')
             f.write("Make\x00sure\x00your\x00cache\x00can\x00handle\x00null\x00bytes! 가정하는 것은 안전하지 않습니다 प्रत्येकं पात्रं इति 'n ASCII-karakter.")
             f.close()
-            assert shell_return(f'touch man_integrity', suppress=True) == 0
-            assert shell_return(f'cp man_nonascii.txt man_integrity', suppress=True) == 0
+            shutil.copyfile("man_nonascii.txt", "man_integrity")
 
             passed = testclass.run_and_check("man_nonascii.txt", outfile, outfile2)
 
@@ -365,7 +555,8 @@ def runtests(tests, suite_name, results: util.TestResults,
                 tests[test] = True
 
             tests[test] = passed
-            assert shell_return(f'rm -- man_nonascii.txt man_integrity', suppress=True) == 0
+            os.remove("man_nonascii.txt")
+            os.remove("man_integrity")
         else:
             passed = testclass.run_and_check(infile, outfile, outfile2)
             if suite_name == "REGRESSION":
@@ -377,13 +568,18 @@ def runtests(tests, suite_name, results: util.TestResults,
                 else:
                     tests[test] = passed
 
+        stats = STATS.take()
         if tests[test]:
             log("\t" + OKGREEN + "PASSED!" + ENDC)
+        if stats is not None:
+            log("\t" + util.format_stats(stats))
 
         if results:
             group = "{}".format(suite_name).lower()
             output = last_log if last_log is not None else ""
             results.add_test(test, group, tests[test], output)
+            if stats is not None:
+                results.add_extra("stats_{}_{}".format(group, test), stats)
 
         last_log = None
 
@@ -403,8 +599,9 @@ def runtests(tests, suite_name, results: util.TestResults,
     else:
         print("{},".format(json.dumps(tests, indent=4)))
 
+    STATS.stop()
     del os.environ["IO300_TEST_RUN"]
-    assert shell_return(f'rm -f -- {infile} {outfile} {outfile2} {integrity}', suppress=True) == 0
+    util.remove_files(infile, outfile, outfile2, integrity)
     return ok
 
 def _msg_fuzz_fail():
@@ -424,7 +621,8 @@ TESTS_ORDER = ["regression", "end-to-end", "fuzz"]
 def run(test_group="all", seed=-1,
         grader_mode=False, results=None,
         try_tmpfs=False,
-        fuzz_test_repeats=defaults.FUZZ_TEST_REPEATS):
+        fuzz_test_repeats=defaults.FUZZ_TEST_REPEATS,
+        testnames=None):
 
     global GRADER_MODE
     global TEST_FILE_PREFIX
@@ -451,42 +649,8 @@ def run(test_group="all", seed=-1,
         results.add_extra("seed", rand_seeds)
         results.add_extra("tmpfs", using_tmpfs)
 
-    all_fuzz = {
-        'basic_readc': FuzzTest("readc", rand_seeds),
-        'basic_writec': FuzzTest("writec", rand_seeds),
-        'complex_readc_writec': FuzzTest("readc writec", rand_seeds),
-        'complex_readc_writec_seek': FuzzTest("readc writec seek", rand_seeds),
-        'basic_read': FuzzTest("read=17", rand_seeds),
-        'basic_read_random_amounts': FuzzTest("read", rand_seeds, file_size=4129),
-        'basic_write': FuzzTest("write=17", rand_seeds),
-        'basic_write_random_amounts': FuzzTest("write", rand_seeds, file_size=4129),
-        'complex_read_write': FuzzTest("read write", rand_seeds),
-        'complex_read_write_seek': FuzzTest("read write seek", rand_seeds),
-        'complex_seek_beyond_eof': FuzzTest("readc writec seek", rand_seeds, file_size=0, max_file_size=4096, num_ops=1000),
-        'complex_all_read_write': FuzzTest("readc writec read write", rand_seeds),
-        'complex_all_operations': FuzzTest("readc writec read write seek", rand_seeds),
-    }
-
-    all_e2e = {
-        'byte_cat': TestByteCat(),
-        #'diabolical_byte_cat': TestDiabolicalByteCat(),
-        'reverse_byte_cat': TestReverseByteCat(),
-        'block_cat_1': TestBlockCat(1),
-        'block_cat_32': TestBlockCat(32),
-        'block_cat_17': TestBlockCat(17),
-        'block_cat_334': TestBlockCat(334),
-        'block_cat_huge': TestBlockCat(8192),
-        'block_cat_gargantuan': TestBlockCat(32768),
-        'reverse_block_cat_1': TestReverseBlockCat(1),
-        'reverse_block_cat_32': TestReverseBlockCat(32),
-        'reverse_block_cat_13': TestReverseBlockCat(13),
-        'reverse_block_cat_987': TestReverseBlockCat(987),
-        'reverse_block_cat_huge': TestReverseBlockCat(8192),
-        'random_block_cat': TestRandomBlockCat(),
-        'stride_cat': TestStrideCat(1, 1024),
-        'rot13': TestRot13(),
-    }
-
+    all_fuzz = create_fuzz_tests(rand_seeds)
+    all_e2e = create_e2e_tests()
     all_unit = create_unit_tests()
     # unit_extra = {
     #     'extra_ascii_independence': TestBlockCat(17),
@@ -511,6 +675,15 @@ def run(test_group="all", seed=-1,
         print(f"Unrecognized test group:  {test_group}")
         return 1
 
+    # Only the named tests (watch.py reruns the ones a change affects)
+    if testnames is not None:
+        all_unit = {k: v for k, v in all_unit.items() if k in testnames}
+        all_fuzz = {k: v for k, v in all_fuzz.items() if k in testnames}
+        all_e2e = {k: v for k, v in all_e2e.items() if k in testnames}
+        run_all_unit = run_all_unit and len(all_unit) > 0
+        run_all_fuzz = run_all_fuzz and len(all_fuzz) > 0
+        run_all_e2e = run_all_e2e and len(all_e2e) > 0
+
     if run_all_unit:
         log('======= (1) REGRESSION TESTS =======')
         unit_ok = runtests(all_unit, "REGRESSION",
@@ -56,3 +56,77 @@ WARN_TIME_THRESHOLD = 0.02
 # sizes.  Use with caution and be sure to verify results on the
 # grading server.
 PERFORMANCE_USE_TMPFS = False
+
+# Total time to spend running the performance tests, in seconds.  With
+# 0, each program runs once per test.  Otherwise the tests run a few
+# times each and the rest of the time goes to extra trials of the
+# tests whose results are least certain (see trials.py).
+PERFORMANCE_TIME_BUDGET = 0
+
+# Subtract each program's fixed startup cost (measured by timing
+# empty_cat, which opens and closes the files without copying) before
+# comparing it with stdio.  For small files, process startup and, in
+# sanitizer builds, ASan's setup can take as long as the copy itself.
+# Both the raw and the corrected ratios are reported; this picks the
+# one that decides pass or fail.  When less than WARN_TIME_THRESHOLD of
+# stdio's time is left after subtracting, the raw ratio decides anyway.
+# The startup time is the median of PERFORMANCE_STARTUP_TRIALS runs.
+PERFORMANCE_SUBTRACT_STARTUP = True
+PERFORMANCE_STARTUP_TRIALS = 5
+
+# Pin the performance test programs to one core and watch each trial
+# for interference from the rest of the machine (see benchenv.py).
+# Trials that look noisy are run again, up to ENV_MAX_RERUNS times.
+PERFORMANCE_STABILIZE = True
+ENV_MAX_RERUNS = 2
+
+# A trial is noisy if other work used more than this fraction of the
+# CPU time on the pinned core, ...
+ENV_MAX_OTHER_CPU = 0.10
+# ... if the core's clock speed changed by more than this fraction, ...
+ENV_MAX_FREQ_CHANGE = 0.10
+# ... or if another process read or wrote more than this many bytes
+# of storage while it ran
+ENV_MAX_OTHER_IO_BYTES = 4 * 1024 * 1024
+
+# Warn before the tests if the 1-minute load average is above this
+ENV_MAX_LOAD = 1.0
+
+# Run each timed test program in a cgroup v2 group of its own, where the
+# system allows it (see cgroup.py), and report the peak memory, page
+# cache, block I/O and CPU time charged to it.  The limits, if set, stop
+# a runaway program:  it is killed if it goes over PERFORMANCE_MEMORY_MAX
+# (e.g. "1G") and cannot have more than PERFORMANCE_PIDS_MAX processes
+# and threads.  Setting a limit needs the memory (or pids) controller.
+PERFORMANCE_CGROUPS = True
+PERFORMANCE_MEMORY_MAX = None
+PERFORMANCE_PIDS_MAX = None
+
+# Reuse stdio's results from earlier runs with the same CPU, kernel,
+# file system, file size and build (see baseline.py) for up to
+# PERFORMANCE_BASELINE_MAX_AGE seconds, instead of timing stdio again.
+# After every PERFORMANCE_BASELINE_CHECK_EVERY runs that reuse them,
+# PERFORMANCE_BASELINE_SPOT_CHECKS of the tests run again; if one is
+# further off than its confidence interval, PERFORMANCE_BASELINE_DRIFT
+# of its time and WARN_TIME_THRESHOLD, they are all measured again.  Set
+# PERFORMANCE_BASELINE_CACHE to None to always run stdio.  Grader mode
+# (--grader) never uses the cache.
+PERFORMANCE_BASELINE_CACHE = "~/.cache/io300/stdio_baseline.json"
+PERFORMANCE_BASELINE_MAX_AGE = 7 * 24 * 3600
+PERFORMANCE_BASELINE_CHECK_EVERY = 5
+PERFORMANCE_BASELINE_SPOT_CHECKS = 2
+PERFORMANCE_BASELINE_DRIFT = 0.20
+
+
+#######################################################
+#       Default parameters for watch mode
+#######################################################
+
+# `run_tests.py watch` (see watch.py) reruns the tests a change affects.
+# It waits until no source has changed for WATCH_SETTLE_TIME seconds
+# before building, and where inotify is not available it checks the
+# sources' modification times every WATCH_POLL_INTERVAL seconds.  With
+# WATCH_PERFORMANCE False it only reruns the correctness tests.
+WATCH_SETTLE_TIME = 0.3
+WATCH_POLL_INTERVAL = 1.0
+WATCH_PERFORMANCE = True
@@ -17,10 +17,11 @@ def try_find_impl(bin_path: str):
     # If any error occurs, finding the implementation is more complicated than we can handle,
     # so just return None
     try:
-        out = subprocess.check_output(f"objdump -W {bin_path} | grep DW_AT_name | grep 'impl/'",
-                                      text=True, shell=True)
+        out = subprocess.check_output(["objdump", "-W", bin_path], text=True,
+                                      stderr=subprocess.DEVNULL)
+        names = [line for line in out.splitlines() if "DW_AT_name" in line and "impl/" in line]
 
-        tokens = out.strip().split(" ")
+        tokens = names[-1].strip().split(" ")
         filename = tokens[-1]
         assert("impl" in filename)
         file_path = pathlib.Path(filename)
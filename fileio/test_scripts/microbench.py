@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Time each io300 call on its own, for each implementation and CACHE_SIZE.
+# Usage:
+#    test_scripts/microbench.py [--impl stdio --impl student ...]
+#        [--cache-size 4096 ...] [--op readc ...] [--pattern seq ...]
+#
+# For each implementation and CACHE_SIZE, this builds io300_bench (see
+# test_programs/io300_bench.c) and runs it for each call and access
+# pattern.  io300_bench times batches of calls, as a single call is too
+# short to time on its own.  The latencies below are per call, averaged
+# over a batch, so a slow call (a cache miss, say) shows up spread over
+# its batch:  use a smaller --batch to see more of it in the tail.
+#
+# The programs are built without sanitizers (use --sanitizers to keep
+# them), which would otherwise take up most of the time of a cached call.
+# With --baseline, each p50 is also compared with the same measurement
+# in an earlier --json output, to see which call got slower.
+#
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from dataclasses import dataclass, asdict
+
+import benchenv
+from benchmark import parse_size
+from trials import percentile
+
+OPS = ["readc", "writec", "read", "write", "seek"]
+DEFAULT_IMPLS = ["stdio", "student"]
+DEFAULT_CACHE_SIZES = [4096]
+DEFAULT_PATTERNS = ["seq", "random"]
+
+BENCH_DIR = "/tmp/io300_microbench"
+
+
+@dataclass
+class MicroResult:
+    impl: str
+    cache_size: int
+    op: str
+    pattern: str
+    size: int
+    batches: int
+    ops_per_batch: int
+    p50_ns: float
+    p99_ns: float
+    p999_ns: float
+    ops_per_sec: float
+    close_ns: int
+
+    def key(self):
+        return (self.impl, self.cache_size, self.op, self.pattern, self.size)
+
+
+def parse_output(text):
+    """io300_bench's header fields, and its batch times in ns"""
+    lines = text.splitlines()
+    header = dict(field.split("=", 1) for field in lines[0].lstrip("# ").split())
+    return header, [int(line) for line in lines[1:] if line]
+
+
+def build(impl, cache_size, sanitizers):
+    subprocess.run(["make", "clean"], check=True, stdout=subprocess.DEVNULL)
+    env = dict(os.environ, CFLAGS=f"-DCACHE_SIZE={cache_size}")
+    subprocess.run(["make", "-B", f"IMPL={impl}", "SAN={}".format(1 if sanitizers else 0),
+                    "io300_bench"], check=True, env=env, stdout=subprocess.DEVNULL)
+
+
+def run_one(impl, cache_size, op, pattern, size, file_size, batch, batches, cpus):
+    path = os.path.join(BENCH_DIR, "file")
+    cmd = ["./io300_bench", "-b", str(batch), "-n", str(batches), "-s", str(size),
+           "-f", str(file_size), "-p", pattern, op, path]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                          preexec_fn=lambda: benchenv.pin(cpus))
+    if proc.returncode != 0:
+        print("error: {} failed: {}".format(" ".join(cmd), proc.stderr.strip()), file=sys.stderr)
+        return None
+
+    header, batch_ns = parse_output(proc.stdout)
+    ops_per_batch = int(header["ops_per_batch"])
+    per_op = [ns / ops_per_batch for ns in batch_ns]
+    return MicroResult(impl=impl, cache_size=cache_size, op=op, pattern=pattern,
+                       size=int(header["size"]), batches=len(batch_ns),
+                       ops_per_batch=ops_per_batch,
+                       p50_ns=percentile(per_op, 50),
+                       p99_ns=percentile(per_op, 99),
+                       p999_ns=percentile(per_op, 99.9),
+                       ops_per_sec=len(batch_ns) * ops_per_batch / (sum(batch_ns) / 1e9),
+                       close_ns=int(header["close_ns"]))
+
+
+def print_results(results, baseline=None):
+    header = "{:<10} {:>10}  {:<7} {:<12} {:>10} {:>10} {:>10} {:>12}{}".format(
+        "impl", "CACHE_SIZE", "op", "pattern", "p50 ns", "p99 ns", "p99.9 ns", "ops/sec",
+        "  p50 vs baseline" if baseline else "")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        change = ""
+        if baseline:
+            old = baseline.get(r.key())
+            change = "  {:>+15.1%}".format(r.p50_ns / old.p50_ns - 1) if old else "  {:>15}".format("-")
+        print("{:<10} {:>10}  {:<7} {:<12} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.0f}{}".format(
+            r.impl, r.cache_size, r.op, r.pattern, r.p50_ns, r.p99_ns, r.p999_ns,
+            r.ops_per_sec, change))
+
+
+def load_baseline(path):
+    with open(path, "r") as f:
+        return {r.key(): r for r in (MicroResult(**d) for d in json.load(f))}
+
+
+def main(input_args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--impl", action="append",
+                        help="Implementation to measure (repeat for several; default: {})".format(
+                            ", ".join(DEFAULT_IMPLS)))
+    parser.add_argument("--cache-size", type=int, action="append",
+                        help="CACHE_SIZE to build with (repeat for several; default: {})".format(
+                            ", ".join(str(s) for s in DEFAULT_CACHE_SIZES)))
+    parser.add_argument("--op", choices=OPS, action="append",
+                        help="Call to time (repeat for several; default: all)")
+    parser.add_argument("--pattern", action="append",
+                        help="Access pattern: seq, reverse, random or stride=<N> "
+                        "(repeat for several; default: {})".format(", ".join(DEFAULT_PATTERNS)))
+    parser.add_argument("--size", type=int, default=32,
+                        help="Bytes per io300_read or io300_write")
+    parser.add_argument("--file-size", type=str, default="1M")
+    parser.add_argument("--batch", type=int, default=256,
+                        help="Calls timed together")
+    parser.add_argument("--batches", type=int, default=1000)
+    parser.add_argument("--sanitizers", action="store_true",
+                        help="Build with sanitizers, as the tests do")
+    parser.add_argument("--no-stabilize", action="store_true",
+                        help="Don't pin io300_bench to a core")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Also write the results to this file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Compare with the results of an earlier --json run")
+
+    args = parser.parse_args(input_args)
+
+    cpus = None if args.no_stabilize else benchenv.choose_core()
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    os.makedirs(BENCH_DIR, exist_ok=True)
+
+    results = []
+    try:
+        for impl in args.impl or DEFAULT_IMPLS:
+            for cache_size in args.cache_size or DEFAULT_CACHE_SIZES:
+                print("Building io300_bench with IMPL={} CACHE_SIZE={}".format(impl, cache_size),
+                      file=sys.stderr)
+                build(impl, cache_size, args.sanitizers)
+                for op in args.op or OPS:
+                    for pattern in args.pattern or DEFAULT_PATTERNS:
+                        r = run_one(impl, cache_size, op, pattern, args.size,
+                                    parse_size(args.file_size), args.batch, args.batches, cpus)
+                        if r is not None:
+                            results.append(r)
+    finally:
+        subprocess.run(["make", "clean"], stdout=subprocess.DEVNULL)
+        subprocess.run(["rm", "-rf", BENCH_DIR])
+
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(r) for r in results], f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,9 +4,13 @@ import re
 import os
 import sys
 import json
+import time
+import random
+import shutil
 import signal
 import argparse
 import tempfile
+import threading
 import subprocess
 
 GRADER_MODE = False
@@ -31,12 +35,27 @@ WARN_TIME_TOO_SHORT = False
 # PGID of running test program
 RUNNING_PGID = None
 
+# CPUs the test programs are pinned to, or None
+PINNED_CPUS = None
+
 import util
+import cgroup
+import baseline
 import defaults
+import benchenv
+import trials
+
+# Groups the timed test programs run in (see cgroup.py), or None
+CGROUPS = None
+
+# io300 statistics reported by the test programs
+STATS = util.StatsCollector()
 
 from correctness_test import TestSpec, TestByteCat, TestReverseByteCat, \
     TestBlockCat, TestReverseBlockCat, TestRandomBlockCat, \
-    TestStrideCat, TestDiabolicalByteCat
+    TestStrideCat, TestDiabolicalByteCat, TestBatchReverseBlockCat, \
+    TestBatchStrideCat, TestZeroCopyBlockCat, TestTreeCat, TestRot13, \
+    TestRandomOverwrite, TestLogWriter
 
 log_lines = []
 
@@ -66,11 +85,12 @@ def get_log_output():
 
 
 def silent_shell(cmd):
+    argv, env = util.split_command(cmd)
     sp = subprocess.run(
-        cmd,
+        argv,
+        env=env,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True
+        stderr=subprocess.PIPE
     )
     if sp.returncode != 0:
         print(f'fatal: the command `${cmd}` failed')
@@ -98,73 +118,99 @@ def parse_size(size):
     return int(float(number)*units[unit[0]])
 
 
-def get_sec(time_str):
-    parts = time_str.split(':')
-    if len(parts) == 3:
-        return int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[0])
-    else:
-        return int(parts[0]) * 60 + float(parts[1])
-
-
-def get_time_field(output, fieldname) -> int:
-    try:
-        fieldstart = output.index(fieldname) + len(fieldname)
-        fieldend = output.index('\\n', fieldstart)
-        # parse the number in the field (might be a percentage)
-        if "wall" in fieldname:
-            return get_sec(output[fieldstart:fieldend])
-        else:
-            return float(output[fieldstart:fieldend].replace('%', ''))
-    except:
-        return None
+def _start_test_program():
+    os.setpgrp()
+    benchenv.pin(PINNED_CPUS)
+    if CGROUPS is not None:
+        CGROUPS.enter()
 
 def time_program(progcmd):
+    """
+    Run progcmd and measure it; returns its times (in seconds) and peak
+    memory use, or None if it failed.  The wall time comes from
+    time.perf_counter() and the CPU times and peak RSS from wait4(2),
+    which keeps a test's few milliseconds of startup from rounding to
+    0.00 or 0.01 the way /usr/bin/time's 10 ms fields did.
+    """
     global TIMEOUT_SEC
     global RUNNING_PGID
 
-    timeout_arg = TIMEOUT_SEC if TIMEOUT_SEC > 0 else None
-
-    sp = None
-    failed = False
-    cmd = ['/usr/bin/time', '--verbose', '--'] + progcmd.split(' ')
-    proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            preexec_fn=os.setpgrp)
+    if CGROUPS is not None:
+        CGROUPS.start()
+    start = time.perf_counter()
+    proc = subprocess.Popen(progcmd.split(' '),
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL,
+                            pass_fds=STATS.pass_fds(),
+                            preexec_fn=_start_test_program)
 
     RUNNING_PGID = os.getpgid(proc.pid)
-    stdout, stderr = bytes(), bytes()
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
+        try:
+            os.killpg(RUNNING_PGID, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    timer = threading.Timer(TIMEOUT_SEC, _kill) if TIMEOUT_SEC > 0 else None
+    if timer is not None:
+        timer.start()
     try:
-        stdout, stderr = proc.communicate(timeout=timeout_arg)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    wtime = time.perf_counter() - start
+    # wait4 reaped it, so Popen must not wait for it again
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    usage = CGROUPS.stop() if CGROUPS is not None else None
+
+    if timed_out.is_set():
         log(FAIL + f"timed out after {TIMEOUT_SEC} seconds" + ENDC)
-        failed = True
-
-    returncode = proc.returncode
-    if failed or returncode != 0:
-        if sp is not None:
-            log(str(stdout, encoding='utf-8', errors="backslashreplace"))
-            log(str(stderr, encoding='utf-8', errors="backslashreplace"))
+    if usage is not None and usage["oom_kills"]:
+        log(FAIL + "killed for going over its memory limit ({} bytes)".format(
+            CGROUPS.memory_max) + ENDC)
+    if usage is not None and usage["pids_max_hits"]:
+        log(FAIL + "could not start a process or thread (pids.max is {})".format(
+            CGROUPS.pids_max) + ENDC)
+    if timed_out.is_set() or proc.returncode != 0:
         return None
 
-    time_output = str(stderr)
-
-    perf_data = {
-        'cpu': get_time_field(time_output, 'Percent of CPU this job got:'),
-        'stime': get_time_field(time_output, 'System time (seconds):'),
-        'utime': get_time_field(time_output, 'User time (seconds):'),
-        'wtime': get_time_field(time_output, 'Elapsed (wall clock) time (h:mm:ss or m:ss):'),
-        'mrss': get_time_field(time_output, 'Maximum resident set size (kbytes):'),
-        'arss': get_time_field(time_output, 'Average resident set size (kbytes):'),
+    return {
+        'cpu': 100 * (rusage.ru_utime + rusage.ru_stime) / wtime if wtime > 0 else 0.0,
+        'stime': rusage.ru_stime,
+        'utime': rusage.ru_utime,
+        'wtime': wtime,
+        'mrss': rusage.ru_maxrss,
+        'cgroup': usage,
     }
 
-    if None in perf_data.values():
-        # we couldn't parse the output, so the command probably failed
-        return None
-    else:
-        return perf_data
+def trace_program(progcmd, use_strace=False):
+    """
+    Run progcmd under the trace library, or under strace; returns the
+    parsed trace or None
+    """
+    timeout_arg = TIMEOUT_SEC if TIMEOUT_SEC > 0 else None
+
+    with tempfile.NamedTemporaryFile(mode="r", suffix=".json") as out:
+        argv, env = progcmd.split(' '), util.trace_env(out.name)
+        if use_strace:
+            argv = util.strace_command(argv, out.name)
+            env.pop("LD_PRELOAD")
+        try:
+            sp = subprocess.run(argv,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                env=env,
+                                timeout=timeout_arg)
+        except subprocess.TimeoutExpired:
+            log(FAIL + f"trace run timed out after {TIMEOUT_SEC} seconds" + ENDC)
+            return None
+        if sp.returncode != 0:
+            return None
+        return util.parse_strace(out.read()) if use_strace else util.parse_trace(out.read())
 
 CALIBRATION_MODE_MAX = "max"
 CALIBRATION_MODE_FREE = "free"
@@ -180,16 +226,17 @@ def determine_test_size(test_map: dict[str,TestSpec], calibration_time,
     target_sec = calibration_time
     size_inc = lambda x: x * 2
 
-    def _run_benchmark(run_func, file_size):
+    def _run_benchmark(spec, file_size):
         infile = f'{TEST_FILE_PREFIX}/infile'
         outfile = f'{TEST_FILE_PREFIX}/outfile'
 
-        silent_shell(f"rm -f {infile} {outfile}")
-        silent_shell(f"touch {outfile}")
-        silent_shell(f'dd if=/dev/urandom of={infile} bs={file_size} count=1')
+        util.empty_file(outfile)
+        util.random_file(infile, file_size)
+        spec.prepare(infile, outfile)
 
-        perf_results = time_program(run_func(infile, outfile, "/dev/null"))
-        silent_shell(f"rm -f {infile} {outfile}")
+        perf_results = time_program(spec.run_cmd(infile, outfile, "/dev/null"))
+        spec.cleanup(infile, outfile)
+        util.remove_files(infile, outfile)
 
         if not perf_results:
             print("Unable to calibrate")
@@ -206,8 +253,7 @@ def determine_test_size(test_map: dict[str,TestSpec], calibration_time,
             if verbose:
                 print(".", end="", flush=True)
 
-            func = spec.run_cmd
-            runtime = _run_benchmark(func, curr_size)
+            runtime = _run_benchmark(spec, curr_size)
             #print("{} {}M => {:.2f}s".format(name, curr_size / (1024 * 1024), runtime))
             if runtime > target_sec:
                 found = True
@@ -237,27 +283,88 @@ def determine_test_size(test_map: dict[str,TestSpec], calibration_time,
     return final_size_map
 
 
+def _in_dir(progcmd, bindir):
+    """progcmd, with the test program taken from bindir instead of ."""
+    return bindir + progcmd[1:] if progcmd.startswith("./") else progcmd
+
+
+def _mean(samples):
+    return sum(samples) / len(samples)
+
+
+def _median(samples):
+    samples = sorted(samples)
+    mid = len(samples) // 2
+    return samples[mid] if len(samples) % 2 else (samples[mid - 1] + samples[mid]) / 2
+
+
+STDIO_MAKECMD = 'make -B IMPL=stdio'
+# What the test programs link besides their own code
+PROGRAM_OBJECTS = ["impl.o", "test_helpers.o", "io300_fallback.o", "io300_stats.o"]
+
 def runtests(tests, size_map, res: util.TestResults,
-             check_correctness=False):
+             check_correctness=False, trace_syscalls=False, stabilize=False,
+             time_budget=0, subtract_startup=False, baseline_cache=None,
+             baseline_max_age=defaults.PERFORMANCE_BASELINE_MAX_AGE,
+             incremental=False):
     global GRADER_MODE
 
+    # Trials of each test so far:  results[testname][impl] is a list of
+    # time_program results, or None once that program has failed
     results = {}
+    notes = {}
+    # Median seconds each implementation's empty_cat took, or None if
+    # it failed (and nothing is subtracted)
+    startup = {}
     for testname in tests:
         results[testname] = {}
+        notes[testname] = []
 
     infile = f'{TEST_FILE_PREFIX}/infile'
     outfile = f'{TEST_FILE_PREFIX}/outfile'
     outfile2 = f'{TEST_FILE_PREFIX}/expected'
+    startup_infile = f'{TEST_FILE_PREFIX}/startup_infile'
+
+    # Each implementation's test programs are kept in a directory of
+    # their own, so later trials can switch between them
+    bindir = tempfile.mkdtemp(prefix="io300_perf_")
+    # An incremental run (watch.py) builds just the programs it needs, in
+    # place, and removes them and their objects again afterwards, so the
+    # rest of the tree's build is left alone
+    programs = sorted({os.path.basename(t.bin_path()) for t in tests.values()} | {"empty_cat"})
+    # Test whose input is in infile, and seconds its last trials took
+    current_input = None
+    trial_cost = {}
+
+    budget = trials.TrialBudget(time_budget) if time_budget > 0 else None
+
+    # stdio's system calls are made inside the C library, where only
+    # strace sees them (see trace_program)
+    use_strace = trace_syscalls and shutil.which("strace") is not None
+    if trace_syscalls and not use_strace:
+        log(WARNING + "strace is not installed, so stdio's system calls cannot be traced" + ENDC)
+
+    # stdio's results from earlier runs, if they can be reused (not
+    # with traces, which the cache does not keep)
+    cache = None
+    if baseline_cache is not None and not trace_syscalls:
+        cache = baseline.BaselineCache(baseline_cache,
+                                       baseline.fingerprint(TEST_FILE_PREFIX, STDIO_MAKECMD),
+                                       max_age=baseline_max_age)
+    # Which tests' stdio results came from the cache, which of those
+    # were run again to check them, and which did not match
+    from_cache = {}
+    spot_checked = []
+    drifted = []
+
+    # Tests that work a byte at a time get more slack
+    def _threshold(test_name):
+        return 10.0 if "byte" in test_name or test_name == "rot13" else 5.0
 
     def _is_pass(test_name, ratio):
         if ratio == "student test failed":
             return False
-        elif "byte" in test_name and ratio <= 10.0:
-            return True
-        elif ratio <= 5.0:
-            return True
-        else:
-            return False
+        return ratio <= _threshold(test_name)
 
     def _fmt_float(ratio):
         return round(ratio, 2) if isinstance(ratio, int) or isinstance(ratio, float) else ""
@@ -275,23 +382,65 @@ def runtests(tests, size_map, res: util.TestResults,
         else:
             print(s)
 
+    def _corrected(impl, times):
+        """Trial times less the implementation's startup time"""
+        if not startup.get(impl):
+            return times
+        return [max(t - startup[impl], 0.001) for t in times]
+
+    def _use_corrected(stdio):
+        """
+        Whether startup is subtracted before deciding a test, given
+        stdio's raw times:  only if what is left of stdio's time is long
+        enough to measure.  Otherwise the raw times decide, rather than
+        a ratio over a few milliseconds (or nothing) of stdio's time.
+        """
+        return subtract_startup and _mean(_corrected("stdio", stdio)) >= defaults.WARN_TIME_THRESHOLD
+
+    def _times(testname, impl, correct=None):
+        times = [r["wtime"] for r in results[testname][impl]]
+        if correct is None:
+            correct = _use_corrected([r["wtime"] for r in results[testname]["stdio"]])
+        return _corrected(impl, times) if correct else times
+
+    def _ratio(stdio, student):
+        return _mean(student) / max(_mean(stdio), 0.001)
+
     def _compute_log_result(testname, file_size, stdio, student, print_log=False):
         global WARN_TIME_TOO_SHORT
-        stdio_time = stdio['wtime']
-        student_time = student['wtime']
+        stdio_time = _mean(stdio)
+        student_time = _mean(student)
 
         if stdio_time == 0.0:
             stdio_time = 0.001
 
         ratio = student_time / stdio_time
+        corrected_stdio = _corrected("stdio", stdio)
+        corrected_student = _corrected("student", student)
+        corrected_ratio = _ratio(corrected_stdio, corrected_student)
+        use_corrected = _use_corrected(stdio)
         if print_log:
             _print_log(testname, file_size, stdio_time, student_time, indent=True)
-
-        if stdio_time < defaults.WARN_TIME_THRESHOLD:
+            if startup.get("stdio") and startup.get("student"):
+                log("\t\tless startup (stdio {:.3f}s, student {:.3f}s): stdio={:.2f}s, student={:.2f}s, ratio={:.2f}"
+                    .format(startup["stdio"], startup["student"], _mean(corrected_stdio),
+                            _mean(corrected_student), corrected_ratio))
+            if len(stdio) > 1 or len(student) > 1:
+                if use_corrected:
+                    stdio, student = corrected_stdio, corrected_student
+                mean_ratio, halfwidth = trials.ratio_ci(student, [max(t, 0.001) for t in stdio])
+                log("\t\t95% confidence interval: {:.2f} to {:.2f} ({} stdio, {} student trials)"
+                    .format(mean_ratio - halfwidth, mean_ratio + halfwidth, len(stdio), len(student)))
+
+        # With startup subtracted, what is left has to be long enough
+        if _mean(corrected_stdio if subtract_startup else stdio) < defaults.WARN_TIME_THRESHOLD:
             WARN_TIME_TOO_SHORT = True
             log("\t\t{}WARNING:  stdio time is very short, results may be inaccurate{}".format(WARNING, ENDC))
+        if subtract_startup and not use_corrected:
+            log("\t\tstdio time less startup is under {}s, so the ratio is decided without subtracting it"
+                .format(defaults.WARN_TIME_THRESHOLD))
 
-        return ratio, stdio_time, student_time
+        return ratio, corrected_ratio, stdio_time, student_time
 
     def _print_log(testname, file_size, stdio_time, student_time, indent=False):
         _size = int(file_size) if file_size >= 1.0 else round(file_size, 2)
@@ -306,97 +455,358 @@ def runtests(tests, size_map, res: util.TestResults,
 
         raise KeyboardInterrupt
 
-    def suite(makecmd, impl):
-        log(f'\033[31mrunning test suite: {impl}\033[0m')
-        silent_shell('make clean')
-        silent_shell(makecmd)
+    def _prepare_input(testname):
+        nonlocal current_input
+        if current_input == testname:
+            return
+
+        if current_input is not None:
+            tests[current_input].cleanup(infile, outfile)
+        util.empty_file(outfile)
+        util.empty_file(outfile2)
+
+        util.random_file(infile, size_map[testname])
+        tests[testname].prepare(infile, outfile)
+        current_input = testname
+
+    def _trial(impl, testname, first):
+        """One timed run of the test; returns its result, or None if it failed"""
+        test_class = tests[testname]
+        prog_str = _in_dir(test_class.run_cmd(infile, outfile, outfile2), f"{bindir}/{impl}")
+        if first:
+            log('-> ' + prog_str)
 
-        for (i, testname) in enumerate(tests):
+        monitor = benchenv.TrialMonitor(PINNED_CPUS) if stabilize else None
+        for attempt in range(defaults.ENV_MAX_RERUNS + 1):
+            STATS.take()
+            if monitor is not None:
+                monitor.start()
+            this_result = time_program(prog_str)
+            if monitor is None or this_result is None:
+                break
+            trial_env = monitor.stop(this_result["utime"] + this_result["stime"])
+            this_result["environment"] = trial_env
+            if not trial_env["noisy"]:
+                break
+            reasons = "; ".join(trial_env["noisy"])
+            if attempt < defaults.ENV_MAX_RERUNS:
+                log("\t{}noisy trial ({}), running it again{}".format(WARNING, reasons, ENDC))
+            else:
+                notes[testname].append("\t{}WARNING:  every {} trial was noisy ({}), results may be inaccurate{}"
+                                       .format(WARNING, impl, reasons, ENDC))
+        stats = STATS.take()
+        if this_result is None:
+            return None
+
+        this_result["stats"] = stats
+        # Output only needs checking once; later trials write the same
+        if check_correctness and first and (impl != "stdio"):
+            is_correct = test_class.check(infile, outfile,
+                                          outfile2)
+            if not is_correct:
+                notes[testname].append("\t" + FAIL + "Test program finished, but output file was not correct.  Make sure correctness tests are passing." + ENDC)
+                return None
+
+        # Tracing slows every call down a little, so the traced run is
+        # separate from the timed one
+        if trace_syscalls and first:
+            this_result["trace"] = trace_program(prog_str, use_strace=(impl == "stdio" and use_strace))
+        return this_result
+
+    def _add_trial(impl, testname):
+        so_far = results[testname].get(impl, [])
+        if so_far is None:
+            return
+        started = time.monotonic()
+        this_result = _trial(impl, testname, first=(len(so_far) == 0))
+        results[testname][impl] = None if this_result is None else so_far + [this_result]
+        trial_cost[(testname, impl)] = time.monotonic() - started
+
+    def suite(makecmd, impl, testnames=None):
+        log(f'\033[31mrunning test suite: {impl}\033[0m')
+        if incremental:
+            silent_shell("{} {}".format(makecmd, " ".join(programs)))
+        else:
+            silent_shell('make clean')
+            silent_shell(makecmd)
+        if trace_syscalls:
+            silent_shell('make io300_trace.so')
+        os.makedirs(f"{bindir}/{impl}")
+        for test_class in tests.values():
+            shutil.copy(test_class.bin_path(), f"{bindir}/{impl}")
+        shutil.copy("./empty_cat", f"{bindir}/{impl}")
+        measure_startup(impl)
+
+        for (i, testname) in enumerate(tests if testnames is None else testnames):
             log(f'\033[32m{i + 1}. {impl}::{testname}\033[0m')
+            _prepare_input(testname)
+            _add_trial(impl, testname)
+            # With no budget, the one trial each is the final result
+            if incremental and impl == "student" and budget is None:
+                _print_current(testname)
+
+    def _print_current(testname):
+        if results[testname]["student"] is None:
+            _print_result(testname, "student test failed", indent=True)
+        elif results[testname].get("stdio"):
+            _print_result(testname, _ratio(_times(testname, "stdio"), _times(testname, "student")),
+                          indent=True)
+
+    def stdio_suite():
+        """
+        Run the stdio suite, or as little of it as the cache allows;
+        returns True if stdio was built (so it can have more trials)
+        """
+        nonlocal from_cache
+        if cache is None:
+            suite(STDIO_MAKECMD, 'stdio')
+            return True
 
-            def _truncate_file(f):
-                silent_shell(f"rm -f {f}")
-                silent_shell(f"touch {f}")
-
-            _truncate_file(infile)
-            _truncate_file(outfile)
-            _truncate_file(outfile2)
-
-            test_file_size = size_map[testname]
-            _test_size_mb = test_file_size / (1024 * 1024)
-            silent_shell(f'dd if=/dev/urandom of={infile} bs={test_file_size} count=1')
-
-            test_class = tests[testname]
-            prog_str = test_class.run_cmd(infile, outfile, outfile2)
-            log('-> ' + prog_str)
+        for testname, spec in tests.items():
+            cached = cache.get(testname, spec, size_map[testname])
+            if cached:
+                from_cache[testname] = cached
+        cached_startup = cache.get_startup()
+        if len(from_cache) == len(tests) and cached_startup is not None and not cache.check_due():
+            log(f'\033[31musing cached stdio results from {cache.path}\033[0m')
+            for testname in tests:
+                results[testname]["stdio"] = from_cache[testname]
+            startup["stdio"] = cached_startup
+            cache.reused()
+            return False
 
-            clear_log()
+        if from_cache and cache.check_due():
+            spot_checked.extend(random.sample(sorted(from_cache),
+                                              min(len(from_cache),
+                                                  defaults.PERFORMANCE_BASELINE_SPOT_CHECKS)))
+            cache.checked()
+        suite(STDIO_MAKECMD, 'stdio',
+              [t for t in tests if t not in from_cache or t in spot_checked])
+
+        drifted.extend(t for t in spot_checked if results[t].get("stdio")
+                       and cache.drifted(from_cache[t], results[t]["stdio"][0]["wtime"]))
+        if drifted:
+            log("{}WARNING:  stdio's times for {} no longer match the cached ones, "
+                "measuring them all again{}".format(WARNING, ", ".join(drifted), ENDC))
+            cache.invalidate()
+            for testname in from_cache:
+                if testname not in spot_checked:
+                    log(f'\033[32mstdio::{testname}\033[0m')
+                    _prepare_input(testname)
+                    _add_trial('stdio', testname)
+            from_cache = {}
+        elif spot_checked:
+            log("stdio's times for {} still match the cached ones".format(", ".join(spot_checked)))
+        for testname, cached in from_cache.items():
+            results[testname]["stdio"] = cached + (results[testname].get("stdio") or [])
+        return True
+
+    def save_baseline(stdio_built):
+        """Keep stdio's new results for later runs"""
+        if stdio_built:
+            cache.put_startup(startup.get("stdio"))
+        for testname, spec in tests.items():
+            if testname not in from_cache and results[testname].get("stdio"):
+                cache.put(testname, spec, size_map[testname], results[testname]["stdio"])
+        try:
+            cache.save()
+        except OSError as e:
+            log(f"{WARNING}WARNING:  could not save the stdio results to {cache.path}: {e}{ENDC}")
+
+    def measure_startup(impl):
+        """Time empty_cat, the fixed cost every test program pays"""
+        prog_str = _in_dir(f"./empty_cat {startup_infile} {outfile}", f"{bindir}/{impl}")
+        log(f'measuring startup time: {prog_str}')
+        util.random_file(startup_infile, 4096)
+        samples = []
+        for _ in range(defaults.PERFORMANCE_STARTUP_TRIALS):
+            STATS.take()
             this_result = time_program(prog_str)
-            if check_correctness and (this_result is not None) and (impl != "stdio"):
-                is_correct = test_class.check(infile, outfile,
-                                              outfile2)
-                if not is_correct:
-                    log("\t" + FAIL + "Test program finished, but output file was not correct.  Make sure correctness tests are passing." + ENDC)
-                    this_result = None
-
-            results_this_test = results[testname]
-            results_this_test[impl] = this_result
-
-            if (not GRADER_MODE) and (impl == "student"):
-                if "stdio" in results_this_test:
-                    ratio = ""
-                    time_stdio = ""
-                    time_student = ""
-
-                    if this_result is None:
-                        log("\t" + FAIL + "student test failed" + ENDC)
-                    else:
-                        stdio_result = results_this_test["stdio"]
-
-                        ratio, time_stdio, time_student = \
-                            _compute_log_result(testname,
-                                                _test_size_mb,
-                                                stdio=stdio_result,
-                                                student=this_result, print_log=True)
-                        _print_result(testname, ratio, indent=True)
-
-                    if res:
-                        output = get_log_output()
-                        is_pass = ratio != "" and _is_pass(testname, ratio)
-                        res.add_test(testname, "performance", is_pass, output)
-                        res.add_extra("size_{}".format(testname), test_file_size)
-                        res.add_extra("ratio_{}".format(testname), _fmt_float(ratio))
-                        res.add_extra("time_{}_{}".format(testname, "stdio"),
-                                      _fmt_float(time_stdio))
-                        res.add_extra("time_{}_{}".format(testname, "student"),
-                                      _fmt_float(time_student))
+            if this_result is None:
+                break
+            samples.append(this_result["wtime"])
+        STATS.take()
+        if len(samples) < defaults.PERFORMANCE_STARTUP_TRIALS:
+            log(f"\t{WARNING}WARNING:  empty_cat failed, so {impl}'s times include its startup{ENDC}")
+            startup[impl] = None
+        else:
+            startup[impl] = _median(samples)
+            log("\tstartup time: {:.3f}s".format(startup[impl]))
+
+    def refine():
+        """Spend what is left of the time budget on the least certain ratios"""
+        log('\033[31mspending the rest of the {}s time budget on the least certain results\033[0m'
+            .format(time_budget))
+        while True:
+            candidates = []
+            for testname in tests:
+                stdio_runs = results[testname].get("stdio")
+                student_runs = results[testname].get("student")
+                if not stdio_runs or not student_runs:
+                    continue
+                stdio_times = [max(t, 0.001) for t in _times(testname, "stdio")]
+                student_times = _times(testname, "student")
+                ratio, halfwidth = trials.ratio_ci(student_times, stdio_times)
+                prio = trials.priority(min(len(stdio_times), len(student_times)),
+                                       ratio, halfwidth, _threshold(testname))
+                cost = trial_cost.get((testname, "stdio"), 0) + trial_cost[(testname, "student")]
+                candidates.append((testname, prio, cost))
+
+            testname = budget.pick(candidates)
+            if testname is None:
+                break
+            _prepare_input(testname)
+            # Alternate the two, so a slow drift in the machine affects
+            # both alike (unless stdio's results are all from the cache)
+            for impl in ["stdio", "student"] if stdio_built else ["student"]:
+                _add_trial(impl, testname)
+
+    def report(testname):
+        """Log the test's results and add them to res"""
+        clear_log()
+        results_this_test = results[testname]
+        test_file_size = size_map[testname]
+        _test_size_mb = test_file_size / (1024 * 1024)
+        ratio = ""
+        raw_ratio = ""
+        corrected_ratio = ""
+        time_stdio = ""
+        time_student = ""
+
+        log(f'\033[32m{testname}\033[0m')
+        for note in notes[testname]:
+            log(note)
+        times = {}
+        for _impl in ["stdio", "student"]:
+            if results_this_test.get(_impl):
+                times[_impl] = [r["wtime"] for r in results_this_test[_impl]]
+
+        if "student" not in times:
+            log("\t" + FAIL + "student test failed" + ENDC)
+        elif "stdio" in times:
+            raw_ratio, corrected_ratio, time_stdio, time_student = \
+                _compute_log_result(testname,
+                                    _test_size_mb,
+                                    stdio=times["stdio"],
+                                    student=times["student"], print_log=True)
+            ratio = corrected_ratio if _use_corrected(times["stdio"]) else raw_ratio
+            _print_result(testname, ratio, indent=True)
+
+        # Tests that copy many files also get a rate per file
+        num_files = getattr(tests[testname], "num_files", None)
+        per_file = {}
+        if num_files:
+            for _impl in times:
+                seconds = _mean(_times(testname, _impl))
+                per_file[_impl] = (num_files / seconds, seconds / num_files * 1e6)
+                log("\t{}: {} files, {:.0f} files/sec, {:.1f}us per file".format(
+                    _impl, num_files, *per_file[_impl]))
+
+        # Statistics and traces are from each program's first trial
+        for _impl in ["stdio", "student"]:
+            if _impl in times:
+                _result = results_this_test[_impl][0]
+                log("\t{}: {}".format(_impl, util.format_stats(_result["stats"])))
+                if CGROUPS is not None:
+                    log("\t{}: {}".format(_impl, cgroup.format_usage(_result.get("cgroup"))))
+                if trace_syscalls:
+                    for line in util.format_trace(_result.get("trace"), indent="\t\t"):
+                        log(line)
+
+        if res:
+            output = get_log_output()
+            is_pass = ratio != "" and _is_pass(testname, ratio)
+            res.add_test(testname, "performance", is_pass, output)
+            res.add_extra("size_{}".format(testname), test_file_size)
+            res.add_extra("ratio_{}".format(testname), _fmt_float(ratio))
+            res.add_extra("ratio_raw_{}".format(testname), _fmt_float(raw_ratio))
+            res.add_extra("ratio_corrected_{}".format(testname), _fmt_float(corrected_ratio))
+            res.add_extra("time_{}_{}".format(testname, "stdio"),
+                          _fmt_float(time_stdio))
+            res.add_extra("time_{}_{}".format(testname, "student"),
+                          _fmt_float(time_student))
+            for _impl in ["stdio", "student"]:
+                if _impl not in times:
+                    continue
+                _result = results_this_test[_impl][0]
+                res.add_extra("trials_{}_{}".format(testname, _impl), times[_impl])
+                if _impl in per_file:
+                    res.add_extra("files_per_sec_{}_{}".format(testname, _impl), per_file[_impl][0])
+                    res.add_extra("usec_per_file_{}_{}".format(testname, _impl), per_file[_impl][1])
+                if _result["stats"] is not None:
+                    res.add_extra("stats_{}_{}".format(testname, _impl),
+                                  _result["stats"])
+                environments = [r["environment"] for r in results_this_test[_impl]
+                                if r.get("environment") is not None]
+                if environments:
+                    res.add_extra("environment_{}_{}".format(testname, _impl),
+                                  environments)
+                usages = [r["cgroup"] for r in results_this_test[_impl]
+                          if r.get("cgroup") is not None]
+                if usages:
+                    res.add_extra("cgroup_{}_{}".format(testname, _impl), usages)
+                if _result.get("trace") is not None:
+                    res.add_extra("trace_{}_{}".format(testname, _impl),
+                                  _result["trace"])
 
     signal.signal(signal.SIGINT, _signit_handler)
 
-    suite('make -B IMPL=stdio', 'stdio')
-    suite('CFLAGS=-DCACHE_SIZE=4096 make -B IMPL=student', 'student')
+    # The test programs only report their io300 statistics to the test scripts
+    os.environ["IO300_TEST_RUN"] = str(1)
+    STATS.start()
 
-    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    stdio_built = True
+    try:
+        stdio_built = stdio_suite()
+        suite('CFLAGS=-DCACHE_SIZE=4096 make -B IMPL=student', 'student')
+        if budget is not None:
+            refine()
+        if cache is not None:
+            save_baseline(stdio_built)
+    finally:
+        STATS.stop()
+        del os.environ["IO300_TEST_RUN"]
+        shutil.rmtree(bindir, ignore_errors=True)
+        util.remove_files(startup_infile)
+        if current_input is not None:
+            tests[current_input].cleanup(infile, outfile)
+
+    if res:
+        for _impl in ["stdio", "student"]:
+            res.add_extra("startup_{}".format(_impl), startup.get(_impl))
+        res.add_extra("perf_baseline", None if cache is None else {
+            "fingerprint": cache.fingerprint,
+            "cached": sorted(from_cache),
+            "spot_checked": spot_checked,
+            "drifted": drifted,
+        })
 
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    metrics = {}
     for testname in tests:
-        if type(results[testname]['stdio']) is not dict:
+        if not results[testname].get('stdio'):
             print('ERROR: stdio program failed. This should not happen, please contact the course staff')
-            print(results[testname]['stdio'])
+            print(results[testname].get('stdio'))
             sys.exit(1)
+
+    if not GRADER_MODE:
+        for testname in tests:
+            report(testname)
+
+    metrics = {}
+    for testname in tests:
         if results[testname]['student'] is None:
             #log('student program failed')
             metrics[testname] = 'student test failed'
             continue
 
-        stdio_time = results[testname]['stdio']['wtime']
-        student_time = results[testname]['student']['wtime']
+        stdio_time = _mean(_times(testname, 'stdio', correct=False))
+        student_time = _mean(_times(testname, 'student', correct=False))
 
         if stdio_time == 0.0:
             stdio_time = 0.001
 
-        ratio = student_time / stdio_time
+        ratio = _ratio(_times(testname, 'stdio'), _times(testname, 'student'))
         metrics[testname] = ratio
         test_file_size = size_map[testname]
         test_size_mb = test_file_size / (1024 * 1024)
@@ -409,8 +819,35 @@ def runtests(tests, size_map, res: util.TestResults,
     else:
         print(json.dumps(metrics, indent=4))
 
-    silent_shell('make clean')
-    silent_shell(f'rm -- {infile} {outfile}')
+    if incremental:
+        util.remove_files(*programs, *PROGRAM_OBJECTS,
+                          *(["io300_trace.so"] if trace_syscalls else []))
+    else:
+        silent_shell('make clean')
+    util.remove_files(infile, outfile)
+
+def create_tests():
+    return {
+        'byte_cat': TestByteCat(),
+    #    'diabolical_byte_cat': TestDiabolicalByteCat,
+        'reverse_byte_cat': TestReverseByteCat(),
+        'block_cat': TestBlockCat(32),
+        'reverse_block_cat': TestReverseBlockCat(32),
+        'random_block_cat': TestRandomBlockCat(),
+        'stride_cat': TestStrideCat(1, 1024),
+        # Same access patterns, handed to the library with io300_readv
+        'batch_reverse_block_cat': TestBatchReverseBlockCat(32),
+        'batch_stride_cat': TestBatchStrideCat(1, 1024),
+        'zero_copy_block_cat': TestZeroCopyBlockCat(32),
+        # Many 1-64 KiB files, where io300_open and io300_close matter most
+        'tree_cat': TestTreeCat(4096),
+        # Files that are both read and written:  in place a byte at a
+        # time, in place at random offsets, and appended to
+        'rot13': TestRot13(),
+        'random_overwrite': TestRandomOverwrite(32),
+        'log_writer': TestLogWriter(),
+    }
+
 
 def run(timeout=0,
         file_size=None,
@@ -419,18 +856,40 @@ def run(timeout=0,
         try_tmpfs=True,
         calibration_time_sec=defaults.CALIBRATION_TIME,
         calibration_mode=defaults.CALIBRATION_MODE,
+        use_advice=True,
+        trace_syscalls=False,
+        stabilize=defaults.PERFORMANCE_STABILIZE,
+        time_budget=defaults.PERFORMANCE_TIME_BUDGET,
+        subtract_startup=defaults.PERFORMANCE_SUBTRACT_STARTUP,
+        use_cgroups=defaults.PERFORMANCE_CGROUPS,
+        memory_max=defaults.PERFORMANCE_MEMORY_MAX,
+        pids_max=defaults.PERFORMANCE_PIDS_MAX,
+        baseline_cache=defaults.PERFORMANCE_BASELINE_CACHE,
+        refresh_baseline=False,
+        testnames=None,
+        incremental=False,
         results: util.TestResults|None=None):
     global TIMEOUT_SEC
     global GRADER_MODE
     global WARN_TIME_TOO_SHORT
     global TEST_FILE_PREFIX
+    global PINNED_CPUS
+    global CGROUPS
 
     if grader_mode:
         GRADER_MODE = True
+        # A graded ratio's two sides are always measured in the same run,
+        # never against stdio times from another day and another load
+        baseline_cache = None
 
     if timeout != 0:
         TIMEOUT_SEC = timeout
 
+    # The test programs skip their io300_advise calls if this is set;
+    # compare runs with and without it to see what the hints are worth
+    if not use_advice:
+        os.environ["IO300_NO_ADVICE"] = "1"
+
     tmpfs_ok = False
     if try_tmpfs:
         tmpfs_ok = util.tmpfs_try_setup(util.TMPFS_PREFIX)
@@ -438,15 +897,28 @@ def run(timeout=0,
             TEST_FILE_PREFIX = util.TMPFS_PREFIX
     log('======= PERFORMANCE TESTS =======')
 
-    TESTS_TO_RUN = {
-        'byte_cat': TestByteCat(),
-    #    'diabolical_byte_cat': TestDiabolicalByteCat,
-        'reverse_byte_cat': TestReverseByteCat(),
-        'block_cat': TestBlockCat(32),
-        'reverse_block_cat': TestReverseBlockCat(32),
-        'random_block_cat': TestRandomBlockCat(),
-        'stride_cat': TestStrideCat(1, 1024),
-    }
+    environment = None
+    if stabilize:
+        PINNED_CPUS = benchenv.choose_core()
+        environment = benchenv.preflight(PINNED_CPUS)
+        log("Running test programs on CPU {}".format(",".join(str(c) for c in PINNED_CPUS)))
+        for warning in environment["warnings"]:
+            log("{}WARNING:  {}, results may be inaccurate{}".format(WARNING, warning, ENDC))
+
+    if use_cgroups:
+        try:
+            CGROUPS = cgroup.setup(memory_max=cgroup.parse_limit(memory_max), pids_max=pids_max)
+        except ValueError as e:
+            log("{}WARNING:  {}, running without limits{}".format(WARNING, e, ENDC))
+            CGROUPS = cgroup.setup()
+        if CGROUPS is not None:
+            log("Accounting for each test program in {} ({})".format(
+                CGROUPS.path, ", ".join(sorted(CGROUPS.controllers)) or "cpu.stat only"))
+
+    TESTS_TO_RUN = create_tests()
+    # Only the named tests (watch.py reruns the ones a change affects)
+    if testnames is not None:
+        TESTS_TO_RUN = {k: v for k, v in TESTS_TO_RUN.items() if k in testnames}
 
     _verbose = (not GRADER_MODE)
     size_map: dict[str,int] = {}
@@ -468,9 +940,28 @@ def run(timeout=0,
     if results:
         results.add_extra("perf_calibration_time", calibration_time_sec)
         results.add_extra("tmpfs", tmpfs_ok);
+        results.add_extra("perf_advice", use_advice)
+        results.add_extra("perf_trace_syscalls", trace_syscalls)
+        results.add_extra("perf_environment", environment)
+        results.add_extra("perf_time_budget", time_budget)
+        results.add_extra("perf_subtract_startup", subtract_startup)
+        results.add_extra("perf_cgroup", None if CGROUPS is None else {
+            "controllers": sorted(CGROUPS.controllers),
+            "memory_max": CGROUPS.memory_max,
+            "pids_max": CGROUPS.pids_max,
+        })
 
 
-    runtests(TESTS_TO_RUN, size_map, res=results, check_correctness=check_correctness)
+    try:
+        runtests(TESTS_TO_RUN, size_map, res=results, check_correctness=check_correctness,
+                 trace_syscalls=trace_syscalls, stabilize=stabilize, time_budget=time_budget,
+                 subtract_startup=subtract_startup, baseline_cache=baseline_cache,
+                 baseline_max_age=0 if refresh_baseline else defaults.PERFORMANCE_BASELINE_MAX_AGE,
+                 incremental=incremental)
+    finally:
+        if CGROUPS is not None:
+            CGROUPS.close()
+            CGROUPS = None
 
     if WARN_TIME_TOO_SHORT:
         if results:
@@ -504,6 +995,27 @@ def main(input_args):
                         help="Calibration mode")
     parser.add_argument("--create-tmpfs", dest="create_tmpfs", action="store_const", const=True)
     parser.add_argument("--no-create-tmpfs", dest="create_tmpfs", action="store_const", const=False)
+    parser.add_argument("--no-advice", action="store_true",
+                        help="Run the test programs without their io300_advise hints")
+    parser.add_argument("--time-budget", type=float, default=defaults.PERFORMANCE_TIME_BUDGET,
+                        help="Seconds to spend on the tests; extra trials go to the least certain results")
+    parser.add_argument("--no-startup-correction", action="store_true",
+                        help="Decide pass or fail on the raw ratios, without subtracting startup time")
+    parser.add_argument("--no-stabilize", action="store_true",
+                        help="Don't pin the test programs to a core or rerun noisy trials")
+    parser.add_argument("--trace-syscalls", action="store_true",
+                        help="Also run each test program under io300_trace.so (stdio's under "
+                        "strace) and show histograms of its system calls")
+    parser.add_argument("--no-cgroups", action="store_true",
+                        help="Don't run the test programs in cgroups of their own")
+    parser.add_argument("--memory-max", type=str, default=defaults.PERFORMANCE_MEMORY_MAX,
+                        help="Kill a test program that uses more memory than this (e.g. 1G)")
+    parser.add_argument("--pids-max", type=int, default=defaults.PERFORMANCE_PIDS_MAX,
+                        help="Most processes and threads a test program may have")
+    parser.add_argument("--no-baseline-cache", action="store_true",
+                        help="Always run stdio, without reusing or saving its results")
+    parser.add_argument("--refresh-baseline", action="store_true",
+                        help="Run stdio again and replace its cached results")
 
     args = parser.parse_args(input_args)
 
@@ -519,6 +1031,17 @@ def main(input_args):
         results=results,
         try_tmpfs=create_tmpfs,
         calibration_mode=args.calibration_mode,
+        use_advice=(not args.no_advice),
+        trace_syscalls=args.trace_syscalls,
+        time_budget=args.time_budget,
+        subtract_startup=(defaults.PERFORMANCE_SUBTRACT_STARTUP
+                          and not args.no_startup_correction),
+        stabilize=(defaults.PERFORMANCE_STABILIZE and not args.no_stabilize),
+        use_cgroups=(defaults.PERFORMANCE_CGROUPS and not args.no_cgroups),
+        memory_max=args.memory_max,
+        pids_max=args.pids_max,
+        baseline_cache=None if args.no_baseline_cache else defaults.PERFORMANCE_BASELINE_CACHE,
+        refresh_baseline=args.refresh_baseline,
         check_correctness=(not args.skip_correctness_check))
 
 
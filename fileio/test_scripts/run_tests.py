@@ -12,6 +12,7 @@ from dataclasses import dataclass, field
 
 import correctness_test
 import performance_test
+import watch
 
 from performance_test import CALIBRATION_MODES, CALIBRATION_MODE_FREE, CALIBRATION_MODE_MAX
 
@@ -42,6 +43,28 @@ def main(input_args):
     parser.add_argument("--corr-no-tmpfs",  dest="corr_use_tmpfs", action="store_const", const=False)
     parser.add_argument("--perf-use-tmpfs", dest="perf_use_tmpfs", action="store_const", const=True)
     parser.add_argument("--perf-no-tmpfs",  dest="perf_use_tmpfs", action="store_const", const=False)
+    parser.add_argument("--perf-no-advice", action="store_true",
+                        help="(Performance tests only) Run the test programs without their io300_advise hints")
+    parser.add_argument("--perf-time-budget", type=float, default=defaults.PERFORMANCE_TIME_BUDGET,
+                        help="(Performance tests only) Seconds to spend on the tests; extra trials go to the least certain results")
+    parser.add_argument("--perf-no-startup-correction", action="store_true",
+                        help="(Performance tests only) Decide pass or fail on the raw ratios, without subtracting startup time")
+    parser.add_argument("--perf-no-stabilize", action="store_true",
+                        help="(Performance tests only) Don't pin the test programs to a core or rerun noisy trials")
+    parser.add_argument("--perf-trace-syscalls", action="store_true",
+                        help="(Performance tests only) Show histograms of each test program's system calls")
+    parser.add_argument("--perf-no-cgroups", action="store_true",
+                        help="(Performance tests only) Don't run the test programs in cgroups of their own")
+    parser.add_argument("--perf-memory-max", type=str, default=defaults.PERFORMANCE_MEMORY_MAX,
+                        help="(Performance tests only) Kill a test program that uses more memory than this (e.g. 1G)")
+    parser.add_argument("--perf-pids-max", type=int, default=defaults.PERFORMANCE_PIDS_MAX,
+                        help="(Performance tests only) Most processes and threads a test program may have")
+    parser.add_argument("--perf-no-baseline-cache", action="store_true",
+                        help="(Performance tests only) Always run stdio, without reusing or saving its results")
+    parser.add_argument("--perf-refresh-baseline", action="store_true",
+                        help="(Performance tests only) Run stdio again and replace its cached results")
+    parser.add_argument("--watch-no-perf", action="store_true",
+                        help="(Watch mode only) Only rerun the correctness tests after a change")
 
     parser.add_argument("test_group", type=str, default="all")
 
@@ -62,23 +85,16 @@ def main(input_args):
     if args.perf_use_tmpfs is not None:
         perf_use_tmpfs = args.perf_use_tmpfs
 
-    impls_checked = None
-    if test_group != "perf":
-        _corr_group = test_group
-        if test_group == "correctness":
-            _corr_group = "all"
-
-        correctness_test.run(test_group=_corr_group,
+    def run_correctness(test_group, results, testnames=None):
+        correctness_test.run(test_group=test_group,
                              seed=args.seed,
                              try_tmpfs=corr_use_tmpfs,
                              fuzz_test_repeats=args.fuzz_repeat,
                              grader_mode=args.grader,
+                             testnames=testnames,
                              results=results)
-        impls_checked = correctness_test.IMPLS_SEEN
 
-    perf_run = False
-    if test_group == "perf" or test_group == "all":
-        perf_run = True
+    def run_performance(results, testnames=None, incremental=False):
         performance_test.run(timeout=timeout,
                              file_size=args.perf_file_size,
                              grader_mode=args.grader,
@@ -86,8 +102,43 @@ def main(input_args):
                              calibration_mode=args.perf_calibration_mode,
                              try_tmpfs=perf_use_tmpfs,
                              check_correctness=perf_check_correctness,
+                             use_advice=(not args.perf_no_advice),
+                             trace_syscalls=args.perf_trace_syscalls,
+                             time_budget=args.perf_time_budget,
+                             subtract_startup=(defaults.PERFORMANCE_SUBTRACT_STARTUP
+                                               and not args.perf_no_startup_correction),
+                             stabilize=(defaults.PERFORMANCE_STABILIZE
+                                        and not args.perf_no_stabilize),
+                             use_cgroups=(defaults.PERFORMANCE_CGROUPS
+                                          and not args.perf_no_cgroups),
+                             memory_max=args.perf_memory_max,
+                             pids_max=args.perf_pids_max,
+                             baseline_cache=(None if args.perf_no_baseline_cache
+                                             else defaults.PERFORMANCE_BASELINE_CACHE),
+                             refresh_baseline=args.perf_refresh_baseline,
+                             testnames=testnames,
+                             incremental=incremental,
                              results=results)
 
+    if test_group == "watch":
+        return watch.run(lambda results, testnames: run_correctness("all", results, testnames),
+                         lambda results, testnames: run_performance(results, testnames, incremental=True),
+                         performance=(defaults.WATCH_PERFORMANCE and not args.watch_no_perf))
+
+    impls_checked = None
+    if test_group != "perf":
+        _corr_group = test_group
+        if test_group == "correctness":
+            _corr_group = "all"
+
+        run_correctness(_corr_group, results)
+        impls_checked = correctness_test.IMPLS_SEEN
+
+    perf_run = False
+    if test_group == "perf" or test_group == "all":
+        perf_run = True
+        run_performance(results)
+
     if not args.grader:
         order = correctness_test.TESTS_ORDER.copy()
         if perf_run:
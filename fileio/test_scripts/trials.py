@@ -0,0 +1,104 @@
+# trials.py - Spend a fixed amount of time on the trials that need it most
+#
+# With a time budget, the performance scripts do not give every
+# workload the same number of trials.  Each workload first gets
+# MIN_TRIALS.  After that, the next trial goes to the workload whose
+# result is least certain, and this goes on until the budget is spent:
+#
+#   1. a workload whose pass/fail verdict could still flip, i.e. the
+#      pass threshold lies within UNCERTAIN_CI confidence interval
+#      half-widths of its ratio (the closest one first), then
+#   2. the workload with the widest confidence interval, relative
+#      to its mean.
+#
+# Confidence intervals are 95% Student-t intervals.  The interval for
+# a ratio of two means comes from the delta method, where the relative
+# errors of the two means add in quadrature.
+
+import math
+import time
+
+MIN_TRIALS = 3
+UNCERTAIN_CI = 2.0
+
+# Two-sided 95% critical values of Student's t, by degrees of freedom
+_T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def t95(df):
+    if df < 1:
+        return math.inf
+    return _T95[df - 1] if df <= len(_T95) else 1.96
+
+
+def mean_ci(samples):
+    """Mean of samples and the half-width of its 95% confidence interval"""
+    n = len(samples)
+    mean = sum(samples) / n
+    if n < 2:
+        return mean, math.inf
+    var = sum((x - mean) ** 2 for x in samples) / (n - 1)
+    return mean, t95(n - 1) * math.sqrt(var / n)
+
+
+def percentile(samples, pct):
+    """The pct'th percentile of samples, interpolating between ranks"""
+    samples = sorted(samples)
+    rank = (len(samples) - 1) * pct / 100
+    lo = int(rank)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (rank - lo)
+
+
+def ratio_ci(numerator, denominator):
+    """mean(numerator) / mean(denominator), and its 95% CI half-width"""
+    num, num_hw = mean_ci(numerator)
+    den, den_hw = mean_ci(denominator)
+    if den <= 0:
+        return math.inf, math.inf
+    ratio = num / den
+    if math.isinf(num_hw) or math.isinf(den_hw):
+        return ratio, math.inf
+    rel = math.hypot(num_hw / num if num > 0 else 0.0, den_hw / den)
+    return ratio, ratio * rel
+
+
+def priority(trials, value, halfwidth, threshold=None, min_trials=MIN_TRIALS):
+    """
+    Sort key for how much a workload with `trials` trials so far, whose
+    result is `value` +/- `halfwidth`, needs another trial (higher sorts
+    first).  `threshold` is the value a pass/fail verdict depends on.
+    """
+    if trials < min_trials or math.isinf(halfwidth):
+        return (3, -trials)
+    if halfwidth == 0:
+        return (0, 0.0)
+    if threshold is not None:
+        distance = abs(value - threshold) / halfwidth
+        if distance < UNCERTAIN_CI:
+            return (2, -distance)
+    return (1, halfwidth / value if value > 0 else math.inf)
+
+
+class TrialBudget:
+    """A wall-clock budget, started when it is created"""
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def pick(self, candidates):
+        """
+        From (key, priority, estimated cost in seconds) tuples, the key
+        of the highest-priority candidate that fits in the time left,
+        or None if none does.
+        """
+        left = self.remaining()
+        fitting = [(prio, key) for key, prio, cost in candidates if cost <= left]
+        if not fitting:
+            return None
+        return max(fitting, key=lambda c: c[0])[1]
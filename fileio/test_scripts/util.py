@@ -2,6 +2,7 @@ import re
 import os
 import sys
 import json
+import shlex
 import argparse
 import tempfile
 import subprocess
@@ -38,11 +39,26 @@ def make_impl_check_msg(impls_seen):
 
 
 def dir_is_tmpfs(dir: str):
-    chk = subprocess.check_output("mount | grep {} || true".format(dir), shell=True, text=True)
-    if "tmpfs" in chk:
-        return True
-    else:
-        return False
+    with open("/proc/mounts", "r") as f:
+        for line in f:
+            fields = line.split()
+            if fields[1] == os.path.abspath(dir) and fields[2] == "tmpfs":
+                return True
+    return False
+
+
+def path_is_on_tmpfs(path: str):
+    """Whether path is on a tmpfs, whether or not it is the mount point"""
+    path = os.path.realpath(path)
+    mount, fstype = "", None
+    with open("/proc/mounts", "r") as f:
+        for line in f:
+            fields = line.split()
+            inside = path == fields[1] or path.startswith(fields[1].rstrip("/") + "/")
+            # Later mounts on the same point hide earlier ones
+            if inside and len(fields[1]) >= len(mount):
+                mount, fstype = fields[1], fields[2]
+    return fstype == "tmpfs"
 
 
 def tmpfs_warning_str():
@@ -51,11 +67,8 @@ def tmpfs_warning_str():
 
 
 def tmpfs_do_setup(prefix: str):
-    def _run(cmd):
-        subprocess.check_output(cmd, shell=True)
-
-    _run("mkdir -p {}".format(prefix))
-    _run("sudo mount -t tmpfs none {}".format(prefix))
+    os.makedirs(prefix, exist_ok=True)
+    subprocess.check_output(["sudo", "mount", "-t", "tmpfs", "none", prefix])
 
 
 def tmpfs_try_setup(prefix: str):
@@ -73,6 +86,333 @@ def tmpfs_try_setup(prefix: str):
     return ok
 
 
+# The harnesses run their commands without a shell and handle their
+# files in-process:  a fork of /bin/sh for every rm, touch or dd adds up
+# to more than a small test takes on a loaded machine.
+def split_command(cmd: str):
+    """
+    argv and environment (None for ours) to run cmd with, without a
+    shell.  Leading NAME=value words, as in "CFLAGS=-O2 make", go in the
+    environment; nothing else of the shell's syntax is understood.
+    """
+    words = shlex.split(cmd)
+    env = None
+    while words and re.match(r"[A-Za-z_][A-Za-z0-9_]*=", words[0]):
+        name, _, value = words.pop(0).partition("=")
+        env = dict(os.environ if env is None else env, **{name: value})
+    return words, env
+
+
+def remove_files(*paths):
+    """rm -f"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def empty_file(path):
+    """Create path, or truncate it if it exists"""
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+
+
+def random_file(path, size):
+    """Replace path with size random bytes"""
+    with open(path, "wb") as f:
+        while size > 0:
+            chunk = os.urandom(min(size, 1 << 20))
+            f.write(chunk)
+            size -= len(chunk)
+
+
+def first_difference(path1, path2):
+    """Offset of the first byte where the files differ, or None if they are the same"""
+    offset = 0
+    with open(path1, "rb") as f1, open(path2, "rb") as f2:
+        while True:
+            a = f1.read(1 << 16)
+            b = f2.read(1 << 16)
+            if a != b:
+                return offset + next((i for i, (x, y) in enumerate(zip(a, b)) if x != y),
+                                     min(len(a), len(b)))
+            if not a:
+                return None
+            offset += len(a)
+
+
+# Test programs report the io300_stats of every file they close to the
+# file descriptor named in IO300_STATS_FD, as long as IO300_TEST_RUN is
+# also set (see io300_stats.c), one line per file:
+#   io300_stats hits=1021 misses=3 refills=3 ...
+STATS_FD_ENV = "IO300_STATS_FD"
+STATS_FIELDS = ["hits", "misses", "refills", "flushes",
+                "read_calls", "write_calls", "seek_calls",
+                "bytes_read", "bytes_written"]
+
+
+def parse_stats(text: str):
+    """Add up the io300_stats lines in text; returns None if there are none"""
+    total = None
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 0 or parts[0] != "io300_stats":
+            continue
+        if total is None:
+            total = {key: 0 for key in STATS_FIELDS}
+            total["files"] = 0
+        total["files"] += 1
+        for part in parts[1:]:
+            key, _, value = part.partition("=")
+            if key in STATS_FIELDS and value.isdigit():
+                total[key] += int(value)
+    return total
+
+
+def _fmt_bytes(n):
+    for unit in ["B", "KiB", "MiB"]:
+        if n < 1024:
+            return "{:.4g}{}".format(n, unit)
+        n /= 1024
+    return "{:.4g}GiB".format(n)
+
+
+def format_stats(stats):
+    if stats is None:
+        return "io300 stats: none reported"
+    return ("io300 stats: {hits} hits, {misses} misses, {refills} refills, {flushes} flushes; "
+            "syscalls: {read_calls} read, {write_calls} write, {seek_calls} lseek "
+            "({bytes_read} read, {bytes_written} written)").format(
+                **{**stats,
+                   "bytes_read": _fmt_bytes(stats["bytes_read"]),
+                   "bytes_written": _fmt_bytes(stats["bytes_written"])})
+
+
+class StatsCollector:
+    """
+    Collects the io300 statistics reported by the test programs.  While
+    started, IO300_STATS_FD names a temporary file; subprocesses must
+    be given pass_fds() so the descriptor stays open in the test program.
+    """
+    def __init__(self):
+        self.file = None
+
+    def start(self):
+        self.file = tempfile.TemporaryFile(buffering=0)
+        os.environ[STATS_FD_ENV] = str(self.file.fileno())
+
+    def stop(self):
+        os.environ.pop(STATS_FD_ENV, None)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def pass_fds(self):
+        return (self.file.fileno(),) if self.file is not None else ()
+
+    def take(self):
+        """Statistics reported since the last take(), or None if there were none"""
+        if self.file is None:
+            return None
+        fd = self.file.fileno()
+        os.lseek(fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        # The test programs share our file offset, so rewind it too
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        return parse_stats(b"".join(chunks).decode("utf-8", errors="replace"))
+
+
+# With TRACE_LIB preloaded, a test program writes histograms of the
+# file system calls it made to the file named in IO300_TRACE_OUT when it
+# exits (see io300_trace.c), one line of JSON per process.
+TRACE_LIB = "./io300_trace.so"
+TRACE_OUT_ENV = "IO300_TRACE_OUT"
+TRACE_HISTOGRAMS = ["size", "distance", "time"]
+
+
+def trace_env(out_path):
+    """Environment for running a test program under the trace library"""
+    env = os.environ.copy()
+    env["LD_PRELOAD"] = TRACE_LIB
+    env[TRACE_OUT_ENV] = out_path
+    # The sanitizers insist on being loaded first; the trace library
+    # does not need them to be
+    asan_options = env.get("ASAN_OPTIONS", "")
+    env["ASAN_OPTIONS"] = ":".join(filter(None, [asan_options, "verify_asan_link_order=0"]))
+    # Reports on the stats descriptor would show up as writes
+    env.pop(STATS_FD_ENV, None)
+    return env
+
+
+def parse_trace(text: str):
+    """Add up the trace lines in text; returns None if there are none"""
+    total = None
+    for line in text.splitlines():
+        try:
+            calls = json.loads(line)["calls"]
+        except (ValueError, KeyError):
+            continue
+        if total is None:
+            total = {}
+        for name, data in calls.items():
+            entry = total.setdefault(name, {"calls": 0, "errors": 0, "bytes": 0, "nsec": 0,
+                                            **{h: {} for h in TRACE_HISTOGRAMS}})
+            for key in ["calls", "errors", "bytes", "nsec"]:
+                entry[key] += data[key]
+            for h in TRACE_HISTOGRAMS:
+                for lo, hi, count in data[h]:
+                    entry[h][(lo, hi)] = entry[h].get((lo, hi), 0) + count
+    if total is None:
+        return None
+    # Back to sorted [lo, hi, count] lists, as in the trace files
+    for entry in total.values():
+        for h in TRACE_HISTOGRAMS:
+            entry[h] = [[lo, hi, count] for (lo, hi), count in sorted(entry[h].items())]
+    return total
+
+
+# The C library makes stdio's system calls itself, where the trace
+# library cannot see them, so stdio is traced with strace instead and
+# its log added up into the same histograms.  The pattern of a call in
+# an strace log, the files the C library opens for itself, and the
+# calls to log (by the name the trace library gives them) follow.
+STRACE_CALL = re.compile(r'^(?:\d+\s+)?(\w+)\((.*)\)\s+=\s+(-?\d+)')
+STRACE_SKIP_PATH = re.compile(r'(\.so(\.\d+)*|/ld\.so\.cache|^/proc/.*|^/sys/.*)$')
+STRACE_TIME = re.compile(r'<(\d+\.\d+)>\s*$')
+STRACE_CALLS = {"read": "read", "write": "write", "lseek": "lseek",
+                "pread64": "pread", "pwrite64": "pwrite",
+                "preadv": "preadv", "pwritev": "pwritev"}
+
+
+def strace_command(argv, out_path):
+    """argv run under strace, logging its file system calls to out_path"""
+    return ["strace", "-f", "-T", "-o", out_path,
+            "-e", "trace=" + ",".join(["openat", "close"] + list(STRACE_CALLS))] + argv
+
+
+def strace_args(args):
+    """The arguments of an strace call, split at the commas"""
+    # Drop the buffer contents, which may contain commas
+    args = re.sub(r'"(?:[^"\\]|\\.)*"(\.\.\.)?', '""', args)
+    args = re.sub(r'\[.*?\]', '[]', args)
+    return [a.strip() for a in args.split(",")]
+
+
+def _bucket(v):
+    """Which log2 bucket v goes in, as in io300_trace.c"""
+    k = v.bit_length()
+    return (0, 0) if k == 0 else (1 << (k - 1), (1 << k) - 1)
+
+
+def parse_strace(text: str):
+    """
+    Add up the calls in an `strace -T` log into the histograms the trace
+    library writes (see parse_trace); returns None if there are none.
+    strace times calls to the microsecond and adds its own overhead, so
+    the time histogram runs a little high.
+    """
+    total = {name: {"calls": 0, "errors": 0, "bytes": 0, "nsec": 0,
+                    **{h: {} for h in TRACE_HISTOGRAMS}} for name in STRACE_CALLS.values()}
+    # File position and where the last call ended, by descriptor
+    positions, ends = {}, {}
+    skipped = set()
+    seen = False
+    for line in text.splitlines():
+        m = STRACE_CALL.match(line)
+        if m is None:
+            continue
+        seen = True
+        call, raw, ret = m.group(1), m.group(2), int(m.group(3))
+        args = strace_args(raw)
+        if call == "openat":
+            path = re.search(r'"((?:[^"\\]|\\.)*)"', raw)
+            if ret >= 0:
+                positions[ret] = ends[ret] = 0
+                skipped.discard(ret)
+                if path and STRACE_SKIP_PATH.search(path.group(1)):
+                    skipped.add(ret)
+            continue
+        if not args[0].isdigit():
+            continue
+        fd = int(args[0])
+        if call == "close":
+            positions.pop(fd, None)
+            ends.pop(fd, None)
+            skipped.discard(fd)
+            continue
+        if call not in STRACE_CALLS or fd in skipped:
+            continue
+
+        name = STRACE_CALLS[call]
+        if name in ("read", "write"):
+            size, start = int(args[2]), positions.get(fd, 0)
+        elif name in ("pread", "pwrite"):
+            size, start = int(args[2]), int(args[3])
+        elif name in ("preadv", "pwritev"):
+            size = sum(int(n) for n in re.findall(r'iov_len=(\d+)', raw))
+            start = int(args[-1])
+        else:
+            size, start = max(ret, 0), ret
+
+        t = STRACE_TIME.search(line)
+        nsec = round(float(t.group(1)) * 1e9) if t else 0
+        entry = total[name]
+        entry["calls"] += 1
+        entry["nsec"] += nsec
+        for h, v in [("time", nsec), ("size", size)]:
+            entry[h][_bucket(v)] = entry[h].get(_bucket(v), 0) + 1
+        if ret < 0:
+            entry["errors"] += 1
+            continue
+        if name != "lseek":
+            entry["bytes"] += ret
+        if name not in ("read", "write"):
+            distance = start - ends.get(fd, 0)
+            lo, hi = _bucket(abs(distance))
+            bucket = (-hi, -lo) if distance < 0 else (lo, hi)
+            entry["distance"][bucket] = entry["distance"].get(bucket, 0) + 1
+        ends[fd] = ret if name == "lseek" else start + ret
+        if name in ("read", "write", "lseek"):
+            positions[fd] = ends[fd]
+    if not seen:
+        return None
+    for entry in total.values():
+        for h in TRACE_HISTOGRAMS:
+            entry[h] = [[lo, hi, count] for (lo, hi), count in sorted(entry[h].items())]
+    return total
+
+
+def _fmt_bucket(lo, hi, unit=""):
+    if lo == hi:
+        return "{}{}".format(lo, unit)
+    return "{}..{}{}".format(lo, hi, unit)
+
+
+def format_trace(trace, indent="\t"):
+    """Lines describing a parsed trace, one per call and histogram"""
+    calls = {name: data for name, data in (trace or {}).items() if data["calls"] > 0}
+    if len(calls) == 0:
+        return [indent + "syscall trace: no calls seen"]
+    lines = []
+    for name, data in calls.items():
+        lines.append("{}{}: {} calls, {}, {:.3g}ms{}".format(
+            indent, name, data["calls"], _fmt_bytes(data["bytes"]), data["nsec"] / 1e6,
+            ", {} errors".format(data["errors"]) if data["errors"] else ""))
+        for h in TRACE_HISTOGRAMS:
+            if len(data[h]) == 0:
+                continue
+            unit = "ns" if h == "time" else ""
+            lines.append("{}    {:<8} {}".format(indent, h, ", ".join(
+                "{}: {}".format(_fmt_bucket(lo, hi, unit), count) for lo, hi, count in data[h])))
+    return lines
+
+
 @dataclass
 class Test:
     name: str
@@ -0,0 +1,232 @@
+# watch.py - Rebuild and rerun the affected tests whenever a source changes
+#
+# `make check` and `make perf` start from a clean tree every time:  they
+# build every program, run every test and (cache permitting) time stdio
+# again.  `run_tests.py watch` stays running instead.  It builds the
+# tree once and runs all the tests, then waits for a change to one of
+# the sources (with inotify, or by polling their modification times
+# where that is not available).
+#
+# After each change, plain `make` rebuilds what depends on it and
+# nothing else, and only the tests whose programs make rebuilt run
+# again:  changing test_programs/block_cat.c reruns the block_cat tests,
+# changing impl/student.c or test_helpers.c reruns them all.  The
+# performance tests run after the correctness tests, if those passed,
+# and reuse stdio's cached results (see baseline.py).  Each test's
+# result is printed as soon as it finishes.
+
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import subprocess
+
+import correctness_test
+import performance_test
+import defaults
+
+from util import TestResults, WARNING, FAIL, ENDC
+
+# Directories whose sources the build uses
+WATCH_DIRS = [".", "impl", "test_programs", "test_programs/reference"]
+WATCH_NAMES = ["Makefile", "defaults.mk"]
+WATCH_SUFFIXES = (".c", ".h")
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+IN_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _is_source(name):
+    return name in WATCH_NAMES or name.endswith(WATCH_SUFFIXES)
+
+
+class Watcher:
+    """
+    wait() blocks until at least one source changes and returns the
+    paths that changed, once no more changes have come in for
+    WATCH_SETTLE_TIME seconds (an editor may write a file in steps, or
+    several files at once).
+    """
+    def __init__(self, dirs):
+        self.dirs = [d for d in dirs if os.path.isdir(d)]
+        self.fd = None
+        self.watches = {}
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+            for d in self.dirs:
+                wd = libc.inotify_add_watch(fd, d.encode(), mask)
+                if wd < 0:
+                    os.close(fd)
+                    raise OSError(ctypes.get_errno(), "inotify_add_watch")
+                self.watches[wd] = d
+            self.fd = fd
+        except (OSError, AttributeError):
+            # Not Linux:  compare modification times instead
+            self.mtimes = self._scan()
+
+    def method(self):
+        return "inotify" if self.fd is not None else "polling"
+
+    def _scan(self):
+        mtimes = {}
+        for d in self.dirs:
+            for name in os.listdir(d):
+                path = os.path.join(d, name)
+                if _is_source(name) and os.path.isfile(path):
+                    mtimes[path] = os.stat(path).st_mtime_ns
+        return mtimes
+
+    def _poll(self, timeout):
+        """Paths that changed within timeout seconds (None:  no limit)"""
+        if self.fd is None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                mtimes = self._scan()
+                changed = {p for p in mtimes.keys() | self.mtimes.keys()
+                           if mtimes.get(p) != self.mtimes.get(p)}
+                self.mtimes = mtimes
+                if changed or (deadline is not None and time.monotonic() >= deadline):
+                    return changed
+                time.sleep(defaults.WATCH_POLL_INTERVAL)
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        buf = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(buf):
+            wd, _, _, length = IN_EVENT_HEADER.unpack_from(buf, offset)
+            offset += IN_EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if wd in self.watches and _is_source(name):
+                changed.add(os.path.join(self.watches[wd], name))
+        return changed
+
+    def wait(self):
+        changed = set()
+        while not changed:
+            changed = self._poll(None)
+        while True:
+            more = self._poll(defaults.WATCH_SETTLE_TIME)
+            if not more:
+                return {os.path.normpath(p) for p in changed}
+            changed |= more
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def build():
+    """Run make; returns True if everything built"""
+    sp = subprocess.run(["make"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if sp.returncode != 0:
+        print(f"{FAIL}build failed:{ENDC}")
+        print(str(sp.stdout, encoding="utf-8", errors="backslashreplace"))
+        return False
+    return True
+
+
+def _programs():
+    """The program each correctness and performance test runs, by test name"""
+    tests = {}
+    tests.update(correctness_test.create_unit_tests())
+    tests.update(correctness_test.create_fuzz_tests([0]))
+    tests.update(correctness_test.create_e2e_tests())
+    correctness = {name: os.path.basename(t.bin_path()) for name, t in tests.items()}
+    performance = {name: os.path.basename(t.bin_path())
+                   for name, t in performance_test.create_tests().items()}
+    return correctness, performance
+
+
+def _mtimes(programs):
+    mtimes = {}
+    for program in programs:
+        try:
+            mtimes[program] = os.stat(program).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[program] = None
+    return mtimes
+
+
+def run(run_correctness, run_performance, performance=True):
+    """
+    Watch until interrupted.  run_correctness(results, testnames) and
+    run_performance(results, testnames) run the named tests with the
+    options run_tests.py was given.
+    """
+    watcher = Watcher(WATCH_DIRS)
+    # Whatever is built may have come from another implementation or
+    # from the performance tests' flags, which make cannot tell apart
+    subprocess.run(["make", "clean"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    seen = {}
+    try:
+        while True:
+            if build():
+                correctness, perf = _programs()
+                built = _mtimes(set(correctness.values()) | set(perf.values()))
+                rebuilt = {p for p, mtime in built.items() if mtime != seen.get(p)}
+                if rebuilt:
+                    _rerun(rebuilt, correctness, perf, run_correctness,
+                           run_performance if performance else None)
+                    # The performance tests remove what they built
+                    build()
+                else:
+                    print("nothing was rebuilt, so there is nothing to rerun")
+                seen = _mtimes(built)
+            print("\n{}watching {} for changes ({}), Ctrl-C to stop{}".format(
+                WARNING, ", ".join(watcher.dirs), watcher.method(), ENDC), flush=True)
+            changed = watcher.wait()
+            print("\n" + "=" * 67)
+            print("changed: {}".format(", ".join(sorted(changed))))
+    except KeyboardInterrupt:
+        print("\nstopped watching")
+    finally:
+        watcher.close()
+    return 0
+
+
+def _rerun(rebuilt, correctness, perf, run_correctness, run_performance):
+    results = TestResults()
+    testnames = [name for name, program in correctness.items() if program in rebuilt]
+    perf_testnames = [name for name, program in perf.items() if program in rebuilt]
+    print("rebuilt {}; rerunning {} correctness and {} performance tests".format(
+        ", ".join(sorted(rebuilt)), len(testnames),
+        len(perf_testnames) if run_performance is not None else 0), flush=True)
+
+    # A change that breaks the harness's assumptions (a missing
+    # program, say) ends that run, not the watch
+    try:
+        if testnames:
+            run_correctness(results, testnames)
+        if run_performance is not None and perf_testnames:
+            if all(t.is_passing() for t in results.tests):
+                run_performance(results, perf_testnames)
+            else:
+                print("{}skipping the performance tests until the correctness tests pass{}"
+                      .format(WARNING, ENDC))
+    except SystemExit:
+        print(f"{FAIL}the test run stopped early{ENDC}")
+    finally:
+        # The performance tests leave SIGINT at SIG_DFL, which would end
+        # the watch without cleaning up
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    order = correctness_test.TESTS_ORDER + ["performance"]
+    results.show_summary(order, impls_seen=correctness_test.IMPLS_SEEN)
+    sys.stdout.flush()